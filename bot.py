@@ -5,6 +5,8 @@ from discord.ui import Select, View, Button, Modal, TextInput
 import os
 from dotenv import load_dotenv
 from database import db
+from models import local_time
+from metrics import query_metrics, delivery_metrics, render_gauges, render_histogram
 import logging
 from datetime import datetime, timedelta
 import asyncio
@@ -44,6 +46,17 @@ intents.members = True
 async def health_check(request):
     return web.Response(text="S.O.L.O System is Online 🟢", content_type='text/plain')
 
+async def metrics_handler(request):
+    """إحصائيات الاستعلامات والذاكرة المؤقتة بصيغة Prometheus"""
+    body = (
+        query_metrics.render()
+        + delivery_metrics.render()
+        + render_gauges("player_cache", "Player row cache statistics.", db.player_cache.stats())
+        + render_gauges("db_executor", "Database thread pool state.", db.executor.stats())
+        + render_histogram("db_executor_queue_wait_seconds", "Time queries wait for a free database thread.", db.executor.queue_wait)
+    )
+    return web.Response(text=body, content_type='text/plain')
+
 def generate_otp(length=6):
     chars = string.digits
     return ''.join(secrets.choice(chars) for _ in range(length))
@@ -67,7 +80,7 @@ async def handle_login_request(request):
             'discord_id': str(discord_id),
             'otp_code': otp,
             'expires_at': expiry
-        }).execute())
+        }).execute(), table='app_auth_sessions', op='upsert')
 
         try:
             user = await bot.fetch_user(int(discord_id))
@@ -87,6 +100,7 @@ async def handle_login_request(request):
 async def start_web_server():
     app = web.Application()
     app.router.add_get('/', health_check)
+    app.router.add_get('/metrics', metrics_handler)
     app.router.add_post('/api/login', handle_login_request)
     runner = web.AppRunner(app)
     await runner.setup()
@@ -100,7 +114,10 @@ class SoloLevelingBot(commands.Bot):
         super().__init__(
             command_prefix="!",
             intents=intents,
-            help_command=None
+            help_command=None,
+            # انتظار مسار أطول من هذا يرفع RateLimited بدل تعليق الطلب (30 ث أقل قيمة يقبلها discord.py)،
+            # وخط الإرسال يلتقطه وينتظر retry_after ثم يعيد المحاولة
+            max_ratelimit_timeout=30.0
         )
     
     async def setup_hook(self):
@@ -118,65 +135,11 @@ class SoloLevelingBot(commands.Bot):
         except Exception as e:
             logger.error(f"❌ فشل تحميل الإضافات: {e}")
 
-        # --- 3. استعادة البوابات النشطة (Portals Persistence) ---
-        try:
-            from portals import PortalJoinView, PortalActiveView, PrivatePortalView
-            
-            active_portals = await db._execute_async(
-                lambda: db.client.table('portal_history')
-                .select('*, quest:system_portal_quests(*)')
-                .in_('status', ['recruiting', 'active'])
-                .execute()
-            )
-            
-            for p in active_portals.data:
-                quest = p['quest']
-                h_id = p['id']
-                participants = p.get('participants_ids', [])
-                
-                if p['status'] == 'recruiting':
-                    if p.get('is_private'):
-                        view = PrivatePortalView(quest, h_id, p.get('owner_id'))
-                    else:
-                        view = PortalJoinView(quest, h_id)
-                else: # status == active
-                    view = PortalActiveView(quest, h_id, participants)
-                
-                self.add_view(view)
-            
-            logger.info(f"✅ تم استعادة {len(active_portals.data)} بوابة نشطة")
-        except Exception as e:
-            logger.error(f"❌ خطأ في استعادة البوابات: {e}")
-
-        # --- 4. استعادة لوحات المهام اليومية (Dashboards Persistence) ---
-        try:
-            from quest_engine import QuestDashboard
-            import task_logic
-            
-            # جلب جميع اللاعبين غير المعطلين (نشط، مريض، مسافر...)
-            active_players = await db._execute_async(
-                lambda: db.client.table('players')
-                .select('*')
-                .neq('status', 'inactive')
-                .execute()
-            )
-            
-            restored_count = 0
-            for p in active_players.data:
-                # إعادة حساب المهام لنعرف شكل اللوحة الخاصة به
-                assigned_tasks = task_logic.get_daily_tasks_for_player(p)
-                if assigned_tasks:
-                    # ✅ النسخة الصحيحة: تمرير discord_id
-                    view = QuestDashboard(p['id'], p['discord_id'], assigned_tasks)
-                    self.add_view(view)
-                    restored_count += 1
-            
-            logger.info(f"✅ تم استعادة لوحات المهام لـ {restored_count} صياد")
-            
-        except Exception as e:
-            logger.error(f"❌ خطأ في استعادة لوحات المهام: {e}")
+        # --- 3. الأزرار الدائمة (البوابات ولوحات المهام) ---
+        # لا شيء يُستعاد هنا: كل إضافة تسجل موجهاً واحداً (DynamicItem) يقرأ المعرف من custom_id
+        # ويبني الـ View عند أول ضغطة، فزمن التشغيل والذاكرة لا يزيدان مع عدد اللاعبين
 
-        # --- 5. مزامنة الأوامر (مرة واحدة فقط) ---
+        # --- 4. مزامنة الأوامر (مرة واحدة فقط) ---
         # ملاحظة: يفضل تعطيل هذا الجزء واستخدام !sync يدوياً لتجنب Rate Limit
         # لكن سأتركه لك كما طلبت (نسخة واحدة فقط)
         try:
@@ -647,24 +610,18 @@ async def profile_command(interaction: discord.Interaction):
             .select('image_url')
             .eq('rank_name', player['rank'])
             .eq('gender', player['gender'])
-            .execute()
+            .execute(),
+            table='system_rank_images', op='select'
         )
         
         # 3. جلب المعدات النشطة حالياً (Equipped Items) مع بياناتها الكاملة
-        equipment_query = await db._execute_async(
-            lambda: db.client.table('player_inventory')
-            .select('*, item:system_shop_items(name, rarity, type, image_url, stats)')
-            .eq('player_id', player['id'])
-            .eq('is_equipped', True)
-            .execute()
-        )
+        gear_data = await db.get_player_inventory(player['id'], equipped_only=True)
 
         # 4. استدعاء محرك توليد الصور
         from image_gen import ProfileGenerator
         gen = ProfileGenerator()
         
         avatar_url = avatar_query.data[0]['image_url'] if avatar_query.data else None
-        gear_data = equipment_query.data if equipment_query.data else []
 
         # توليد الصورة في الذاكرة
         image_buffer = await gen.generate(player, avatar_url, gear_data)
@@ -690,39 +647,21 @@ async def active_buffs_command(interaction: discord.Interaction):
     now = datetime.now()
     now_iso = now.isoformat()
 
-    # 2. استعلام لجلب البفات التي لم تنتهِ بعد
+    # 2. استعلام لجلب البفات التي لم تنتهِ بعد (expires_at محول مسبقاً إلى datetime)
     # نستخدم التحقق البرمجي لاحقاً لضمان الدقة القصوى مع التوقيت
-    res = await db._execute_async(lambda: db.client.table('player_buffs')
-        .select('*')
-        .eq('player_id', player['id'])
-        .execute())
+    buffs = await db.get_active_buffs(player['id'])
 
-    if not res.data:
+    if not buffs:
         await interaction.followup.send("🧊 لا توجد تأثيرات نشطة حالياً. استخدم بعض الجرعات من حقيبتك!", ephemeral=True)
         return
 
     embed = discord.Embed(title="✨ التأثيرات والمضاعفات النشطة", color=discord.Color.gold())
     active_count = 0
 
-    for buff in res.data:
+    for buff in buffs:
         try:
-            raw_expiry = buff['expires_at'].replace('Z', '+00:00')
-            if '.' in raw_expiry:
-                main_part, remainder = raw_expiry.split('.')
-                tz_sign = '+' if '+' in remainder else '-' if '-' in remainder else None
-                if tz_sign:
-                    ms_part, tz_part = remainder.split(tz_sign, 1)
-                    ms_part = (ms_part + "000000")[:6]
-                    raw_expiry = f"{main_part}.{ms_part}{tz_sign}{tz_part}"
-                else:
-                    ms_part = (remainder + "000000")[:6]
-                    raw_expiry = f"{main_part}.{ms_part}"
-
-            expiry_aware = datetime.fromisoformat(raw_expiry)
-            expiry_naive = expiry_aware.astimezone().replace(tzinfo=None)
-
             # حساب الوقت المتبقي
-            remaining = expiry_naive - now
+            remaining = local_time(buff['expires_at']) - now
             
             # عرض فقط التأثيرات التي لم تنتهِ فعلياً
             if remaining.total_seconds() > 0:
@@ -870,13 +809,10 @@ async def give_command(interaction: discord.Interaction, player: discord.Member,
     # تحويل اسم المورد إلى اسم العمود الصحيح في قاعدة البيانات
     db_column = "current_energy" if resource.value == "energy" else resource.value
     
-    target_player = await db.get_player(str(player.id))
-    if target_player:
-        current_val = target_player.get(db_column, 0)
-        # التأكد من أن القيمة لا تصبح سالبة (في حال كان الـ amount سالباً)
-        new_val = max(0, current_val + amount)
-        
-        await db.update_player(str(player.id), {db_column: new_val})
+    # إضافة ذرية داخل السيرفر مع التأكد من أن القيمة لا تصبح سالبة (في حال كان الـ amount سالباً)
+    updated = await db.increment_player(str(player.id), {db_column: amount}, floor=0)
+    if updated:
+        new_val = updated.get(db_column, 0)
         await interaction.followup.send(f"✅ تم تعديل **{resource.name}** لـ {player.mention}. القيمة الجديدة: **{new_val:,}**")
         
         # إرسال تنبيه للاعب في الخاص (اختياري)
@@ -899,7 +835,8 @@ async def leaderboard_command(interaction: discord.Interaction):
         .select('username, rank, active_title, total_level, total_xp')
         .order('total_level', desc=True)
         .order('total_xp', desc=True)
-        .limit(10).execute()
+        .limit(10).execute(),
+        table='players', op='select'
     )
     
     if not res.data:
@@ -1096,7 +1033,8 @@ async def my_penalties_command(interaction: discord.Interaction):
         .select('*')
         .eq('player_id', player['id'])
         .eq('status', 'pending')
-        .execute()
+        .execute(),
+        table='penalties', op='select'
     )
     
     if not penalties.data:
@@ -1120,7 +1058,7 @@ async def reset_me_command(interaction: discord.Interaction):
         async def confirm(self, i: discord.Interaction, b: discord.ui.Button):
             if i.user.id != interaction.user.id: 
                 return
-            await db.client.table('players').delete().eq('discord_id', str(i.user.id)).execute()
+            await db.delete_player(str(i.user.id))
             await i.response.send_message("✅ تم مسح جميع بياناتك من السجلات. يمكنك البدء من جديد عبر `/start`.", ephemeral=True)
             
     await interaction.response.send_message("⚠️ **تحذير:** هل أنت متأكد من رغبتك في حذف حسابك؟ لا يمكن التراجع عن هذا الإجراء.", view=Confirm(), ephemeral=True)
@@ -1137,17 +1075,10 @@ async def career_command(interaction: discord.Interaction):
         await interaction.followup.send("❌ لم يتم العثor على بياناتك، سجل أولاً!", ephemeral=True)
         return
 
-    # --- معالجة التاريخ لضمان التوافق ومنع أخطاء Naive/Aware ---
+    # --- created_at محول مسبقاً إلى datetime، نقارنه بالتوقيت المحلي للبوت ---
     try:
-        # تنظيف صيغة التاريخ القادمة من Supabase
-        created_str = player['created_at'].replace('Z', '').split('.')[0]
-        created_dt = datetime.fromisoformat(created_str)
-        
-        # إزالة المنطقة الزمنية للمقارنة مع utcnow
-        if created_dt.tzinfo is not None:
-            created_dt = created_dt.replace(tzinfo=None)
-        
-        days_joined = (datetime.utcnow() - created_dt).days
+        created_dt = local_time(player['created_at'])
+        days_joined = (datetime.now() - created_dt).days
         join_date = created_dt.strftime("%Y-%m-%d")
         
     except Exception as e:
@@ -1196,15 +1127,11 @@ async def show_aspect_status(interaction: discord.Interaction, category: str):
     
     # 3. جلب الـ Buffs النشطة
     now = datetime.now()
-    buffs_res = await db._execute_async(lambda: db.client.table('player_buffs')
-        .select('*')
-        .eq('player_id', player['id'])
-        .gt('expires_at', now.isoformat())
-        .execute())
+    buffs = await db.get_active_buffs(player['id'])
     
     active_boost = 0
     boost_text = ""
-    for buff in buffs_res.data:
+    for buff in buffs:
         if category in buff['buff_type'] or "all" in buff['buff_type']:
             active_boost += int(buff['value'] * 100)
     
@@ -1236,6 +1163,19 @@ async def show_aspect_status(interaction: discord.Interaction, category: str):
     if xp_needed == 0: xp_display = "`MAX LEVEL REACHED`"
         
     embed.add_field(name="📈 شريط التقدم", value=f"{progress_bar}\n{xp_display}{boost_text}", inline=False)
+
+    # 5. تقدم اليوم في هذا الجانب (ملخص اليوم يتحدث مع كل مهمة تُسجل)
+    today_tasks = [tid for tid, info in task_logic.get_daily_tasks_for_player(player).items()
+                   if info.get('category') == category or (category == "freedom" and info.get('category') == "work")]
+    if today_tasks:
+        progress = await db.get_daily_progress(player['id'], now.date().isoformat())
+        done_today = sum(1 for tid in today_tasks if progress.is_completed(tid))
+        embed.add_field(
+            name="📅 إنجاز اليوم",
+            value=f"{draw_progress_bar(done_today, len(today_tasks), length=8)} ({done_today}/{len(today_tasks)})"
+                  f"\n`+{progress.category_xp.get(category, 0):,} XP`",
+            inline=False
+        )
     embed.set_footer(text=f"نظام S.O.L.O • {cat_name}")
 
     await interaction.followup.send(embed=embed)
@@ -0,0 +1,164 @@
+# cache.py
+import copy
+import time
+from collections import OrderedDict
+
+from models import Player
+
+
+class TTLCache:
+    """
+    ذاكرة مؤقتة داخل العملية: كل عنصر ينتهي بعد ttl ثانية،
+    وعند امتلاء السعة يُطرد الأقدم استخداماً (LRU).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """قراءة بدون تحديث العدادات أو ترتيب الاستخدام"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class LRUCache:
+    """
+    آخر العناصر استخداماً بدون انتهاء صلاحية (مثل لوحات المهام المفتوحة حالياً)،
+    وعند امتلاء السعة يُطرد الأقدم استخداماً ويُستدعى له on_evict(key, value) إن وجد.
+    """
+
+    def __init__(self, maxsize: int = 512, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        value = self._data.get(key, default)
+        if key in self._data:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        old = self._data.pop(key, None)
+        self._data[key] = value
+        if old is not None and old is not value and self.on_evict:
+            self.on_evict(key, old)
+        while len(self._data) > self.maxsize:
+            evicted_key, evicted = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "evictions": self.evictions}
+
+
+class PlayerCache:
+    """
+    ذاكرة صفوف اللاعبين بمفتاحين: discord_id و الـ UUID (players.id).
+    القراءة تعيد نسخة مستقلة حتى لا يعدّل أي View الصف المخزن بالخطأ.
+    الصفوف تُخزن كـ Player (تواريخ محولة مرة واحدة) مهما كان شكل الصف المُمرر.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 60.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_by_discord(self, discord_id: str):
+        row = self._cache.get(("discord", str(discord_id)))
+        return copy.deepcopy(row) if row is not None else None
+
+    def get_by_uuid(self, player_id: str):
+        row = self._cache.get(("uuid", str(player_id)))
+        return copy.deepcopy(row) if row is not None else None
+
+    def put(self, row: dict):
+        if not row:
+            return
+        stored = Player(copy.deepcopy(dict(row)))
+        if stored.get("discord_id") is not None:
+            self._cache.set(("discord", str(stored["discord_id"])), stored)
+        if stored.get("id") is not None:
+            self._cache.set(("uuid", str(stored["id"])), stored)
+
+    def patch(self, player_id: str, fields: dict):
+        """دمج أعمدة محدثة في الصف المخزن (إن وجد) بدون استعلام جديد"""
+        row = self._cache.peek(("uuid", str(player_id)))
+        if row is None:
+            return
+        patched = row.copy()
+        patched.update(fields)
+        self.put(patched)
+
+    def invalidate(self, discord_id: str = None, player_id: str = None):
+        """حذف اللاعب بكلا المفتاحين (يكفي تمرير أحدهما)"""
+        rows = []
+        if discord_id is not None:
+            rows.append(self._cache.pop(("discord", str(discord_id))))
+        if player_id is not None:
+            rows.append(self._cache.pop(("uuid", str(player_id))))
+        for row in rows:
+            if not row:
+                continue
+            self._cache.pop(("discord", str(row.get("discord_id"))))
+            self._cache.pop(("uuid", str(row.get("id"))))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
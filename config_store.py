@@ -0,0 +1,122 @@
+# config_store.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigStore:
+    """
+    نسخة في الذاكرة من جدول system_config:
+    - يُحمّل الجدول كاملاً مرة واحدة، وكل القراءات بعدها من الذاكرة
+    - الكتابة تمر على قاعدة البيانات ثم تُحدّث النسخة المحلية مباشرة (write-through)
+    - التغييرات من خارج البوت تُكتشف عبر LISTEN/NOTIFY (محرك asyncpg)،
+      أو بفحص أعلى قيمة في عمود version كل refresh_interval ثانية (محرك سوبابيس)
+    - إذا انقطع اتصال الإشعارات يعود للفحص الدوري ويعيد الاشتراك مع كل فحص حتى ينجح
+    """
+
+    def __init__(self, database, refresh_interval: float = 300.0):
+        self.db = database
+        self.refresh_interval = refresh_interval
+        self._values = {}
+        self._version = None
+        self._loaded = False
+        self._ever_loaded = False
+        self._checked_at = 0.0
+        self._lock = None
+        self._subscribers = {}
+        self.listening = False
+        self._can_listen = True  # يصبح False إذا كان المحرك لا يدعم LISTEN (سوبابيس)
+
+    async def get(self, key: str, default=None):
+        await self._ensure_fresh()
+        return self._values.get(key, default)
+
+    async def set(self, key: str, value):
+        result = await self.db._write_system_config(key, value)
+        old = self._values.get(key)
+        self._values[key] = value
+        if old != value:
+            self._notify(key, value)
+        return result
+
+    def subscribe(self, key: str, callback):
+        """callback(value) عند تغير قيمة المفتاح (كتابة من البوت أو إعادة تحميل بقيمة مختلفة)"""
+        self._subscribers.setdefault(key, []).append(callback)
+
+    def _notify(self, key, value):
+        for callback in self._subscribers.get(key, []):
+            try:
+                callback(value)
+            except Exception as e:
+                logger.warning(f"⚠️ خطأ في متابع الإعداد {key}: {e}")
+
+    def invalidate(self, key: str = None):
+        """يُستدعى عند وصول إشعار تغيير: القراءة التالية تعيد تحميل الجدول"""
+        self._loaded = False
+        # المتابعون (مثل مجدول البوابات) يحتاجون القيمة الجديدة الآن وليس عند القراءة التالية
+        if key in self._subscribers:
+            asyncio.get_running_loop().create_task(self._reload_for_subscribers())
+
+    async def _reload_for_subscribers(self):
+        try:
+            await self._ensure_fresh()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر إعادة تحميل الإعدادات بعد الإشعار: {e}")
+
+    async def _ensure_fresh(self):
+        if not self._loaded:
+            await self.reload()
+            return
+        if self.listening or time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+
+        self._checked_at = time.monotonic()
+        try:
+            version = await self.db._fetch_config_version()
+        except Exception as e:
+            # عمود version غير موجود أو خطأ مؤقت: الجدول صغير فنعيد تحميله كاملاً
+            logger.warning(f"⚠️ تعذر فحص إصدار الإعدادات: {e}")
+            version = None
+        if version is None or version != self._version:
+            await self.reload()
+        if self._can_listen:
+            # بعد فحص ما فات أثناء الانقطاع نحاول الاشتراك من جديد
+            await self._subscribe()
+
+    async def reload(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            rows = await self.db._fetch_system_config()
+            old = self._values
+            self._values = {row['key']: row['value'] for row in rows}
+            versions = [row['version'] for row in rows if row.get('version') is not None]
+            self._version = max(versions) if versions else None
+            self._checked_at = time.monotonic()
+            first_load = not self._ever_loaded
+            self._loaded = self._ever_loaded = True
+
+        if not first_load:
+            for key in self._subscribers:
+                if old.get(key) != self._values.get(key):
+                    self._notify(key, self._values.get(key))
+        else:
+            await self._subscribe()
+            logger.info(f"⚙️ تم تحميل {len(self._values)} إعداد للنظام في الذاكرة")
+
+    async def _subscribe(self):
+        try:
+            self.listening = await self.db._listen_config_changes(self.invalidate, self._on_disconnect)
+        except Exception as e:
+            self.listening = False
+            logger.warning(f"⚠️ تعذر الاشتراك في إشعارات الإعدادات، سيتم الفحص الدوري: {e}")
+            return
+        if not self.listening:
+            self._can_listen = False
+
+    def _on_disconnect(self):
+        """انقطع اتصال الإشعارات: نعود للفحص الدوري"""
+        self.listening = False
+        self._checked_at = 0.0
@@ -4,7 +4,21 @@ from dotenv import load_dotenv
 import logging
 from typing import Dict, Any, List
 import asyncio
-from datetime import datetime # ✅ إضافة ضرورية للتعامل مع أوقات انتهاء البفات
+import copy
+import functools
+import json
+import re
+from datetime import datetime, date # ✅ إضافة ضرورية للتعامل مع أوقات انتهاء البفات
+from decimal import Decimal
+from uuid import UUID
+from cache import PlayerCache
+from db_executor import DatabaseExecutor
+from config_store import ConfigStore
+from level_histogram import LevelHistogram
+from quest_catalog import QuestCatalog
+from progress import DailyProgress, ProgressTracker
+from metrics import query_metrics, count_rows
+from models import Player, Portal, Participant, InventoryItem, Buff, parse_timestamp
 
 load_dotenv()
 
@@ -34,10 +48,75 @@ class Database:
             logger.error(f"❌ فشل تهيئة Supabase: {e}")
             raise
 
+        # مجمع خيوط خاص باستعلامات قاعدة البيانات (منفصل عن المنفذ الافتراضي لـ asyncio)
+        self.executor = DatabaseExecutor(
+            max_workers=int(os.getenv("DB_EXECUTOR_WORKERS", "8")),
+            max_queue=int(os.getenv("DB_EXECUTOR_QUEUE", "64")),
+            background_workers=int(os.getenv("DB_BACKGROUND_WORKERS", "0")) or None,
+            timeout=float(os.getenv("DB_QUERY_TIMEOUT", "15"))
+        )
+
+        # الاستعلامات المتطابقة الجارية حالياً (مفتاح -> Future) لدمجها في طلب واحد
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+        # إعدادات النظام تُقرأ من الذاكرة (تتغير بضع مرات في اليوم فقط)
+        self.config = ConfigStore(self, refresh_interval=float(os.getenv("CONFIG_REFRESH_SECONDS", "300")))
+
+        # ذاكرة مؤقتة لصفوف اللاعبين (أكثر استعلام يتكرر في البوت)
+        self.player_cache = PlayerCache(
+            maxsize=int(os.getenv("PLAYER_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("PLAYER_CACHE_TTL", "60"))
+        )
+
+        # ملخص تقدم اليوم لكل لاعب يتحدث مع كل تسجيل مهمة (للوحة وساعة الحساب)
+        self.progress = ProgressTracker()
+
+        # مهام البوابات مفهرسة في الذاكرة (تُحمّل مرة واحدة)
+        self.quests = QuestCatalog(self)
+
+        # مدرج مستويات اللاعبين النشطين لمولد البوابات (يُعاد بناؤه بعد تغير المستويات أو بعد مدته)
+        self._level_histogram = None
+        self.level_histogram_ttl = float(os.getenv("LEVEL_HISTOGRAM_TTL", "600"))
+
     # ✅ نقلنا هذه الدالة للأعلى لأنها "المحرك" لكل الدوال التالية
-    async def _execute_async(self, query_func):
-        """الدالة السحرية لتنفيذ استعلامات سوبابيس في خيط منفصل لمنع تجميد البوت"""
-        return await asyncio.to_thread(query_func)
+    async def _execute_async(self, query_func, table: str = None, op: str = None):
+        """
+        الدالة السحرية لتنفيذ استعلامات سوبابيس في خيط منفصل لمنع تجميد البوت.
+        table/op: تصنيف الاستعلام في إحصائيات /metrics (الزمن، الصفوف، الأخطاء)
+        """
+        with query_metrics.track(table, op) as timer:
+            result = await self.executor.run(query_func)
+            timer.rows = count_rows(result)
+        return result
+
+    async def _single_flight(self, key: tuple, fetch):
+        """
+        دمج القراءات المتطابقة المتزامنة: أول طالب ينفذ fetch() فعلياً،
+        ومن يطلب نفس المفتاح أثناء التنفيذ ينتظر نفس النتيجة (نسخة مستقلة) بدل طلب جديد.
+        key: (الجدول، وصف الاستعلام، ...المعاملات)
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            query_metrics.observe_coalesced(key[0], key[1])
+            # shield: إلغاء أحد المنتظرين لا يلغي الطلب على الباقين
+            return copy.deepcopy(await asyncio.shield(pending))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # حتى لا يُسجل تحذير إذا لم يكن هناك منتظرون
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
 
     # ============ 1. دوال المهام اليومية (Daily Quests) ============
 
@@ -45,7 +124,7 @@ class Database:
         """جلب قائمة المهام المسجلة للاعب في تاريخ معين"""
         def query():
             return self.client.table('player_daily_quests').select('*').eq('player_id', player_id).eq('log_date', log_date).execute()
-        res = await self._execute_async(query)
+        res = await self._execute_async(query, table='player_daily_quests', op='select')
         return res.data
 
     async def upsert_daily_quest(self, data: dict):
@@ -56,7 +135,110 @@ class Database:
                 data, 
                 on_conflict='player_id, task_id, log_date'
             ).execute()
-        return await self._execute_async(query)
+        res = await self._execute_async(query, table='player_daily_quests', op='upsert')
+        self.progress.record(data)
+        return res
+
+    async def _fetch_daily_logs_page(self, log_date: str, after: tuple, limit: int):
+        """صفحة واحدة من سجلات يوم كامل مرتبة بـ (player_id, task_id) بعد المؤشر after"""
+        def query():
+            q = self.client.table('player_daily_quests').select('*').eq('log_date', log_date)
+            if after:
+                pid, tid = after
+                q = q.or_(f'player_id.gt."{pid}",and(player_id.eq."{pid}",task_id.gt."{tid}")')
+            return q.order('player_id').order('task_id').limit(limit).execute()
+        res = await self._execute_async(query, table='player_daily_quests', op='select')
+        return res.data
+
+    async def iter_daily_logs_by_player(self, log_date: str, chunk_size: int = 1000):
+        """
+        (النسخة المتدفقة) تمر على كل سجلات اليوم بترقيم Keyset وتعيد (player_id, logs)
+        لكل لاعب بمجرد اكتمال سجلاته، بدون تحميل اليوم كاملاً في الذاكرة.
+        """
+        after = None
+        current_id, current_logs = None, []
+        while True:
+            page = await self._fetch_daily_logs_page(log_date, after, chunk_size)
+            for log in page:
+                if log['player_id'] != current_id:
+                    if current_logs:
+                        yield current_id, current_logs
+                    current_id, current_logs = log['player_id'], []
+                current_logs.append(log)
+            if len(page) < chunk_size:
+                break
+            after = (page[-1]['player_id'], page[-1]['task_id'])
+        if current_logs:
+            yield current_id, current_logs
+
+    async def get_daily_logs_for_date(self, log_date: str, chunk_size: int = 1000) -> Dict[str, List[dict]]:
+        """جلب سجلات كل اللاعبين لتاريخ معين في دفعات، مجمعة حسب اللاعب {player_id: [logs]}"""
+        grouped = {}
+        async for player_id, logs in self.iter_daily_logs_by_player(log_date, chunk_size):
+            grouped[player_id] = logs
+        return grouped
+
+    async def _fetch_daily_progress(self, player_id: str, log_date: str):
+        """صف ملخص يوم اللاعب من player_daily_progress (يحدثه trigger مع كل سجل مهمة)"""
+        def query():
+            return self.client.table('player_daily_progress').select('*').eq('player_id', player_id).eq('log_date', log_date).limit(1).execute()
+        res = await self._execute_async(query, table='player_daily_progress', op='select')
+        return res.data[0] if res.data else None
+
+    async def _fetch_daily_progress_page(self, log_date: str, after: str, limit: int):
+        """صفحة من ملخصات يوم كامل مرتبة بـ player_id بعد المؤشر after"""
+        def query():
+            q = self.client.table('player_daily_progress').select('player_id, log_date, tasks').eq('log_date', log_date)
+            if after:
+                q = q.gt('player_id', after)
+            return q.order('player_id').limit(limit).execute()
+        res = await self._execute_async(query, table='player_daily_progress', op='select')
+        return res.data
+
+    async def _load_daily_progress(self, player_id: str, log_date: str) -> DailyProgress:
+        try:
+            row = await self._fetch_daily_progress(player_id, log_date)
+        except Exception as e:
+            # قبل تنفيذ sql/005 نبني الملخص من سجلات اليوم مباشرة
+            logger.warning(f"⚠️ تعذرت قراءة player_daily_progress، القراءة من السجلات: {e}")
+            logs = await self.get_player_daily_logs(player_id, log_date)
+            return DailyProgress.from_logs(player_id, log_date, logs)
+        return DailyProgress.from_row(row) if row else DailyProgress(player_id, log_date)
+
+    async def get_daily_progress(self, player_id: str, log_date: str) -> DailyProgress:
+        """ملخص يوم اللاعب: من الذاكرة، أو صف واحد من قاعدة البيانات عند أول طلب ثم يُحدث مع كل كتابة"""
+        player_id = str(player_id)
+        progress = self.progress.get(player_id, log_date)
+        if progress is not None:
+            return progress
+        version = self.progress.version(player_id, log_date)
+        progress = await self._single_flight(
+            ('player_daily_progress', 'by_player', player_id, log_date),
+            lambda: self._load_daily_progress(player_id, log_date)
+        )
+        # لا نخزن ملخصاً قُرئ قبل كتابة حدثت أثناء القراءة (يُعاد تحميله في الطلب التالي)
+        if self.progress.version(player_id, log_date) == version:
+            self.progress.put(progress)
+        return progress
+
+    async def get_daily_progress_for_date(self, log_date: str, page_size: int = 1000) -> Dict[str, DailyProgress]:
+        """ملخصات كل اللاعبين لتاريخ معين {player_id: DailyProgress} (صف واحد لكل لاعب بدل كل سجلاته)"""
+        grouped = {}
+        after = None
+        try:
+            while True:
+                page = await self._fetch_daily_progress_page(log_date, after, page_size)
+                for row in page:
+                    progress = DailyProgress.from_row(row)
+                    grouped[progress.player_id] = progress
+                if len(page) < page_size:
+                    break
+                after = page[-1]['player_id']
+        except Exception as e:
+            logger.warning(f"⚠️ تعذرت قراءة player_daily_progress، القراءة من السجلات: {e}")
+            logs_by_player = await self.get_daily_logs_for_date(log_date)
+            grouped = {pid: DailyProgress.from_logs(pid, log_date, logs) for pid, logs in logs_by_player.items()}
+        return grouped
 
     # ============ 2. دوال التأثيرات النشطة (Active Buffs) - جديد ✅ ============
 
@@ -69,33 +251,141 @@ class Database:
                 .eq('player_id', player_id)\
                 .gt('expires_at', now)\
                 .execute()
-        res = await self._execute_async(query)
+        res = await self._execute_async(query, table='player_buffs', op='select')
+        return Buff.from_rows(res.data)
+
+    async def get_active_buffs_by_player(self, buff_type: str) -> Dict[str, List[dict]]:
+        """كل التأثيرات السارية من نوع معين لكل اللاعبين في استعلام واحد: {player_id: [buffs]}"""
+        now = datetime.now().isoformat()
+        def query():
+            return self.client.table('player_buffs')\
+                .select('*')\
+                .eq('buff_type', buff_type)\
+                .gt('expires_at', now)\
+                .execute()
+        res = await self._execute_async(query, table='player_buffs', op='select')
+        grouped = {}
+        for buff in Buff.from_rows(res.data):
+            grouped.setdefault(buff['player_id'], []).append(buff)
+        return grouped
+
+    async def get_player_inventory(self, player_id: str, equipped_only: bool = False) -> List[InventoryItem]:
+        """عناصر حقيبة اللاعب مع بيانات كل عنصر من المتجر (item)"""
+        return InventoryItem.from_rows(await self._fetch_player_inventory(player_id, equipped_only))
+
+    async def _fetch_player_inventory(self, player_id: str, equipped_only: bool):
+        def query():
+            q = self.client.table('player_inventory')\
+                .select('*, item:system_shop_items(*)')\
+                .eq('player_id', player_id)
+            if equipped_only:
+                q = q.eq('is_equipped', True)
+            return q.execute()
+        res = await self._execute_async(query, table='player_inventory', op='select')
         return res.data
 
     async def add_player_buff(self, buff_data: dict):
         """تسجيل تأثير جديد (يستدعى عند استهلاك عنصر من الحقيبة)"""
         def query():
             return self.client.table('player_buffs').insert(buff_data).execute()
-        return await self._execute_async(query)       
-        
-    # الدالة السحرية لمنع التهنيج
-    async def _execute_async(self, query_func):
-        return await asyncio.to_thread(query_func)
+        return await self._execute_async(query, table='player_buffs', op='insert')       
+
 
     # ============ دوال اللاعبين ============
-    async def get_player(self, discord_id: str):
+    async def _select_player(self, column: str, value: str):
+        """جلب صف لاعب مباشرة من قاعدة البيانات (بدون الذاكرة المؤقتة)"""
         def query():
-            response = self.client.table('players').select('*').eq('discord_id', discord_id).execute()
+            response = self.client.table('players').select('*').eq(column, value).execute()
             return response.data[0] if response.data else None
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='players', op='select')
+
+    async def _load_player(self, column: str, value: str):
+        row = await self._select_player(column, value)
+        return Player.from_row(row)
+
+    async def get_player(self, discord_id: str):
+        """جلب اللاعب بمعرف ديسكورد (قراءة عبر الذاكرة المؤقتة أولاً)"""
+        cached = self.player_cache.get_by_discord(discord_id)
+        if cached is not None:
+            return cached
+        player = await self._single_flight(
+            ('players', 'by_discord', discord_id), lambda: self._load_player('discord_id', discord_id)
+        )
+        self.player_cache.put(player)
+        return player
+
+    async def get_player_by_uuid(self, player_id: str):
+        """جلب اللاعب بالـ UUID الخاص بقاعدة البيانات"""
+        cached = self.player_cache.get_by_uuid(player_id)
+        if cached is not None:
+            return cached
+        player = await self._single_flight(
+            ('players', 'by_uuid', player_id), lambda: self._load_player('id', player_id)
+        )
+        self.player_cache.put(player)
+        return player
+
+    @staticmethod
+    def _player_columns(columns) -> list:
+        """أعمدة الإسقاط مع إضافة id دائماً لأنه مؤشر الترقيم"""
+        if not columns or columns == '*':
+            return ['*']
+        return ['id'] + [c for c in columns if c != 'id']
+
+    async def _fetch_players_page(self, columns: list, after: str, limit: int, where: dict, exclude_status: str):
+        """صفحة واحدة من اللاعبين مرتبة بـ id بعد المؤشر after"""
+        def query():
+            q = self.client.table('players').select(', '.join(columns))
+            if exclude_status:
+                q = q.neq('status', exclude_status)
+            for col, value in (where or {}).items():
+                q = q.eq(col, value)
+            if after:
+                q = q.gt('id', after)
+            return q.order('id').limit(limit).execute()
+        res = await self._execute_async(query, table='players', op='select')
+        return res.data
+
+    async def iter_player_pages(self, columns=None, page_size: int = 500, where: dict = None, exclude_status: str = 'inactive'):
+        """
+        (النسخة المتدفقة) صفحات اللاعبين بترقيم Keyset على id بدل تحميل الجدول كاملاً:
+        الذاكرة ثابتة مهما كبر عدد اللاعبين، والمعالجة تبدأ من أول صفحة.
+        columns: الأعمدة المطلوبة فقط (الافتراضي كل الأعمدة)، where: شروط تساوي إضافية.
+        الصفوف الجزئية لا تدخل الذاكرة المؤقتة للاعبين.
+        """
+        columns = self._player_columns(columns)
+        after = None
+        while True:
+            page = Player.from_rows(await self._fetch_players_page(columns, after, page_size, where, exclude_status))
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            after = page[-1]['id']
+
+    async def iter_players(self, columns=None, page_size: int = 500, where: dict = None, exclude_status: str = 'inactive'):
+        """نفس iter_player_pages لكن لاعباً لاعباً"""
+        async for page in self.iter_player_pages(columns, page_size, where, exclude_status):
+            for player in page:
+                yield player
+
+    def _refresh_cached_player(self, rows: list, discord_id: str = None, player_id: str = None):
+        """بعد أي كتابة: نخزن الصف الذي أعاده السيرفر، وإن لم يُعد شيئاً نحذف النسخة القديمة"""
+        if rows:
+            for row in rows:
+                self.player_cache.put(row)
+        else:
+            self.player_cache.invalidate(discord_id=discord_id, player_id=player_id)
     
     async def create_player(self, data: dict):
         def query():
             return self.client.table('players').insert(data).execute()
         
         try:
-            response = await self._execute_async(query)
-            return response.data[0] if response.data else None
+            response = await self._execute_async(query, table='players', op='insert')
+            player = Player.from_row(response.data[0]) if response.data else None
+            self.player_cache.put(player)
+            return player
         except Exception as e:
             logger.error(f"Error creating player: {e}")
             return None
@@ -103,12 +393,64 @@ class Database:
     async def update_player(self, discord_id: str, data: dict):
         def query():
             return self.client.table('players').update(data).eq('discord_id', discord_id).execute()
-        return await self._execute_async(query)
+        try:
+            response = await self._execute_async(query, table='players', op='update')
+        except Exception:
+            self.player_cache.invalidate(discord_id=discord_id)
+            raise
+        self._refresh_cached_player(response.data, discord_id=discord_id)
+        if 'status' in data: self.invalidate_level_histogram()
+        return response
+
+    @staticmethod
+    def _delta_bounds(bound, deltas: dict) -> dict:
+        """حد القص: رقم واحد لكل الحقول أو dict لكل حقل على حدة"""
+        if bound is None:
+            return {}
+        if isinstance(bound, dict):
+            return {k: v for k, v in bound.items() if k in deltas}
+        return {k: bound for k in deltas}
+
+    def _increment_row(self, key: str, deltas: dict, floor=None, cap=None, strict: bool = False) -> dict:
+        return {
+            'key': str(key), 'deltas': deltas,
+            'floor': self._delta_bounds(floor, deltas), 'cap': self._delta_bounds(cap, deltas),
+            'strict': strict
+        }
+
+    async def increment_player(self, discord_id: str, deltas: dict, floor=None, cap=None, strict: bool = False):
+        """
+        إضافة/خصم قيم على عدادات اللاعب ذرياً داخل السيرفر بدون قراءة مسبقة: {'coins': -50, 'gems': 5}
+        floor/cap للقص (رقم أو dict لكل حقل)، و strict=True يرفض العملية كاملة بدل القص تحت floor.
+        يعيد صف اللاعب بعد التحديث، أو None إذا لم يوجد اللاعب أو رُفضت العملية.
+        """
+        row = self._increment_row(discord_id, deltas, floor, cap, strict)
+        def query():
+            return self.client.rpc('increment_player', {
+                'p_discord_id': row['key'], 'p_deltas': row['deltas'],
+                'p_floor': row['floor'], 'p_cap': row['cap'], 'p_strict': strict
+            }).execute()
+        try:
+            response = await self._execute_async(query, table='increment_player', op='rpc')
+        except Exception:
+            self.player_cache.invalidate(discord_id=discord_id)
+            raise
+        self._refresh_cached_player(response.data, discord_id=discord_id)
+        return response.data[0] if response.data else None
+
+    async def delete_player(self, discord_id: str):
+        """حذف حساب اللاعب نهائياً"""
+        def query():
+            return self.client.table('players').delete().eq('discord_id', discord_id).execute()
+        try:
+            return await self._execute_async(query, table='players', op='delete')
+        finally:
+            self.player_cache.invalidate(discord_id=discord_id)
 
     async def get_player_count(self):
         def query():
             return self.client.table('players').select('id', count='exact').execute()
-        response = await self._execute_async(query)
+        response = await self._execute_async(query, table='players', op='select')
         return response.count
 
     async def get_top_players(self, limit=10):
@@ -119,7 +461,7 @@ class Database:
                 .order('total_xp', desc=True)\
                 .limit(limit)\
                 .execute()
-        response = await self._execute_async(query)
+        response = await self._execute_async(query, table='players', op='select')
         return response.data
     
     # ============ نظام العقوبات (تم تحويله لـ Async) ============
@@ -163,7 +505,7 @@ class Database:
                 logger.error(f"خطأ في تطبيق العقوبة: {e}")
                 return None
 
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='penalties', op='insert')
 
     # ============ دوال إضافية (تم تحويلها لـ Async) ============
 
@@ -177,7 +519,7 @@ class Database:
             except Exception as e:
                 logger.error(f"خطأ في تسجيل النشاط: {e}")
                 return None
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='activities', op='insert')
 
     async def get_active_portals(self, guild_id: str = None):
         def query():
@@ -190,19 +532,55 @@ class Database:
             except Exception as e:
                 logger.error(f"خطأ في جلب البوابات: {e}")
                 return []
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='portals', op='select')
 
     # ============ دوال البوابات (جديد) ============
     
     async def get_portal(self, portal_id: str):
-        """جلب بيانات بوابة محددة"""
+        """جلب بيانات بوابة محددة (Portal بتواريخ محولة)"""
+        return Portal.from_row(await self._fetch_portal(portal_id))
+
+    async def _fetch_portal(self, portal_id: str):
         def query():
             response = self.client.table('portal_history')\
                 .select('*')\
                 .eq('id', portal_id)\
                 .execute()
             return response.data[0] if response.data else None
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='portal_history', op='select')
+
+    async def get_open_portals(self) -> List[Portal]:
+        """البوابات المفتوحة (recruiting / active) لتتبع مواعيدها عند التشغيل"""
+        return Portal.from_rows(await self._fetch_open_portals())
+
+    async def _fetch_open_portals(self):
+        def query():
+            return self.client.table('portal_history')\
+                .select('*')\
+                .in_('status', ['recruiting', 'active'])\
+                .execute()
+        res = await self._execute_async(query, table='portal_history', op='select')
+        return res.data
+
+    async def get_portal_participants(self, portal_id: str) -> List[Participant]:
+        """مشاركو البوابة مع اسم كل لاعب ومعرفه في ديسكورد (players)"""
+        return Participant.from_rows(await self._fetch_participants(portal_id))
+
+    async def get_participant(self, portal_id: str, player_id: str):
+        """سجل لاعب واحد في البوابة أو None إذا لم ينضم"""
+        rows = await self._fetch_participants(portal_id, player_id)
+        return Participant.from_row(rows[0]) if rows else None
+
+    async def _fetch_participants(self, portal_id: str, player_id: str = None):
+        def query():
+            q = self.client.table('portal_participants')\
+                .select('*, players(discord_id, username)')\
+                .eq('portal_id', portal_id)
+            if player_id:
+                q = q.eq('player_id', player_id)
+            return q.execute()
+        res = await self._execute_async(query, table='portal_participants', op='select')
+        return res.data
 
     async def update_portal_participants(self, portal_id: str, participants: list):
         """تحديث قائمة المشاركين في البوابة"""
@@ -211,7 +589,7 @@ class Database:
                 .update({'participants_ids': participants})\
                 .eq('id', portal_id)\
                 .execute()
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='portal_history', op='update')
     
 
     async def apply_global_penalty(self, category: str, amount: int):
@@ -221,116 +599,787 @@ class Database:
                 'penalty_category': category, 
                 'penalty_amount': amount
             }).execute()
-        return await self._execute_async(query)
+        try:
+            return await self._execute_async(query, table='apply_global_xp_penalty', op='rpc')
+        finally:
+            # العقوبة تغير خبرة الجميع، فكل النسخ المخزنة أصبحت قديمة
+            self.player_cache.clear()
+            self.invalidate_level_histogram()
         
     async def get_system_config(self, key: str):
-        """جلب إعداد معين (مثل الفاصل الزمني)"""
+        """جلب إعداد معين (مثل الفاصل الزمني) من نسخة الذاكرة"""
+        return await self.config.get(key)
+
+    async def _fetch_system_config(self) -> List[dict]:
         def query():
-            res = self.client.table('system_config').select('value').eq('key', key).execute()
-            return res.data[0]['value'] if res.data else None
-        return await self._execute_async(query)
+            return self.client.table('system_config').select('*').execute().data
+        return await self._execute_async(query, table='system_config', op='select')
+
+    async def _fetch_config_version(self):
+        """أعلى رقم إصدار في الجدول (يزيد مع كل تعديل عبر trigger)"""
+        def query():
+            res = self.client.table('system_config').select('version').order('version', desc=True).limit(1).execute()
+            return res.data[0]['version'] if res.data else None
+        return await self._execute_async(query, table='system_config', op='select')
+
+    async def _listen_config_changes(self, on_change, on_disconnect) -> bool:
+        """سوبابيس عبر REST لا يدعم LISTEN، فيعتمد المخزن على الفحص الدوري لعمود version"""
+        return False
 
     async def get_last_portal_time(self):
-        """معرفة متى فُتحت آخر بوابة لحساب الفاصل الزمني"""
+        """معرفة متى فُتحت آخر بوابة لحساب الفاصل الزمني (datetime بمنطقة زمنية أو None)"""
+        created_at = await self._single_flight(('portal_history', 'last_created_at'), self._fetch_last_portal_time)
+        return parse_timestamp(created_at)
+
+    async def _fetch_last_portal_time(self):
         def query():
             # نجلب آخر بوابة تم إنشاؤها
             res = self.client.table('portal_history').select('created_at').order('created_at', desc=True).limit(1).execute()
             return res.data[0]['created_at'] if res.data else None
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='portal_history', op='select')
 
-    async def get_random_quest(self):
-        """جلب مهمة عشوائية (ليست موسمية)"""
-        # ملاحظة: سوبابيس لا تدعم order by random مباشرة بسهولة، لذا سنجلب الكل ونختار بالكود
-        # بما أن العدد 42 فقط، هذا خفيف جداً
+    async def get_shop_items(self, item_type: str = None):
+        """عناصر المتجر المتاحة (مع فلتر النوع اختيارياً)، الطلبات المتزامنة لنفس الفلتر تُدمج"""
+        return await self._single_flight(
+            ('system_shop_items', 'available', item_type), lambda: self._fetch_shop_items(item_type)
+        )
+
+    async def _fetch_shop_items(self, item_type: str = None):
         def query():
-            return self.client.table('system_portal_quests').select('*').eq('is_seasonal', False).execute()
-        res = await self._execute_async(query)
-        if res.data:
-            import random
-            return random.choice(res.data)
-        return None
+            q = self.client.table('system_shop_items').select('*').eq('is_available', True)
+            if item_type:
+                q = q.eq('type', item_type)
+            return q.execute().data
+        return await self._execute_async(query, table='system_shop_items', op='select')
+
+    async def get_random_quest(self):
+        """جلب مهمة عشوائية (ليست موسمية) من فهرس المهام في الذاكرة"""
+        return self.quests.pick_weighted(await self.quests.regular_quests())
 
     async def get_seasonal_quest(self, hijri_date_str: str):
         """البحث عن بوابة موسمية لهذا اليوم (مثل 10-1 للعيد)"""
+        return await self.quests.seasonal_for(hijri_date_str)
+
+    async def _fetch_portal_quests(self) -> List[dict]:
+        """كل مهام البوابات (يُستدعى فقط عند تحميل QuestCatalog أو تحديثه)"""
         def query():
-            return self.client.table('system_portal_quests')\
-                .select('*')\
-                .eq('is_seasonal', True)\
-                .eq('seasonal_hijri_date', hijri_date_str)\
-                .execute()
-        res = await self._execute_async(query)
-        return res.data[0] if res.data else None    
+            return self.client.table('system_portal_quests').select('*').execute()
+        res = await self._execute_async(query, table='system_portal_quests', op='select')
+        return res.data
         
         
     async def count_capable_players(self, min_level: int):
-        """حساب عدد اللاعبين النشطين الذين يتجاوز مستواهم الحد المطلوب"""
+        """حساب عدد اللاعبين النشطين الذين يتجاوز مستواهم الحد المطلوب (من مدرج المستويات)"""
+        return (await self.get_level_histogram()).count_at_least(min_level)
+
+    async def get_level_histogram(self) -> LevelHistogram:
+        """مدرج مستويات اللاعبين النشطين من الذاكرة، أو استعلام تجميعي واحد إذا تغيرت المستويات أو انتهت مدته"""
+        histogram = self._level_histogram
+        if histogram is None or histogram.age > self.level_histogram_ttl:
+            rows = await self._single_flight(('players', 'level_histogram'), self._fetch_level_histogram)
+            histogram = self._level_histogram = LevelHistogram(rows)
+        return histogram
+
+    def invalidate_level_histogram(self):
+        self._level_histogram = None
+
+    async def _fetch_level_histogram(self) -> List[dict]:
+        """[{level, players}] لكل مستوى كلي (دالة active_level_histogram في sql/006)"""
         def query():
-            # نعد اللاعبين النشطين (active) ومستواهم >= المطلوب
-            return self.client.table('players')\
-                .select('id', count='exact')\
-                .eq('status', 'active')\
-                .gte('total_level', min_level)\
-                .execute()
-        
-        res = await self._execute_async(query)
-        return res.count
+            return self.client.rpc('active_level_histogram', {}).execute()
+        res = await self._execute_async(query, table='active_level_histogram', op='rpc')
+        return res.data or []
         
     async def set_system_config(self, key: str, value: str):
-        """تحديث إعداد نظام (مثل تاريخ آخر توزيع)"""
+        """تحديث إعداد نظام (مثل تاريخ آخر توزيع) في القاعدة والذاكرة معاً"""
+        return await self.config.set(key, value)
+
+    async def _write_system_config(self, key: str, value):
         def query():
             return self.client.table('system_config').upsert({'key': key, 'value': value}).execute()
-        return await self._execute_async(query)
+        return await self._execute_async(query, table='system_config', op='upsert')
 
       
     # أضفها في database.py
     async def recalculate_player_stats(self, player_id: str):
-        """إعادة حساب المستوى الكلي والرتبة بناءً على مجموع خبرة الجوانب"""
+        """إعادة حساب المستوى الكلي والرتبة داخل السيرفر في طلب واحد (دالة recalculate_player_stats)"""
+        def query():
+            return self.client.rpc('recalculate_player_stats', {'p_player_id': player_id}).execute()
         try:
-            # 1. جلب بيانات اللاعب الحالية
-            p = await self.get_player_by_uuid(player_id) # سنحتاج دالة تجلب بالـ UUID او نستخدم الموجودة
-            # للتبسيط سنفترض أننا نملك البيانات أو نجلبها
-            # هنا سأكتب المنطق المباشر للتحديث
-            
-            def query():
-                # نجلب اللاعب
-                data = self.client.table('players').select('*').eq('id', player_id).execute()
-                if not data.data: return None
-                player = data.data[0]
-                
-                # 2. حساب المجموع الكلي للخبرة
-                total_xp = (
-                    player.get('strength_xp', 0) + 
-                    player.get('intelligence_xp', 0) + 
-                    player.get('vitality_xp', 0) + 
-                    player.get('agility_xp', 0) + 
-                    player.get('perception_xp', 0) + 
-                    player.get('freedom_xp', 0)
+            response = await self._execute_async(query, table='recalculate_player_stats', op='rpc')
+            row = response.data[0] if response and response.data else None
+            if row:
+                self.player_cache.patch(player_id, row)
+                self.invalidate_level_histogram()
+                logger.info(f"🔄 تم تحديث مستوى اللاعب {player_id} تلقائياً.")
+            return row
+        except Exception as e:
+            self.player_cache.invalidate(player_id=player_id)
+            logger.error(f"Stats Recalc Error: {e}")
+            return None
+
+    async def recalculate_players_stats(self, player_ids: list) -> List[dict]:
+        """نفس إعادة الحساب لمجموعة لاعبين في طلب واحد (تُستخدم من BatchWriter)"""
+        def query():
+            return self.client.rpc('recalculate_players_stats', {'p_player_ids': player_ids}).execute()
+        try:
+            response = await self._execute_async(query, table='recalculate_players_stats', op='rpc')
+        except Exception:
+            for pid in player_ids:
+                self.player_cache.invalidate(player_id=pid)
+            raise
+        rows = response.data or []
+        for row in rows:
+            self.player_cache.patch(row['id'], row)
+        if rows: self.invalidate_level_histogram()
+        return rows
+
+
+    # ============ دوال الكتابة المجمعة (Bulk Writes) ============
+
+    async def bulk_update_players(self, updates: List[dict]):
+        """تحديث عدة لاعبين في طلب واحد عبر RPC، كل عنصر: {"id": uuid, عمود: قيمة...}"""
+        def query():
+            return self.client.rpc('bulk_update_players', {'updates': updates}).execute()
+        try:
+            return await self._execute_async(query, table='bulk_update_players', op='rpc')
+        finally:
+            for row in updates:
+                self.player_cache.invalidate(player_id=row['id'])
+
+    async def bulk_increment_players(self, rows: List[dict]):
+        """إضافة فروق لعدة لاعبين (بالـ UUID) في طلب واحد، كل عنصر ناتج _increment_row"""
+        def query():
+            return self.client.rpc('increment_players', {'p_rows': rows, 'p_key': 'id'}).execute()
+        try:
+            return await self._execute_async(query, table='increment_players', op='rpc')
+        finally:
+            for row in rows:
+                self.player_cache.invalidate(player_id=row['key'])
+
+    async def bulk_insert(self, table: str, rows: List[dict]):
+        """إدراج عدة صفوف في طلب واحد"""
+        def query():
+            return self.client.table(table).insert(rows).execute()
+        return await self._execute_async(query, table=table, op='insert')
+
+    async def bulk_delete(self, table: str, ids: list):
+        """حذف عدة صفوف بالمعرف في طلب واحد"""
+        def query():
+            return self.client.table(table).delete().in_('id', ids).execute()
+        return await self._execute_async(query, table=table, op='delete')
+
+
+class BatchWriter:
+    """
+    مرحلة الكتابة المجمعة لساعة الحساب: تتجمع تحديثات اللاعبين وصفوف العقوبات
+    والبفات المستهلكة في الذاكرة، ثم تُرسل في flush على شكل دفعات (chunks)
+    مع إعادة المحاولة، وعند فشل دفعة بالكامل تُقسم لعزل الصف المعطوب فقط.
+    """
+
+    def __init__(self, database: "Database", chunk_size: int = 200, max_retries: int = 3, retry_delay: float = 1.0):
+        self.db = database
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.player_updates: Dict[str, dict] = {}
+        self.player_increments: Dict[str, dict] = {}
+        self.penalty_rows: List[dict] = []
+        self.buff_ids: List[str] = []
+        self.recalc_ids: List[str] = []
+        self.buff_owners: Dict[str, str] = {}
+        self.failed: List[tuple] = []
+
+    # --- التجميع ---
+
+    def update_player(self, player_id: str, data: dict):
+        self.player_updates.setdefault(player_id, {}).update(data)
+
+    def increment_player(self, player_id: str, deltas: dict, floor=None, cap=None):
+        """فروق تُجمع مع أي فروق سابقة لنفس اللاعب وتُطبق ذرياً في السيرفر عند flush"""
+        pending = self.player_increments.setdefault(player_id, {'deltas': {}, 'floor': {}, 'cap': {}})
+        for field, delta in deltas.items():
+            pending['deltas'][field] = pending['deltas'].get(field, 0) + delta
+        pending['floor'].update(Database._delta_bounds(floor, deltas))
+        pending['cap'].update(Database._delta_bounds(cap, deltas))
+
+    def add_penalty(self, row: dict):
+        self.penalty_rows.append(row)
+
+    def delete_buff(self, buff_id: str, player_id: str = None):
+        self.buff_ids.append(buff_id)
+        if player_id:
+            self.buff_owners[buff_id] = player_id
+
+    def recalculate(self, player_id: str):
+        if player_id not in self.recalc_ids:
+            self.recalc_ids.append(player_id)
+
+    def replay(self, writes: list):
+        """إعادة صفوف لم تُحفظ سابقاً (ناتج failed_players) إلى الدفعة كما هي بدون إعادة حسابها"""
+        for label, row in writes:
+            if label == "penalties":
+                self.add_penalty(row)
+            elif label == "player_buffs":
+                self.delete_buff(row)
+            elif label == "players":
+                self.update_player(row['id'], {k: v for k, v in row.items() if k != 'id'})
+            elif label == "increments":
+                self.player_increments[row['key']] = {k: row[k] for k in ('deltas', 'floor', 'cap')}
+                self.recalculate(row['key'])
+
+    def __len__(self):
+        return len(self.player_updates) + len(self.player_increments) + len(self.penalty_rows) + len(self.buff_ids)
+
+    # --- الإرسال ---
+
+    async def flush(self) -> dict:
+        """إرسال كل ما تجمع ثم تفريغ الدفعة، ويعيد ملخصاً بعدد الصفوف والفشل"""
+        updates = [{'id': pid, **data} for pid, data in self.player_updates.items()]
+        increments = [{'key': pid, 'strict': False, **inc} for pid, inc in self.player_increments.items()]
+        penalties, buff_ids, recalc_ids = self.penalty_rows, self.buff_ids, self.recalc_ids
+        self.player_updates, self.player_increments = {}, {}
+        self.penalty_rows, self.buff_ids, self.recalc_ids = [], [], []
+        self.failed = []
+
+        await self._flush_chunks("penalties", penalties, lambda chunk: self.db.bulk_insert('penalties', chunk))
+        await self._flush_chunks("player_buffs", buff_ids, lambda chunk: self.db.bulk_delete('player_buffs', chunk))
+        await self._flush_chunks("players", updates, self.db.bulk_update_players)
+        await self._flush_chunks("increments", increments, self.db.bulk_increment_players)
+        # إعادة حساب المستوى بعد وصول كل التحديثات (طلب واحد لكل دفعة)
+        await self._flush_chunks("recalc", recalc_ids, self.db.recalculate_players_stats)
+
+        summary = {
+            "players": len(updates), "increments": len(increments), "penalties": len(penalties),
+            "buffs": len(buff_ids), "failed": len(self.failed)
+        }
+        logger.info(f"💾 تم حفظ نتائج الدفعة: {summary}")
+        return summary
+
+    def failed_players(self) -> Dict[str, list]:
+        """
+        صفوف آخر flush التي لم تُحفظ مجمعة حسب اللاعب: {player_id: [(label, row)]}.
+        فشل إعادة حساب المستوى لا يُحسب (يُعاد حسابه مع أي تحديث لاحق للاعب).
+        """
+        grouped = {}
+        for label, row in self.failed:
+            if label == "penalties":
+                player_id = row.get('player_id')
+            elif label == "player_buffs":
+                player_id = self.buff_owners.get(row)
+            elif label == "players":
+                player_id = row['id']
+            elif label == "increments":
+                player_id = row['key']
+            else:
+                continue
+            if player_id:
+                grouped.setdefault(player_id, []).append((label, row))
+        return grouped
+
+    async def _flush_chunks(self, label: str, items: list, write_chunk):
+        for start in range(0, len(items), self.chunk_size):
+            await self._write_with_retry(label, items[start:start + self.chunk_size], write_chunk, self.max_retries)
+
+    async def _write_with_retry(self, label: str, chunk: list, write_chunk, attempts: int):
+        for attempt in range(1, attempts + 1):
+            try:
+                await write_chunk(chunk)
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ فشل حفظ دفعة {label} ({len(chunk)} صف) محاولة {attempt}/{attempts}: {e}")
+                if attempt < attempts:
+                    await asyncio.sleep(self.retry_delay * (2 ** (attempt - 1)))
+
+        if len(chunk) == 1:
+            self.failed.append((label, chunk[0]))
+            logger.error(f"❌ تعذر حفظ صف في {label}: {chunk[0]}")
+            return
+        # تقسيم الدفعة لنصفين حتى لا يُسقط صف واحد معطوب بقية الصفوف
+        mid = len(chunk) // 2
+        await self._write_with_retry(label, chunk[:mid], write_chunk, 1)
+        await self._write_with_retry(label, chunk[mid:], write_chunk, 1)
+
+
+# ============ المحرك البديل: اتصال مباشر بـ PostgreSQL عبر asyncpg ============
+
+def _to_rest_value(value):
+    """تحويل قيم asyncpg إلى نفس الشكل الذي يعيده PostgREST (نصوص للتواريخ والمعرفات)"""
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, list):
+        return [_to_rest_value(v) for v in value]
+    return value
+
+
+def _record_to_dict(record):
+    return {k: _to_rest_value(v) for k, v in record.items()} if record is not None else None
+
+
+_SQL_CALL = re.compile(r"^\s*SELECT\s+(?:\*\s+FROM\s+)?(\w+)\(\$", re.IGNORECASE)
+_SQL_TARGET = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def _sql_labels(sql: str) -> tuple:
+    """استخراج (الجدول، العملية) من نص الاستعلام لتصنيفه في /metrics"""
+    call = _SQL_CALL.match(sql)
+    if call:
+        return call.group(1), "rpc"
+    target = _SQL_TARGET.search(sql)
+    return (target.group(1) if target else "unknown"), sql.split(None, 1)[0].lower()
+
+
+def _ident(name: str) -> str:
+    """تغليف اسم العمود بعلامات اقتباس لمنع حقن SQL عبر مفاتيح القاموس"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class AsyncpgDatabase(Database):
+    """
+    نفس واجهة Database لكن الاستعلامات تمر عبر مجمع اتصالات asyncpg مباشرة
+    إلى PostgreSQL (بدون خيط منفصل ولا طلب HTTP إلى PostgREST لكل استعلام).
+    التفعيل: DB_BACKEND=asyncpg مع DATABASE_URL (اتصال مباشر أو Session Pooler
+    لأن وضع Transaction Pooler لا يدعم الـ Prepared Statements).
+    عميل سوبابيس يبقى متاحاً للاستعلامات المكتوبة مباشرة في بقية الملفات.
+    """
+
+    def _initialize(self):
+        super()._initialize()
+        self.dsn = os.getenv("DATABASE_URL")
+        if not self.dsn:
+            raise ValueError("❌ مطلوب DATABASE_URL عند استخدام DB_BACKEND=asyncpg")
+        self.pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+        self.pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+        self._pool = None
+        self._pool_lock = None
+        self._config_listener = None
+
+    async def _init_connection(self, conn):
+        """تجهيز كل اتصال جديد: تحويل json/jsonb تلقائياً إلى قواميس بايثون"""
+        for type_name in ('json', 'jsonb'):
+            await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def get_pool(self):
+        """إنشاء المجمع عند أول استخدام (لأن الـ event loop غير موجود وقت الاستيراد)"""
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    import asyncpg
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.pool_min_size,
+                        max_size=self.pool_max_size,
+                        init=self._init_connection,
+                    )
+                    logger.info(f"✅ تم تهيئة مجمع اتصالات asyncpg ({self.pool_min_size}-{self.pool_max_size})")
+        return self._pool
+
+    async def close(self):
+        if self._config_listener is not None:
+            await self._config_listener.close()
+            self._config_listener = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    # --- أدوات التنفيذ (asyncpg يحتفظ بالـ Prepared Statements في ذاكرة كل اتصال تلقائياً) ---
+
+    async def _fetch(self, sql: str, *args):
+        pool = await self.get_pool()
+        with query_metrics.track(*_sql_labels(sql)) as timer:
+            rows = await pool.fetch(sql, *args, timeout=self.executor.timeout)
+            timer.rows = len(rows)
+        return [_record_to_dict(r) for r in rows]
+
+    async def _fetchrow(self, sql: str, *args):
+        pool = await self.get_pool()
+        with query_metrics.track(*_sql_labels(sql)) as timer:
+            row = await pool.fetchrow(sql, *args, timeout=self.executor.timeout)
+            timer.rows = 1 if row is not None else 0
+        return _record_to_dict(row)
+
+    async def _fetchval(self, sql: str, *args):
+        pool = await self.get_pool()
+        with query_metrics.track(*_sql_labels(sql)):
+            return await pool.fetchval(sql, *args, timeout=self.executor.timeout)
+
+    @staticmethod
+    def _record_exprs(data: dict, alias: str = "r"):
+        """
+        تجهيز الأعمدة والقيم: القيم تمر عبر jsonb_populate_record ليحوّلها PostgreSQL
+        لأنواع الأعمدة الصحيحة (كما يفعل PostgREST)، والقيمة "now()" تُنفذ كدالة.
+        """
+        cols, exprs, payload = [], [], {}
+        for key, value in data.items():
+            col = _ident(key)
+            cols.append(col)
+            if isinstance(value, str) and value == "now()":
+                exprs.append("now()")
+            else:
+                exprs.append(f"{alias}.{col}")
+                payload[key] = value
+        return cols, exprs, payload
+
+    async def _insert(self, table: str, data: dict, on_conflict: List[str] = None):
+        cols, exprs, payload = self._record_exprs(data)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(cols)}) "
+            f"SELECT {', '.join(exprs)} FROM jsonb_populate_record(NULL::{table}, $1::jsonb) AS r"
+        )
+        if on_conflict:
+            conflict_cols = [_ident(c) for c in on_conflict]
+            updates = [f"{c} = EXCLUDED.{c}" for c in cols if c not in conflict_cols]
+            action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+            sql += f" ON CONFLICT ({', '.join(conflict_cols)}) {action}"
+        return await self._fetch(sql + " RETURNING *", payload)
+
+    async def _update(self, table: str, data: dict, key_column: str, key_value):
+        cols, exprs, payload = self._record_exprs(data)
+        assignments = ", ".join(f"{c} = {e}" for c, e in zip(cols, exprs))
+        sql = (
+            f"UPDATE {table} AS t SET {assignments} "
+            f"FROM jsonb_populate_record(NULL::{table}, $1::jsonb) AS r "
+            f"WHERE t.{_ident(key_column)} = $2 RETURNING t.*"
+        )
+        return await self._fetch(sql, payload, key_value)
+
+    # ============ 1. دوال المهام اليومية ============
+
+    async def get_player_daily_logs(self, player_id: str, log_date: str):
+        return await self._fetch(
+            "SELECT * FROM player_daily_quests WHERE player_id = $1 AND log_date = $2",
+            player_id, date.fromisoformat(log_date)
+        )
+
+    async def upsert_daily_quest(self, data: dict):
+        rows = await self._insert('player_daily_quests', data, on_conflict=['player_id', 'task_id', 'log_date'])
+        self.progress.record(data)
+        return rows
+
+    async def _fetch_daily_progress(self, player_id: str, log_date: str):
+        return await self._fetchrow(
+            "SELECT * FROM player_daily_progress WHERE player_id = $1 AND log_date = $2",
+            player_id, date.fromisoformat(log_date)
+        )
+
+    async def _fetch_daily_progress_page(self, log_date: str, after: str, limit: int):
+        if after:
+            return await self._fetch(
+                "SELECT player_id, log_date, tasks FROM player_daily_progress WHERE log_date = $1 AND player_id > $2"
+                " ORDER BY player_id LIMIT $3",
+                date.fromisoformat(log_date), after, limit
+            )
+        return await self._fetch(
+            "SELECT player_id, log_date, tasks FROM player_daily_progress WHERE log_date = $1 ORDER BY player_id LIMIT $2",
+            date.fromisoformat(log_date), limit
+        )
+
+    async def _fetch_daily_logs_page(self, log_date: str, after: tuple, limit: int):
+        if after:
+            return await self._fetch(
+                "SELECT * FROM player_daily_quests WHERE log_date = $1 AND (player_id, task_id) > ($2, $3)"
+                " ORDER BY player_id, task_id LIMIT $4",
+                date.fromisoformat(log_date), after[0], after[1], limit
+            )
+        return await self._fetch(
+            "SELECT * FROM player_daily_quests WHERE log_date = $1 ORDER BY player_id, task_id LIMIT $2",
+            date.fromisoformat(log_date), limit
+        )
+
+    # ============ 2. التأثيرات النشطة ============
+
+    async def get_active_buffs(self, player_id: str):
+        # نمرر الوقت المحلي بدون منطقة زمنية ليُقارن بنفس طريقة نسخة سوبابيس
+        return Buff.from_rows(await self._fetch(
+            "SELECT * FROM player_buffs WHERE player_id = $1 AND expires_at > $2",
+            player_id, datetime.now()
+        ))
+
+    async def get_active_buffs_by_player(self, buff_type: str) -> Dict[str, List[dict]]:
+        rows = await self._fetch(
+            "SELECT * FROM player_buffs WHERE buff_type = $1 AND expires_at > $2",
+            buff_type, datetime.now()
+        )
+        grouped = {}
+        for buff in Buff.from_rows(rows):
+            grouped.setdefault(buff['player_id'], []).append(buff)
+        return grouped
+
+    async def _fetch_player_inventory(self, player_id: str, equipped_only: bool):
+        equipped = " AND i.is_equipped" if equipped_only else ""
+        return await self._fetch(
+            "SELECT i.*, to_jsonb(s) AS item FROM player_inventory i"
+            f" LEFT JOIN system_shop_items s ON s.id = i.item_id WHERE i.player_id = $1{equipped}",
+            player_id
+        )
+
+    async def add_player_buff(self, buff_data: dict):
+        return await self._insert('player_buffs', buff_data)
+
+    # ============ دوال اللاعبين ============
+
+    async def _select_player(self, column: str, value: str):
+        return await self._fetchrow(f"SELECT * FROM players WHERE {_ident(column)} = $1", value)
+
+    async def _fetch_players_page(self, columns: list, after: str, limit: int, where: dict, exclude_status: str):
+        select = '*' if columns == ['*'] else ', '.join(_ident(c) for c in columns)
+        conditions, args = [], []
+        if exclude_status:
+            args.append(exclude_status)
+            conditions.append(f"status <> ${len(args)}")
+        for col, value in (where or {}).items():
+            args.append(value)
+            conditions.append(f"{_ident(col)} = ${len(args)}")
+        if after:
+            args.append(after)
+            conditions.append(f"id > ${len(args)}")
+        args.append(limit)
+        where_sql = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return await self._fetch(f"SELECT {select} FROM players{where_sql} ORDER BY id LIMIT ${len(args)}", *args)
+
+    async def create_player(self, data: dict):
+        try:
+            rows = await self._insert('players', data)
+            player = Player.from_row(rows[0]) if rows else None
+            self.player_cache.put(player)
+            return player
+        except Exception as e:
+            logger.error(f"Error creating player: {e}")
+            return None
+
+    async def update_player(self, discord_id: str, data: dict):
+        try:
+            rows = await self._update('players', data, 'discord_id', discord_id)
+        except Exception:
+            self.player_cache.invalidate(discord_id=discord_id)
+            raise
+        self._refresh_cached_player(rows, discord_id=discord_id)
+        if 'status' in data: self.invalidate_level_histogram()
+        return rows
+
+    async def increment_player(self, discord_id: str, deltas: dict, floor=None, cap=None, strict: bool = False):
+        row = self._increment_row(discord_id, deltas, floor, cap, strict)
+        try:
+            rows = await self._fetch(
+                "SELECT * FROM increment_player($1, $2::jsonb, $3::jsonb, $4::jsonb, $5)",
+                row['key'], row['deltas'], row['floor'], row['cap'], strict
+            )
+        except Exception:
+            self.player_cache.invalidate(discord_id=discord_id)
+            raise
+        self._refresh_cached_player(rows, discord_id=discord_id)
+        return rows[0] if rows else None
+
+    async def delete_player(self, discord_id: str):
+        try:
+            return await self._fetch("DELETE FROM players WHERE discord_id = $1 RETURNING id", discord_id)
+        finally:
+            self.player_cache.invalidate(discord_id=discord_id)
+
+    async def get_player_count(self):
+        return await self._fetchval("SELECT count(*) FROM players")
+
+    async def get_top_players(self, limit=10):
+        return await self._fetch(
+            "SELECT username, total_level, rank, total_xp FROM players "
+            "ORDER BY total_level DESC, total_xp DESC LIMIT $1",
+            limit
+        )
+
+    # ============ نظام العقوبات ============
+
+    async def apply_penalty(self, player_id: str, task_data: dict) -> Dict[str, Any]:
+        try:
+            from questions import PenaltySystem
+            penalty = PenaltySystem().generate_penalty(
+                task_level=task_data.get("task_level", 1),
+                task_type=task_data.get("task_type", "general"),
+                player_level=task_data.get("player_level", 1)
+            )
+            rows = await self._insert('penalties', {
+                "player_id": player_id,
+                "penalty_type": penalty["type"],
+                "description": penalty["description"],
+                "amount": penalty["amount"],
+                "currency": penalty["currency"],
+                "category": penalty.get("category"),
+                "task_data": task_data,
+                "status": "pending",
+                "requires_proof": penalty.get("requires_proof", False),
+                "created_at": "now()"
+            })
+            if rows:
+                penalty["id"] = rows[0]["id"]
+                logger.info(f"✅ تم تطبيق عقوبة: {penalty['type']}")
+                return penalty
+            return None
+        except Exception as e:
+            logger.error(f"خطأ في تطبيق العقوبة: {e}")
+            return None
+
+    # ============ دوال إضافية ============
+
+    async def log_activity(self, player_id: str, activity_data: dict):
+        try:
+            activity_data["player_id"] = player_id
+            activity_data["created_at"] = "now()"
+            rows = await self._insert('activities', activity_data)
+            return rows[0] if rows else None
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل النشاط: {e}")
+            return None
+
+    async def get_active_portals(self, guild_id: str = None):
+        try:
+            if guild_id:
+                return await self._fetch(
+                    "SELECT * FROM portals WHERE status = 'active' AND discord_guild_id = $1", guild_id
                 )
-                
-                # 3. حساب المستوى والرتبة (نستورد الدوال الحسابية هنا لتجنب التداخل)
-                from questions import calculate_level_progressive
-                level, _, _ = calculate_level_progressive(total_xp)
-                
-                # حساب الرتبة
-                rank = "E"
-                if level >= 100: rank = "SS"
-                elif level >= 80: rank = "S"
-                elif level >= 60: rank = "A"
-                elif level >= 40: rank = "B"
-                elif level >= 20: rank = "C"
-                elif level >= 10: rank = "D"
-                
-                # 4. التحديث
-                return self.client.table('players').update({
-                    'total_level': level,
-                    'total_xp': total_xp,
-                    'rank': rank
-                }).eq('id', player_id).execute()
-
-            await self._execute_async(query)
-            logger.info(f"🔄 تم تحديث مستوى اللاعب {player_id} تلقائياً.")
+            return await self._fetch("SELECT * FROM portals WHERE status = 'active'")
         except Exception as e:
+            logger.error(f"خطأ في جلب البوابات: {e}")
+            return []
+
+    # ============ دوال البوابات ============
+
+    async def _fetch_portal(self, portal_id: str):
+        return await self._fetchrow("SELECT * FROM portal_history WHERE id = $1", portal_id)
+
+    async def _fetch_open_portals(self):
+        return await self._fetch("SELECT * FROM portal_history WHERE status IN ('recruiting', 'active')")
+
+    async def _fetch_participants(self, portal_id: str, player_id: str = None):
+        player_filter = " AND pp.player_id = $2" if player_id else ""
+        return await self._fetch(
+            "SELECT pp.*, json_build_object('discord_id', p.discord_id, 'username', p.username) AS players"
+            " FROM portal_participants pp JOIN players p ON p.id = pp.player_id"
+            f" WHERE pp.portal_id = $1{player_filter}",
+            *((portal_id, player_id) if player_id else (portal_id,))
+        )
+
+    async def update_portal_participants(self, portal_id: str, participants: list):
+        return await self._update('portal_history', {'participants_ids': participants}, 'id', portal_id)
+
+    async def apply_global_penalty(self, category: str, amount: int):
+        try:
+            return await self._fetchval("SELECT apply_global_xp_penalty($1, $2)", category, amount)
+        finally:
+            self.player_cache.clear()
+            self.invalidate_level_histogram()
+
+    async def _fetch_system_config(self) -> List[dict]:
+        return await self._fetch("SELECT * FROM system_config")
+
+    async def _fetch_config_version(self):
+        return await self._fetchval("SELECT max(version) FROM system_config")
+
+    async def _listen_config_changes(self, on_change, on_disconnect) -> bool:
+        """اتصال مخصص يستمع لقناة system_config_changed (يطلقها trigger الجدول)"""
+        import asyncpg
+        conn = await asyncpg.connect(self.dsn)
+        await conn.add_listener('system_config_changed', lambda _conn, _pid, _channel, key: on_change(key))
+        conn.add_termination_listener(lambda _conn: on_disconnect())
+        self._config_listener = conn
+        logger.info("📡 الاستماع لتغييرات system_config عبر LISTEN/NOTIFY")
+        return True
+
+    async def _fetch_last_portal_time(self):
+        return _to_rest_value(await self._fetchval(
+            "SELECT created_at FROM portal_history ORDER BY created_at DESC LIMIT 1"
+        ))
+
+    async def _fetch_shop_items(self, item_type: str = None):
+        if item_type:
+            return await self._fetch(
+                "SELECT * FROM system_shop_items WHERE is_available = true AND type = $1", item_type
+            )
+        return await self._fetch("SELECT * FROM system_shop_items WHERE is_available = true")
+
+    async def _fetch_portal_quests(self) -> List[dict]:
+        return await self._fetch("SELECT * FROM system_portal_quests")
+
+    async def _fetch_level_histogram(self) -> List[dict]:
+        return await self._fetch(
+            "SELECT total_level AS level, count(*) AS players FROM players"
+            " WHERE status = 'active' AND total_level IS NOT NULL GROUP BY total_level"
+        )
+
+    async def _write_system_config(self, key: str, value):
+        return await self._insert('system_config', {'key': key, 'value': value}, on_conflict=['key'])
+
+    async def recalculate_player_stats(self, player_id: str):
+        try:
+            row = await self._fetchrow("SELECT * FROM recalculate_player_stats($1)", player_id)
+            if row:
+                self.player_cache.patch(player_id, row)
+                self.invalidate_level_histogram()
+                logger.info(f"🔄 تم تحديث مستوى اللاعب {player_id} تلقائياً.")
+            return row
+        except Exception as e:
+            self.player_cache.invalidate(player_id=player_id)
             logger.error(f"Stats Recalc Error: {e}")
-        
-# إنشاء نسخة وحيدة من قاعدة البيانات
-db = Database()
\ No newline at end of file
+            return None
+
+    async def recalculate_players_stats(self, player_ids: list) -> List[dict]:
+        try:
+            rows = await self._fetch("SELECT * FROM recalculate_players_stats($1::uuid[])", player_ids)
+        except Exception:
+            for pid in player_ids:
+                self.player_cache.invalidate(player_id=pid)
+            raise
+        for row in rows:
+            self.player_cache.patch(row['id'], row)
+        if rows: self.invalidate_level_histogram()
+        return rows
+
+
+    # ============ دوال الكتابة المجمعة ============
+
+    async def bulk_update_players(self, updates: List[dict]):
+        try:
+            return await self._fetchval("SELECT bulk_update_players($1::jsonb)", updates)
+        finally:
+            for row in updates:
+                self.player_cache.invalidate(player_id=row['id'])
+
+    async def bulk_increment_players(self, rows: List[dict]):
+        try:
+            return await self._fetch("SELECT * FROM increment_players($1::jsonb, 'id')", rows)
+        finally:
+            for row in rows:
+                self.player_cache.invalidate(player_id=row['key'])
+
+    async def bulk_insert(self, table: str, rows: List[dict]):
+        # نجمع الصفوف حسب أعمدتها حتى لا تُملأ الأعمدة الناقصة بـ NULL بدل القيم الافتراضية
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        inserted = []
+        for keys, group in groups.items():
+            cols, exprs, _ = self._record_exprs(dict.fromkeys(keys))
+            inserted += await self._fetch(
+                f"INSERT INTO {table} ({', '.join(cols)}) "
+                f"SELECT {', '.join(exprs)} FROM jsonb_populate_recordset(NULL::{table}, $1::jsonb) AS r RETURNING *",
+                group
+            )
+        return inserted
+
+    async def bulk_delete(self, table: str, ids: list):
+        return await self._fetch(
+            f"DELETE FROM {table} AS t USING jsonb_populate_recordset(NULL::{table}, $1::jsonb) AS r"
+            " WHERE t.id = r.id RETURNING t.id",
+            [{'id': i} for i in ids]
+        )
+
+# إنشاء نسخة وحيدة من قاعدة البيانات (المحرك يُختار عبر DB_BACKEND: supabase أو asyncpg)
+if os.getenv("DB_BACKEND", "supabase").lower() == "asyncpg":
+    db = AsyncpgDatabase()
+else:
+    db = Database()
\ No newline at end of file
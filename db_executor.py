@@ -0,0 +1,113 @@
+# db_executor.py
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# هل الكود الحالي جزء من دورة خلفية (توزيع المهام / ساعة الحساب / فحص البوابات)؟
+_background = contextvars.ContextVar("db_background", default=False)
+
+
+class DatabaseBusyError(RuntimeError):
+    """طابور قاعدة البيانات ممتلئ: نرفض الطلب فوراً بدل الانتظار الطويل"""
+
+
+@contextmanager
+def background_lane():
+    """
+    كل استعلام داخل هذه الكتلة يُحسب على مسار الخلفية المحدود،
+    حتى تبقى بقية الخيوط متاحة لأوامر اللاعبين أثناء الدورات الكبيرة.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class DatabaseExecutor:
+    """
+    مجمع خيوط خاص باستعلامات سوبابيس (بدلاً من المنفذ الافتراضي المشترك لـ asyncio.to_thread):
+    - عدد خيوط ثابت + طابور انتظار محدود، وعند امتلائه يُرفض الطلب التفاعلي فوراً (DatabaseBusyError)
+    - مسار الخلفية لا يشغل أكثر من background_workers خيط في نفس الوقت (وينتظر دوره ولا يُرفض)
+    - مهلة لكل استعلام، والطلب الذي انتهت مهلته قبل أن يبدأ لا يُنفذ أصلاً
+    """
+
+    def __init__(self, max_workers: int = 8, max_queue: int = 64, background_workers: int = None, timeout: float = 15.0):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queue
+        self.background_workers = background_workers or max(1, max_workers // 2)
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._background_slots = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_wait = Histogram()
+
+    async def run(self, func, timeout: float = None):
+        if _background.get():
+            if self._background_slots is None:
+                self._background_slots = asyncio.Semaphore(self.background_workers)
+            async with self._background_slots:
+                return await self._submit(func, timeout)
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise DatabaseBusyError(f"طابور قاعدة البيانات ممتلئ ({self.pending} طلب معلق)")
+        return await self._submit(func, timeout)
+
+    async def _submit(self, func, timeout: float = None):
+        enqueued = time.perf_counter()
+        abandoned = threading.Event()
+
+        def job():
+            with self._lock:
+                self.queue_wait.observe(time.perf_counter() - enqueued)
+                self.running += 1
+            try:
+                if abandoned.is_set():
+                    raise asyncio.TimeoutError("انتهت المهلة قبل بدء التنفيذ")
+                return func()
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._pool, job)
+        # العداد ينقص عند انتهاء الخيط فعلياً (وليس عند انتهاء المهلة) ليعكس الضغط الحقيقي
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            abandoned.set()
+            self.timeouts += 1
+            logger.warning(f"⏱️ استعلام تجاوز المهلة ({timeout or self.timeout} ث)")
+            raise
+
+    def _release(self, future):
+        self.pending -= 1
+        # استهلاك الاستثناء حتى لا يظهر تحذير "exception was never retrieved" بعد انتهاء المهلة
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": max(0, self.pending - self.running),
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,138 @@
+# delivery.py
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+import discord
+
+from metrics import delivery_metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # علامة نهاية الطابور لكل مرسل
+
+
+class DeliveryPipeline:
+    """
+    إرسال رسائل خاصة لعدد كبير من اللاعبين بالتوازي بدل لاعب واحد كل 0.6 ثانية:
+    - عدد ثابت من المرسلين المتزامنين (concurrency)
+    - max_per_second حد لطلبات API الفعلية لا للعناصر: كل عنصر يحجز مكاناً لطلب الإرسال،
+      و pace() يحجز مكاناً لكل طلب إضافي (جلب المستخدم أو فتح الخاص عند غيابهما من الذاكرة)،
+      فالقيمة الافتراضية (25 طلب/ث) تبقى تحت الحد العام لديسكورد (50 طلب/ث) مع هامش لبقية البوت
+    - حدود كل مسار (bucket) و 429 يعالجها discord.py نفسه من ترويسات الرد وينتظر ثم يعيد الطلب؛
+      إذا تجاوز الانتظار max_ratelimit_timeout للبوت يرفع RateLimited فننتظر retry_after ثم نعيد المحاولة
+    - 429 أو 5xx بعد أن استنفد discord.py محاولاته: تراجع أُسي (2، 4، ...) ثم إعادة المحاولة
+    - الخاص المغلق (403) أو الحساب المحذوف (404) فشل نهائي بدون إعادة محاولة
+    """
+
+    def __init__(self, name: str, concurrency: int = 8, max_per_second: float = 25.0, max_retries: int = 3):
+        self.name = name
+        self.concurrency = concurrency
+        self.min_interval = 1.0 / max_per_second if max_per_second else 0.0
+        self.max_retries = max_retries
+        self._next_slot = 0.0
+        self._slot_lock = asyncio.Lock()
+
+    async def run(self, items, send, deadline: datetime = None, progress_every: int = 250) -> dict:
+        """
+        send(item) كوروتين يرسل لعنصر واحد. يعيد ملخصاً:
+        {"sent", "failed", "skipped", "expired", "seconds", "per_second"}
+        أي send يعيد False يُحسب skipped (لا يوجد ما يُرسل لهذا اللاعب)،
+        وبعد deadline لا يبدأ أي إرسال جديد وتُحسب العناصر المتبقية expired.
+        items قائمة أو مولد غير متزامن (مثل db.iter_players): مع المولد يبدأ الإرسال
+        من أول صفحة، والطابور محدود فلا يُقرأ من المصدر أسرع مما يُرسل.
+        """
+        streaming = hasattr(items, "__aiter__")
+        total = "?" if streaming else len(items)
+        workers = self.concurrency if streaming else (min(self.concurrency, len(items)) or 1)
+        queue = asyncio.Queue(maxsize=workers * 4)
+        summary = {"sent": 0, "failed": 0, "skipped": 0, "expired": 0}
+        started = time.perf_counter()
+
+        async def produce():
+            try:
+                if streaming:
+                    async for item in items:
+                        await queue.put(item)
+                else:
+                    for item in items:
+                        await queue.put(item)
+            finally:
+                for _ in range(workers):
+                    await queue.put(_DONE)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if deadline and datetime.now() >= deadline:
+                    outcome = "expired"
+                else:
+                    outcome = await self._deliver(item, send)
+                summary[outcome] += 1
+
+                done = summary["sent"] + summary["failed"] + summary["skipped"]
+                if outcome != "expired" and done % progress_every == 0:
+                    logger.info(f"📬 [{self.name}] تقدم الإرسال: {done}/{total}")
+
+        await asyncio.gather(produce(), *(worker() for _ in range(workers)))
+
+        summary["seconds"] = round(time.perf_counter() - started, 1)
+        summary["per_second"] = round(summary["sent"] / summary["seconds"], 2) if summary["seconds"] else 0.0
+        if summary["expired"]:
+            logger.warning(f"⏰ [{self.name}] انتهى الوقت قبل إرسال {summary['expired']} رسالة")
+        logger.info(f"📬 [{self.name}] اكتمل الإرسال: {summary}")
+        return summary
+
+    async def _deliver(self, item, send) -> str:
+        for attempt in range(1, self.max_retries + 1):
+            await self.pace()
+            started = time.perf_counter()
+            try:
+                result = await send(item)
+            except (discord.Forbidden, discord.NotFound) as e:
+                delivery_metrics.observe(self.name, "closed", time.perf_counter() - started)
+                logger.debug(f"[{self.name}] لا يمكن الإرسال: {e}")
+                return "failed"
+            except discord.RateLimited as e:
+                # ليس HTTPException: انتظار المسار أطول من max_ratelimit_timeout فترك discord.py القرار لنا
+                delivery_metrics.observe(self.name, "retry", time.perf_counter() - started)
+                logger.warning(f"⏳ [{self.name}] 429 - إعادة المحاولة بعد {e.retry_after:.1f} ث")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except discord.HTTPException as e:
+                elapsed = time.perf_counter() - started
+                if e.status == 429 or e.status >= 500:
+                    delivery_metrics.observe(self.name, "retry", elapsed)
+                    retry_after = 2 ** attempt
+                    logger.warning(f"⏳ [{self.name}] {e.status} - إعادة المحاولة بعد {retry_after:.1f} ث")
+                    await asyncio.sleep(retry_after)
+                    continue
+                delivery_metrics.observe(self.name, "error", elapsed)
+                logger.warning(f"⚠️ [{self.name}] فشل الإرسال: {e}")
+                return "failed"
+            except Exception as e:
+                delivery_metrics.observe(self.name, "error", time.perf_counter() - started)
+                logger.warning(f"⚠️ [{self.name}] فشل الإرسال: {e}")
+                return "failed"
+
+            if result is False:
+                return "skipped"
+            delivery_metrics.observe(self.name, "sent", time.perf_counter() - started)
+            return "sent"
+
+        delivery_metrics.observe(self.name, "error", 0.0)
+        return "failed"
+
+    async def pace(self):
+        """حجز مكان لطلب API واحد: توزيع الطلبات على فترات متساوية بدل إرسالها دفعة واحدة"""
+        if not self.min_interval:
+            return
+        async with self._slot_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.min_interval
+        if wait > 0:
+            await asyncio.sleep(wait)
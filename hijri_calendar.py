@@ -0,0 +1,97 @@
+# hijri_calendar.py
+import logging
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+from hijri_converter import Gregorian
+
+logger = logging.getLogger(__name__)
+
+FRIDAY = 4  # 0=الأثنين ... 4=الجمعة
+
+
+class DayInfo(NamedTuple):
+    """يوم واحد في الجدول: التاريخ الميلادي والهجري والعلامات المشتقة منهما"""
+    date: date
+    weekday: int
+    hijri_year: int
+    hijri_month: int
+    hijri_day: int
+
+    @property
+    def is_friday(self) -> bool:
+        return self.weekday == FRIDAY
+
+    @property
+    def is_first_of_month(self) -> bool:
+        return self.date.day == 1
+
+    @property
+    def is_white_day(self) -> bool:
+        """الأيام البيض (13، 14، 15 من الشهر الهجري)"""
+        return self.hijri_day in (13, 14, 15)
+
+    @property
+    def is_ashura(self) -> bool:
+        return self.hijri_month == 1 and self.hijri_day == 10
+
+    @property
+    def is_mon_thu(self) -> bool:
+        """صيام الإثنين والخميس"""
+        return self.weekday in (0, 3)
+
+    @property
+    def is_ramadan(self) -> bool:
+        return self.hijri_month == 9
+
+    @property
+    def seasonal_key(self) -> str:
+        """مفتاح البوابات الموسمية في system_portal_quests (مثال: 10-1 لعيد الفطر)"""
+        return f"{self.hijri_month}-{self.hijri_day}"
+
+    @property
+    def context(self) -> tuple:
+        """(رقم اليوم في الأسبوع، اليوم من الشهر، اليوم الهجري، الشهر الهجري) لفهرس المهام"""
+        return self.weekday, self.date.day, self.hijri_day, self.hijri_month
+
+
+class HijriCalendar:
+    """
+    جدول تحويل ميلادي ← هجري محسوب مسبقاً عند التشغيل (سنة للخلف وعدة سنوات للأمام)،
+    فكل سؤال عن التاريخ (مهام اليوم، البوابات الموسمية، تذكير الصيام) هو بحث في قاموس.
+    التواريخ خارج الجدول تُحسب عند الطلب وتُضاف إليه.
+    """
+
+    def __init__(self, years_ahead: int = 3, years_back: int = 1):
+        today = date.today()
+        start = today - timedelta(days=365 * years_back)
+        end = today + timedelta(days=365 * years_ahead)
+        self._days = {}
+        day = start
+        while day <= end:
+            self._days[day] = self._convert(day)
+            day += timedelta(days=1)
+        logger.info(f"📅 تم تجهيز جدول التقويم الهجري ({len(self._days)} يوم)")
+
+    @staticmethod
+    def _convert(day: date) -> DayInfo:
+        hijri = Gregorian(day.year, day.month, day.day).to_hijri()
+        return DayInfo(day, day.weekday(), hijri.year, hijri.month, hijri.day)
+
+    def day(self, when=None) -> DayInfo:
+        """معلومات يوم معين (date أو datetime)، والافتراضي اليوم الحالي"""
+        when = when or datetime.now()
+        day = when.date() if isinstance(when, datetime) else when
+        info = self._days.get(day)
+        if info is None:
+            info = self._days[day] = self._convert(day)
+        return info
+
+    def today(self) -> DayInfo:
+        return self.day()
+
+    def tomorrow(self) -> DayInfo:
+        return self.day(datetime.now() + timedelta(days=1))
+
+
+hijri_calendar = HijriCalendar()
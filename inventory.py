@@ -27,13 +27,7 @@ class InventoryView(View):
 
     async def load_inventory(self):
         """جلب عناصر المخزن"""
-        response = await db._execute_async(
-            lambda: db.client.table('player_inventory')
-            .select('*, item:system_shop_items(*)')
-            .eq('player_id', self.player_data['id'])
-            .execute()
-        )
-        self.inventory_items = response.data
+        self.inventory_items = await db.get_player_inventory(self.player_data['id'])
 
     async def update_view(self, interaction: discord.Interaction):
         self.clear_items()
@@ -152,7 +146,7 @@ class InventoryView(View):
             
             if inv_item['is_equipped']:
                 # خلع
-                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': False, 'equipped_slot': None}).eq('id', inv_item['id']).execute())
+                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': False, 'equipped_slot': None}).eq('id', inv_item['id']).execute(), table='player_inventory', op='update')
                 await interaction.followup.send(f"✅ تم خلع **{item_details['name']}**.", ephemeral=True)
             else:
                 # ارتداء
@@ -163,9 +157,9 @@ class InventoryView(View):
 
                 slot_type = item_details['type']
                 # إلغاء ارتداء القديم في نفس المكان
-                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': False, 'equipped_slot': None}).eq('player_id', self.player_data['id']).eq('equipped_slot', slot_type).execute())
+                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': False, 'equipped_slot': None}).eq('player_id', self.player_data['id']).eq('equipped_slot', slot_type).execute(), table='player_inventory', op='update')
                 # ارتداء الجديد
-                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': True, 'equipped_slot': slot_type}).eq('id', inv_item['id']).execute())
+                await db._execute_async(lambda: db.client.table('player_inventory').update({'is_equipped': True, 'equipped_slot': slot_type}).eq('id', inv_item['id']).execute(), table='player_inventory', op='update')
                 await interaction.followup.send(f"⚔️ تم تجهيز **{item_details['name']}** بنجاح!", ephemeral=True)
 
             await self.load_inventory()
@@ -188,7 +182,7 @@ class InventoryView(View):
                 
                 portal_cog = self.bot.get_cog("PortalSystem")
                 if portal_cog:
-                    await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                    await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                     await portal_cog.create_private_portal(interaction, target_level, tier)
                     return 
                 else:
@@ -205,11 +199,11 @@ class InventoryView(View):
                     max_d = item['item']['stats'].get('max_durability', 100)
                     if curr < max_d:
                         new_dur = min(max_d, curr + amount)
-                        await db._execute_async(lambda: db.client.table('player_inventory').update({'current_durability': new_dur}).eq('id', item['id']).execute())
+                        await db._execute_async(lambda: db.client.table('player_inventory').update({'current_durability': new_dur}).eq('id', item['id']).execute(), table='player_inventory', op='update')
                         repaired += 1
                 
                 msg = f"✅ تم إصلاح {repaired} قطعة!" if repaired else "⚠️ معداتك سليمة تماماً."
-                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                 await interaction.followup.send(msg, ephemeral=True)
 
             # --- ⚡ 3. استعادة الطاقة ---
@@ -220,9 +214,13 @@ class InventoryView(View):
                 if curr_en >= max_en:
                     await interaction.followup.send("⚡ طاقتك ممتلئة بالفعل!", ephemeral=True)
                     return 
-                new_en = min(max_en, curr_en + amount)
-                await db._execute_async(lambda: db.client.table('players').update({'current_energy': new_en}).eq('id', self.player_data['id']).execute())
-                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                # إضافة ذرية مقصوصة عند الحد الأقصى (بدل كتابة قيمة محسوبة من نسخة قديمة)
+                updated = await db.increment_player(str(self.user_id), {'current_energy': amount}, cap={'current_energy': max_en})
+                if not updated:
+                    await interaction.followup.send("❌ لم يتم العثور على بياناتك!", ephemeral=True)
+                    return
+                new_en = updated['current_energy']
+                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                 await interaction.followup.send(f"✅ تم شحن الطاقة: {curr_en} ➔ {new_en} ⚡", ephemeral=True)
 
             # --- 🧪 4. تفعيل مضاعف الخبرة (XP Boost) ---
@@ -238,8 +236,8 @@ class InventoryView(View):
                     "value": xp_boost,
                     "expires_at": expiry
                 }
-                await db._execute_async(lambda: db.client.table('player_buffs').insert(buff_data).execute())
-                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                await db._execute_async(lambda: db.client.table('player_buffs').insert(buff_data).execute(), table='player_buffs', op='insert')
+                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                 await interaction.followup.send(f"🧪 تفعيل مؤقت: حصلت على زيادة {int(xp_boost*100)}% XP لمدة {duration} ساعة!", ephemeral=True)
 
             # --- ❄️ 5. حماية الستريك (Streak Freeze) ---
@@ -252,8 +250,8 @@ class InventoryView(View):
                     "value": 1,
                     "expires_at": expiry
                 }
-                await db._execute_async(lambda: db.client.table('player_buffs').insert(buff_data).execute())
-                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                await db._execute_async(lambda: db.client.table('player_buffs').insert(buff_data).execute(), table='player_buffs', op='insert')
+                await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                 await interaction.followup.send(f"❄️ تم تفعيل الحماية! ستريكك محمي من الفشل لمدة 24 ساعة.", ephemeral=True)
 
             # --- 📜 6. إزالة عقوبة مالية (صك الغفران) ---
@@ -261,13 +259,13 @@ class InventoryView(View):
                 # جلب أقدم عقوبة مالية معلقة
                 penalties = await db._execute_async(lambda: db.client.table('penalties')
                     .select('*').eq('player_id', self.player_data['id'])
-                    .eq('status', 'pending').order('created_at').limit(1).execute())
+                    .eq('status', 'pending').order('created_at').limit(1).execute(), table='penalties', op='select')
                 
                 if penalties.data:
                     await db._execute_async(lambda: db.client.table('penalties')
                         .update({'status': 'forgiven', 'forgiven_reason': 'استخدام صك الغفران'})
-                        .eq('id', penalties.data[0]['id']).execute())
-                    await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute())
+                        .eq('id', penalties.data[0]['id']).execute(), table='penalties', op='update')
+                    await db._execute_async(lambda: db.client.table('player_inventory').delete().eq('id', inv_item['id']).execute(), table='player_inventory', op='delete')
                     await interaction.followup.send(f"📜 تم مسح عقوبة بقيمة **{penalties.data[0]['amount']}** بنجاح!", ephemeral=True)
                 else:
                     await interaction.followup.send("⚠️ ليس لديك عقوبات مالية معلقة حالياً.", ephemeral=True)
@@ -0,0 +1,118 @@
+# journal.py
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "data/journal")
+
+
+class CycleJournal:
+    """
+    سجل محلي (سطر JSON لكل حدث) لدورة يومية واحدة مثل توزيع المهام أو ساعة الحساب.
+    يُكتب بعد إنجاز كل لاعب، فإذا أُعيد تشغيل البوت أثناء الدورة تُستكمل
+    للاعبين الذين لم يُسجل لهم شيء فقط بدل تخطيهم أو إعادة الدورة للجميع.
+    الملفات في data/journal (مجلد data مربوط بـ volume في docker-compose).
+    """
+
+    def __init__(self, cycle: str, day: str, directory: str = None, keep_days: int = 7):
+        self.cycle = cycle
+        self.day = day
+        self.dir = Path(directory or JOURNAL_DIR)
+        self.path = self.dir / f"{cycle}_{day}.jsonl"
+        self.keep_days = keep_days
+        self.started = False
+        self.completed = False
+        self.entries = {}  # stage -> {player_id: data}
+        self.checkpoints = set()  # مراحل اكتملت لكل اللاعبين (مثل الحفظ)
+        self._torn = False
+        self._load()
+
+    @property
+    def in_progress(self) -> bool:
+        """بدأت الدورة ولم تكتمل (انقطعت بإعادة تشغيل)"""
+        return self.started and not self.completed
+
+    def done(self, stage: str) -> dict:
+        """اللاعبون المسجلون في مرحلة معينة: {player_id: data}"""
+        return self.entries.get(stage, {})
+
+    def start(self):
+        if not self.started:
+            self._prune()
+            self._append({"event": "started"})
+            self.started = True
+
+    def mark(self, stage: str, player_id: str, **data):
+        self.entries.setdefault(stage, {})[player_id] = data
+        self._append({"stage": stage, "player_id": player_id, **data})
+
+    def mark_many(self, stage: str, records: dict):
+        """تسجيل عدة لاعبين بكتابة واحدة: {player_id: data}"""
+        bucket = self.entries.setdefault(stage, {})
+        lines = []
+        for player_id, data in records.items():
+            bucket[player_id] = data
+            lines.append({"stage": stage, "player_id": player_id, **data})
+        self._append(*lines)
+
+    def checkpoint(self, name: str):
+        """اكتملت مرحلة كاملة من الدورة فلا تُعاد عند الاستكمال"""
+        self._append({"event": "checkpoint", "name": name})
+        self.checkpoints.add(name)
+
+    def reached(self, name: str) -> bool:
+        return name in self.checkpoints
+
+    def complete(self):
+        self._append({"event": "completed"})
+        self.completed = True
+
+    # --- الملف ---
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                self._torn = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # آخر سطر قد يكون مقطوعاً بسبب التوقف المفاجئ
+                event = record.pop("event", None)
+                if event == "started":
+                    self.started = True
+                elif event == "completed":
+                    self.completed = True
+                elif event == "checkpoint":
+                    self.checkpoints.add(record.get("name"))
+                elif "stage" in record:
+                    stage = record.pop("stage")
+                    self.entries.setdefault(stage, {})[record.pop("player_id")] = record
+        if self.in_progress:
+            counts = {stage: len(players) for stage, players in self.entries.items()}
+            logger.info(f"📒 تم العثور على دورة {self.cycle} غير مكتملة ليوم {self.day}: {counts}")
+
+    def _append(self, *records):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            if self._torn:
+                f.write("\n")  # إنهاء السطر المقطوع حتى لا يلتصق به السطر الجديد
+                self._torn = False
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+
+    def _prune(self):
+        """حذف سجلات الأيام القديمة"""
+        cutoff = time.time() - self.keep_days * 86400
+        for old in self.dir.glob(f"{self.cycle}_*.jsonl"):
+            try:
+                if old.stat().st_mtime < cutoff:
+                    old.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,35 @@
+# level_histogram.py
+import time
+from bisect import bisect_left
+
+
+class LevelHistogram:
+    """
+    عدد اللاعبين النشطين لكل مستوى كلي، مجمعاً تراكمياً من الأعلى:
+    count_at_least(level) = عدد اللاعبين الذين مستواهم >= level (بحث ثنائي واحد بدون استعلام).
+    """
+
+    def __init__(self, rows):
+        counts = {}
+        for row in rows:
+            counts[int(row['level'])] = counts.get(int(row['level']), 0) + int(row['players'])
+        self.levels = sorted(counts)
+        self.at_least = []
+        running = 0
+        for level in reversed(self.levels):
+            running += counts[level]
+            self.at_least.append(running)
+        self.at_least.reverse()
+        self.loaded_at = time.monotonic()
+
+    @property
+    def total(self) -> int:
+        return self.at_least[0] if self.at_least else 0
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    def count_at_least(self, level: int) -> int:
+        i = bisect_left(self.levels, level)
+        return self.at_least[i] if i < len(self.at_least) else 0
@@ -0,0 +1,203 @@
+# metrics.py
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+# حدود الـ Histogram بالثواني (من 5 ملي ثانية إلى 10 ثواني)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """توزيع تراكمي بسيط بنفس شكل Prometheus (عدد لكل حد + المجموع والعدد الكلي)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.counts):
+            self.counts[idx] += 1
+        self.total += 1
+        self.sum += value
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            yield bound, running
+
+
+class QueryMetrics:
+    """
+    عدادات استعلامات قاعدة البيانات مصنفة حسب (الجدول، العملية):
+    زمن التنفيذ، عدد الصفوف المعادة، وعدد الأخطاء.
+    التسجيل يحدث من الـ event loop ومن خيوط التنفيذ لذلك نحميه بقفل.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(Histogram)
+        self.rows = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.coalesced = defaultdict(int)
+
+    def observe(self, table: str, op: str, seconds: float, rows: int = 0, error: bool = False):
+        key = (table or "unknown", op or "query")
+        with self._lock:
+            self.latency[key].observe(seconds)
+            self.rows[key] += rows
+            if error:
+                self.errors[key] += 1
+
+    def observe_coalesced(self, table: str, op: str):
+        """طلب لم يُرسل لأنه انضم لاستعلام مطابق جارٍ (single-flight)"""
+        with self._lock:
+            self.coalesced[(table, op)] += 1
+
+    def track(self, table: str, op: str) -> "QueryTimer":
+        """with query_metrics.track('players', 'select') as t: ... ; t.rows = عدد الصفوف"""
+        return QueryTimer(self, table, op)
+
+    def snapshot(self) -> list:
+        """ملخص مرتب بالزمن الكلي (الأثقل أولاً) لعرضه في الأوامر أو السجلات"""
+        with self._lock:
+            items = [
+                {
+                    "table": table, "op": op, "count": h.total,
+                    "total_seconds": round(h.sum, 3),
+                    "avg_ms": round(h.sum / h.total * 1000, 1) if h.total else 0.0,
+                    "rows": self.rows[(table, op)], "errors": self.errors[(table, op)],
+                }
+                for (table, op), h in self.latency.items()
+            ]
+        return sorted(items, key=lambda x: x["total_seconds"], reverse=True)
+
+    def render(self) -> str:
+        """تصدير كل العدادات بصيغة Prometheus النصية"""
+        lines = [
+            "# HELP db_query_duration_seconds Database query latency by table and operation.",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (table, op), h in sorted(self.latency.items()):
+                labels = f'table="{table}",op="{op}"'
+                for bound, count in h.cumulative():
+                    lines.append(f'db_query_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'db_query_duration_seconds_bucket{{{labels},le="+Inf"}} {h.total}')
+                lines.append(f"db_query_duration_seconds_sum{{{labels}}} {h.sum:.6f}")
+                lines.append(f"db_query_duration_seconds_count{{{labels}}} {h.total}")
+
+            lines += [
+                "# HELP db_query_rows_total Rows returned by database queries.",
+                "# TYPE db_query_rows_total counter",
+            ]
+            for (table, op), count in sorted(self.rows.items()):
+                lines.append(f'db_query_rows_total{{table="{table}",op="{op}"}} {count}')
+
+            lines += [
+                "# HELP db_query_errors_total Failed database queries.",
+                "# TYPE db_query_errors_total counter",
+            ]
+            for (table, op), count in sorted(self.errors.items()):
+                lines.append(f'db_query_errors_total{{table="{table}",op="{op}"}} {count}')
+
+            lines += [
+                "# HELP db_query_coalesced_total Reads served by joining an identical in-flight query.",
+                "# TYPE db_query_coalesced_total counter",
+            ]
+            for (table, op), count in sorted(self.coalesced.items()):
+                lines.append(f'db_query_coalesced_total{{table="{table}",op="{op}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class QueryTimer:
+    """يقيس زمن كتلة with ويسجله عند الخروج (مع خطأ إن خرجت باستثناء)"""
+
+    def __init__(self, registry: QueryMetrics, table: str, op: str):
+        self.registry = registry
+        self.table = table
+        self.op = op
+        self.rows = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.registry.observe(self.table, self.op, elapsed, rows=self.rows, error=exc_type is not None)
+        return False
+
+
+class DeliveryMetrics:
+    """نتائج إرسال الرسائل الخاصة لكل مسار (sent / closed / retry / error) وزمن كل إرسال"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.outcomes = defaultdict(int)
+        self.latency = defaultdict(Histogram)
+
+    def observe(self, pipeline: str, outcome: str, seconds: float):
+        with self._lock:
+            self.outcomes[(pipeline, outcome)] += 1
+            if outcome == "sent":
+                self.latency[pipeline].observe(seconds)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP dm_delivery_total Direct message delivery attempts by pipeline and outcome.",
+            "# TYPE dm_delivery_total counter",
+        ]
+        with self._lock:
+            for (pipeline, outcome), count in sorted(self.outcomes.items()):
+                lines.append(f'dm_delivery_total{{pipeline="{pipeline}",outcome="{outcome}"}} {count}')
+            lines += [
+                "# HELP dm_delivery_duration_seconds Time to deliver one direct message.",
+                "# TYPE dm_delivery_duration_seconds histogram",
+            ]
+            for pipeline, h in sorted(self.latency.items()):
+                for bound, count in h.cumulative():
+                    lines.append(f'dm_delivery_duration_seconds_bucket{{pipeline="{pipeline}",le="{bound}"}} {count}')
+                lines.append(f'dm_delivery_duration_seconds_bucket{{pipeline="{pipeline}",le="+Inf"}} {h.total}')
+                lines.append(f'dm_delivery_duration_seconds_sum{{pipeline="{pipeline}"}} {h.sum:.6f}')
+                lines.append(f'dm_delivery_duration_seconds_count{{pipeline="{pipeline}"}} {h.total}')
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(name: str, help_text: str, hist: Histogram) -> str:
+    """تصدير Histogram واحد بدون تصنيفات بصيغة Prometheus"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for bound, count in hist.cumulative():
+        lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {hist.total}')
+    lines.append(f"{name}_sum {hist.sum:.6f}")
+    lines.append(f"{name}_count {hist.total}")
+    return "\n".join(lines) + "\n"
+
+
+def render_gauges(name: str, help_text: str, values: dict) -> str:
+    """تصدير مجموعة قيم لحظية (مثل إحصائيات الذاكرة المؤقتة) بصيغة Prometheus"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for key, value in values.items():
+        lines.append(f'{name}{{stat="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def count_rows(result) -> int:
+    """عدد الصفوف في نتيجة استعلام (استجابة سوبابيس، قائمة، أو صف واحد)"""
+    if result is None:
+        return 0
+    data = getattr(result, "data", result)
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        return 1
+    return 0
+
+
+query_metrics = QueryMetrics()
+delivery_metrics = DeliveryMetrics()
@@ -0,0 +1,164 @@
+# models.py
+import re
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+
+_FRACTION = re.compile(r"\.(\d+)")
+
+
+def parse_timestamp(value):
+    """
+    تحويل توقيت قاعدة البيانات إلى datetime مع منطقة زمنية مرة واحدة:
+    يقبل نص سوبابيس (Z أو +00:00، وكسور الثانية بأي عدد أرقام) أو datetime من asyncpg.
+    التوقيت بدون منطقة زمنية يُعامل كـ UTC (هكذا تخزن أعمدة timestamptz).
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        text = str(value).strip().replace('Z', '+00:00')
+        # توحيد الكسور إلى 6 أرقام (سوبابيس يعيد 3 أو 4 أو 5 أحياناً)
+        text = _FRACTION.sub(lambda m: "." + (m.group(1) + "000000")[:6], text, count=1)
+        parsed = datetime.fromisoformat(text)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def local_time(value):
+    """توقيت محلي بدون منطقة زمنية للمقارنة مع datetime.now() المستخدم في البوت"""
+    parsed = parse_timestamp(value)
+    return parsed.astimezone().replace(tzinfo=None) if parsed else None
+
+
+def is_timestamp_column(column: str) -> bool:
+    """أعمدة التوقيت في المخطط كلها تنتهي بـ _at (created_at, started_at, expires_at...)"""
+    return column.endswith('_at')
+
+
+class Row(MutableMapping):
+    """
+    صف مضغوط من قاعدة البيانات: الأعمدة المعروفة في __slots__ بدل قاموس لكل صف،
+    وأعمدة _at تُحول إلى datetime مرة واحدة عند فك الصف (وعند أي تعديل لاحق).
+    يتصرف كقاموس (row['x'] و row.get('x') و {**row}) فلا يتغير أي كود يقرأ الصفوف،
+    والأعمدة غير المعروفة (أو المضافة مثل quest) تُحفظ في _extra.
+    """
+    __slots__ = ('_extra',)
+    _fields = ()
+    _field_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = cls._fields + tuple(cls.__dict__.get('__slots__', ()))
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, data=None, **values):
+        self._extra = None
+        if data:
+            self.update(data)
+        if values:
+            self.update(values)
+
+    @classmethod
+    def from_row(cls, row):
+        """فك صف قادم من قاعدة البيانات (None يبقى None)"""
+        return cls(row) if row is not None else None
+
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return [cls(row) for row in rows or ()]
+
+    # --- واجهة القاموس ---
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if is_timestamp_column(key) and value != 'now()':
+            value = parse_timestamp(value)
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for name in self._fields:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def copy(self):
+        return type(self)(self)
+
+    def to_dict(self) -> dict:
+        """قاموس عادي بتواريخ نصية (للكتابة في قاعدة البيانات أو السجلات)"""
+        return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in self.items()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class Player(Row):
+    """صف players (الأعمدة المقروءة في كل مكان، وبقية أعمدة الجوانب في _extra)"""
+    __slots__ = (
+        'id', 'discord_id', 'username', 'status', 'rank', 'total_level', 'total_xp',
+        'coins', 'gems', 'current_energy', 'max_energy', 'streak_days',
+        'active_title', 'unlocked_titles', 'gender', 'faith_type', 'age_group',
+        'assessment_done', 'last_dashboard_msg_id',
+        'strength_xp', 'intelligence_xp', 'vitality_xp', 'agility_xp', 'perception_xp', 'freedom_xp',
+        'created_at', 'updated_at',
+    )
+
+
+class Portal(Row):
+    """صف portal_history (مع المهمة المرفقة quest عند تتبع البوابة)"""
+    __slots__ = (
+        'id', 'quest_id', 'status', 'owner_id', 'is_private', 'participants_ids',
+        'channel_message_id', 'quest', 'created_at', 'started_at', 'ended_at',
+    )
+
+
+class Participant(Row):
+    """صف portal_participants (مع players المرفق عند طلبه)"""
+    __slots__ = ('id', 'portal_id', 'player_id', 'status', 'players', 'joined_at', 'completed_at')
+
+
+class InventoryItem(Row):
+    """صف player_inventory (مع item من system_shop_items)"""
+    __slots__ = (
+        'id', 'player_id', 'item_id', 'quantity', 'is_equipped', 'equipped_slot',
+        'current_durability', 'item', 'created_at',
+    )
+
+
+class Buff(Row):
+    """صف player_buffs"""
+    __slots__ = ('id', 'player_id', 'buff_type', 'buff_name', 'value', 'expires_at', 'created_at')
@@ -0,0 +1,67 @@
+# portal_deadlines.py
+import heapq
+import itertools
+from datetime import datetime
+
+
+class OpenPortal:
+    """بوابة مفتوحة في الذاكرة: صفها (مع المهمة) وحالتها وموعد انتهائها"""
+    __slots__ = ("row", "status", "deadline", "seq")
+
+    def __init__(self, row: dict, status: str, deadline: datetime, seq: int):
+        self.row = row
+        self.status = status
+        self.deadline = deadline
+        self.seq = seq
+
+
+class PortalDeadlines:
+    """
+    حالة البوابات المفتوحة (recruiting / active) في الذاكرة مع كومة صغرى لمواعيد انتهائها:
+    مهلة التجمع للبوابات التي تنتظر الفريق، ومدة المهمة للبوابات النشطة.
+    تُحمّل مرة واحدة عند التشغيل وتتحدث مع كل انتقال (إطلاق، بدء، تطهير، انهيار)،
+    فأقرب موعد قراءة من رأس الكومة بدون أي استعلام.
+    الحذف كسول: العنصر القديم في الكومة يُتجاهل إذا تغير موعد البوابة أو أُغلقت.
+    """
+
+    def __init__(self):
+        self._heap = []       # (deadline, seq, portal_id)
+        self._portals = {}    # portal_id -> OpenPortal
+        self._seq = itertools.count()
+
+    def track(self, row: dict, status: str, deadline: datetime) -> OpenPortal:
+        """إضافة بوابة أو تحديث حالتها وموعدها"""
+        portal_id = str(row['id'])
+        entry = OpenPortal(row, status, deadline, next(self._seq))
+        self._portals[portal_id] = entry
+        heapq.heappush(self._heap, (deadline, entry.seq, portal_id))
+        return entry
+
+    def get(self, portal_id):
+        return self._portals.get(str(portal_id))
+
+    def discard(self, portal_id):
+        """البوابة أُغلقت (تطهير أو انهيار)"""
+        return self._portals.pop(str(portal_id), None)
+
+    def _is_current(self, item) -> bool:
+        entry = self._portals.get(item[2])
+        return entry is not None and entry.seq == item[1]
+
+    def next_deadline(self):
+        """أقرب موعد انتهاء أو None إذا لم تكن هناك بوابات مفتوحة"""
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: datetime) -> list:
+        """البوابات التي حل موعدها (تُحذف من الذاكرة) بترتيب المواعيد"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._is_current(item):
+                expired.append(self._portals.pop(item[2]))
+        return expired
+
+    def __len__(self):
+        return len(self._portals)
@@ -1,212 +1,219 @@
 import discord
 from discord import app_commands
-from discord.ext import tasks, commands
+from discord.ext import commands
 from discord.ui import View, Button
+from cache import LRUCache
 from database import db
-from datetime import datetime, timedelta
+from models import local_time
+from portal_deadlines import PortalDeadlines
+from hijri_calendar import hijri_calendar
+from scheduler import Scheduler
+from datetime import datetime, timedelta, time
 import asyncio
 import os
 import random
 import logging
 
-from hijri_converter import Gregorian
-
 
 logger = logging.getLogger(__name__) # ✅ أضف هذا السطر تحت الاستيرادات مباشرة
 
+# مهلة التجمع قبل كسر الختم، ووضع النوم: لا بوابات بين 12 ليلاً و 8 صباحاً
+RECRUIT_TIMEOUT = timedelta(minutes=45)
+AWAKE_FROM = time(8, 0)
+
+
+def note_portal_status(client, h_id, status, quest=None, is_private=False):
+    """إبلاغ نظام البوابات بانتقال بوابة من الأزرار (active يبدأ مؤقت المهمة، cleared يغلقها)"""
+    cog = client.get_cog("PortalSystem")
+    if cog: cog.portal_status_changed(h_id, status, quest, is_private)
+
 class PortalSystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.portal_checker.start()
+        # البوابات المفتوحة ومواعيد انتهائها في الذاكرة (تُحمّل في أول تشغيل للمجدول)
+        self.portals = PortalDeadlines()
+        self.portals_loaded = False
+        self.next_spawn = datetime.min
+        self.scheduler = Scheduler("portals")
+        self.scheduler.add("portal_expiry", lambda now: self.portals.next_deadline() if self.portals_loaded else now, self.expire_portals)
+        self.scheduler.add("portal_spawn", lambda now: self.next_spawn, self.spawn_portals)
+        self.scheduler.start(wait_for=self.bot.wait_until_ready)
+        db.config.subscribe('portal_interval_hours', self.replan_spawn)
 
     def cog_unload(self):
-        self.portal_checker.cancel()
+        self.scheduler.stop()
 
     # ====================================================
-    # 🕒 1. المراقب الزمني (The Scheduler Loop)
+    # 🕒 1. المراقب الزمني (The Scheduler)
     # ====================================================
-    @tasks.loop(minutes=1)
-    async def portal_checker(self):
-        try:
-            # 1. الوقت الحالي بتوقيت القاهرة
-            now = datetime.now() 
-            
-            # ==========================================
-            # 🧹 الجزء الأول: تنظيف البوابات (الصرامة)
-            # ==========================================
-            
-            # أ) كسر الختم للتوظيف المتأخر (أكثر من 45 دقيقة)
-            expired_recruiting = await db._execute_async(
-                lambda: db.client.table('portal_history')
-                .select('*, quest:system_portal_quests(*)') # جلب كل التفاصيل للعقوبة
-                .eq('status', 'recruiting')
-                .execute()
-            )
-            for p in expired_recruiting.data:
-                try:
-                    created_at = self.parse_supabase_date(p['created_at'])
-                    if now > (created_at + timedelta(minutes=45)):
-                        await self.close_portal(p, "broken", "💀 **فشل في التجمع!** تأخر الصيادون عن دخول البوابة، فخرجت الوحوش للمدينة.")
-                        await asyncio.sleep(0.8) # منع الحظر
-                except Exception as e:
-                    print(f"Error checking recruiting {p['id']}: {e}")
-
-            # ب) إعلان فشل الغارات النشطة التي تجاوزت الوقت
-            active_portals = await db._execute_async(
-                lambda: db.client.table('portal_history')
-                .select('*, quest:system_portal_quests(*)')
-                .eq('status', 'active')
-                .execute()
-            )
-            for p in active_portals.data:
-                try:
-                    started_at = self.parse_supabase_date(p['started_at'])
-                    duration = p['quest']['duration_minutes']
-                    
-                    if now > (started_at + timedelta(minutes=duration)):
-                        await self.close_portal(p, "broken", "💀 **DUNGEON BREAK!** انتهى الوقت المخصص ولم ينجح الفريق في تطهير البوابة.")
-                        await asyncio.sleep(0.8)
-                except Exception as e:
-                    print(f"Error checking active {p['id']}: {e}")
-
-            # ==========================================
-            # 🌪️ الجزء الثاني: المولد الجديد (The Spawner)
-            # ==========================================
-
-            # 1. وضع النوم (Sleep Mode): لا بوابات بين 12 ليلاً و 8 صباحاً
-            if 0 <= now.hour < 8:
-                return
-
-            # 2. التحقق من البوابات الموسمية (الأعياد) 🕌
+    def track_portal(self, row: dict, status: str, deadline: datetime):
+        """بوابة جديدة أو بدأت: تسجيل موعد انتهائها وإيقاظ المجدول لإعادة التخطيط"""
+        self.portals.track(row, status, deadline)
+        self.scheduler.wake()
+
+    def portal_status_changed(self, h_id, status, quest=None, is_private=False):
+        if status != 'active':
+            self.portals.discard(h_id)
+            return
+        entry = self.portals.get(h_id)
+        row = entry.row if entry else {'id': h_id, 'quest': quest, 'is_private': is_private}
+        row['status'] = 'active'
+        duration = (row.get('quest') or quest)['duration_minutes']
+        self.track_portal(row, 'active', datetime.now() + timedelta(minutes=duration))
+
+    def replan_spawn(self, value=None):
+        """تغير الفاصل الزمني: إعادة حساب موعد البوابة القادمة فوراً"""
+        self.next_spawn = datetime.min
+        self.scheduler.wake()
+
+    async def load_open_portals(self):
+        """تحميل البوابات المفتوحة مرة واحدة عند التشغيل، وبعدها تُتابع في الذاكرة فقط"""
+        for p in await db.get_open_portals():
             try:
-                from hijri_converter import Gregorian
-                hijri = Gregorian(now.year, now.month, now.day).to_hijri()
-                hijri_key = f"{hijri.month}-{hijri.day}" # مثال: 10-1
-                
-                # البحث عن بوابة موسمية لهذا اليوم
-                seasonal_quest = await db._execute_async(
-                    lambda: db.client.table('system_portal_quests')
-                    .select('*').eq('is_seasonal', True).eq('seasonal_hijri_date', hijri_key).execute()
-                )
-                
-                if seasonal_quest.data:
-                    # نتأكد أنها لم تطلق اليوم بالفعل
-                    last_portal = await db._execute_async(
-                        lambda: db.client.table('portal_history').select('created_at').order('created_at', desc=True).limit(1).execute()
-                    )
-                    
-                    should_spawn_seasonal = True
-                    if last_portal.data:
-                        last_date = self.parse_supabase_date(last_portal.data[0]['created_at']).date()
-                        if last_date == now.date():
-                            should_spawn_seasonal = False # تم إطلاقها اليوم
-
-                    if should_spawn_seasonal:
-                        await self.launch_public_portal(seasonal_quest.data[0])
-                        return # لا نطلق بوابات عشوائية في يوم العيد
+                # تفاصيل المهمة (للعقوبة) من فهرس المهام
+                p['quest'] = await db.quests.get(p['quest_id'])
+                if p['status'] == 'recruiting':
+                    deadline = local_time(p['created_at']) + RECRUIT_TIMEOUT
+                else:
+                    deadline = local_time(p['started_at']) + timedelta(minutes=p['quest']['duration_minutes'])
+                self.portals.track(p, p['status'], deadline)
             except Exception as e:
-                print(f"Seasonal Check Error: {e}")
-
-            # 3. التحقق من الفاصل الزمني للبوابات العشوائية 🎲
-            
-            # جلب إعداد الفاصل الزمني (الافتراضي ساعتين)
-            config_res = await db._execute_async(
-                lambda: db.client.table('system_config').select('value').eq('key', 'portal_interval_hours').execute()
-            )
-            interval_hours = int(config_res.data[0]['value']) if config_res.data else 2
+                print(f"Error loading portal {p['id']}: {e}")
+        self.portals_loaded = True
+        logger.info(f"🌀 تم تحميل {len(self.portals)} بوابة مفتوحة")
+
+    async def expire_portals(self):
+        """إغلاق البوابات التي حل موعدها (من رأس الكومة، بدون استعلام فحص)"""
+        if not self.portals_loaded:
+            await self.load_open_portals()
+
+        # 1. الوقت الحالي بتوقيت القاهرة
+        now = datetime.now()
+        for entry in self.portals.pop_expired(now):
+            if entry.status == 'recruiting':
+                # أ) كسر الختم للتوظيف المتأخر (أكثر من 45 دقيقة)
+                message = "💀 **فشل في التجمع!** تأخر الصيادون عن دخول البوابة، فخرجت الوحوش للمدينة."
+            else:
+                # ب) إعلان فشل الغارات النشطة التي تجاوزت الوقت
+                message = "💀 **DUNGEON BREAK!** انتهى الوقت المخصص ولم ينجح الفريق في تطهير البوابة."
+            try:
+                await self.close_portal(entry.row, "broken", message)
+                await asyncio.sleep(0.8) # منع الحظر
+            except Exception as e:
+                print(f"Error closing portal {entry.row['id']}: {e}")
+                # إعادة المحاولة بعد دقيقة
+                self.portals.track(entry.row, entry.status, now + timedelta(minutes=1))
+
+    async def spawn_portals(self):
+        # ==========================================
+        # 🌪️ الجزء الثاني: المولد الجديد (The Spawner)
+        # ==========================================
+        now = datetime.now()
+        last_time = await self.try_spawn(now)
+
+        # البوابة القادمة بعد الفاصل الزمني من آخر بوابة، ويُعاد الفحص مع بداية كل يوم (البوابات الموسمية)
+        interval_hours = int(await db.get_system_config('portal_interval_hours') or 2)
+        next_day = datetime.combine(now.date() + timedelta(days=1), AWAKE_FROM)
+        if now.time() < AWAKE_FROM:
+            next_day = datetime.combine(now.date(), AWAKE_FROM)
+        due = min(next_day, (last_time or now) + timedelta(hours=interval_hours))
+        if due.time() < AWAKE_FROM:
+            due = datetime.combine(due.date(), AWAKE_FROM)
+        self.next_spawn = due
+
+    async def try_spawn(self, now):
+        """فحص البوابات الموسمية والعشوائية، ويعيد وقت آخر بوابة (أو الآن إذا أُطلقت/تُخطيت واحدة)"""
+        # 1. وضع النوم (Sleep Mode): لا بوابات بين 12 ليلاً و 8 صباحاً
+        if now.time() < AWAKE_FROM:
+            return None
+
+        # وقت آخر بوابة (يُقرأ مرة واحدة ويُستخدم في الفحصين التاليين)
+        last_portal_time = await db.get_last_portal_time()
+
+        # 2. التحقق من البوابات الموسمية (الأعياد) 🕌
+        try:
+            hijri_key = hijri_calendar.day(now).seasonal_key # مثال: 10-1
             
-            # جلب وقت آخر بوابة
-            last_portal_res = await db._execute_async(
-                lambda: db.client.table('portal_history').select('created_at').order('created_at', desc=True).limit(1).execute()
-            )
+            # البحث عن بوابة موسمية لهذا اليوم
+            seasonal_quest = await db.get_seasonal_quest(hijri_key)
             
-            should_spawn = False
-            if not last_portal_res.data:
-                should_spawn = True # أول مرة يشتغل السيرفر
-            else:
-                last_time = self.parse_supabase_date(last_portal_res.data[0]['created_at'])
-                # هل مر الوقت المحدد؟
-                if now > (last_time + timedelta(hours=interval_hours)):
-                    should_spawn = True
+            if seasonal_quest:
+                # نتأكد أنها لم تطلق اليوم بالفعل
+                should_spawn_seasonal = True
+                if last_portal_time:
+                    last_date = local_time(last_portal_time).date()
+                    if last_date == now.date():
+                        should_spawn_seasonal = False # تم إطلاقها اليوم
+
+                if should_spawn_seasonal:
+                    await self.launch_public_portal(seasonal_quest)
+                    return now # لا نطلق بوابات عشوائية في يوم العيد
+        except Exception as e:
+            print(f"Seasonal Check Error: {e}")
+
+        # 3. التحقق من الفاصل الزمني للبوابات العشوائية 🎲
+        
+        # جلب إعداد الفاصل الزمني (الافتراضي ساعتين)
+        interval_hours = int(await db.get_system_config('portal_interval_hours') or 2)
+        
+        should_spawn = False
+        last_time = None
+        if not last_portal_time:
+            should_spawn = True # أول مرة يشتغل السيرفر
+        else:
+            last_time = local_time(last_portal_time)
+            # هل مر الوقت المحدد؟
+            if now > (last_time + timedelta(hours=interval_hours)):
+                should_spawn = True
+        
+        if should_spawn:
+            # 1. جلب كل البوابات غير الموسمية
+            all_quests = await db.quests.regular_quests()
             
-            if should_spawn:
-                # 1. جلب كل البوابات غير الموسمية
-                quests_res = await db._execute_async(
-                    lambda: db.client.table('system_portal_quests')
-                    .select('*').eq('is_seasonal', False).execute()
-                )
+            if all_quests:
                 
-                if quests_res.data:
-                    all_quests = quests_res.data
-                    # خلط البوابات لضمان العشوائية
-                    random.shuffle(all_quests)
-                    
-                    selected_quest = None
+                # 2. البحث عن بوابة مناسبة لقوة السيرفر الحالية:
+                # مدرج المستويات يُقرأ مرة واحدة، وكل مهمة بحث واحد فيه (هل يوجد عدد كافٍ من الأقوياء؟)
+                levels = await db.get_level_histogram()
+                eligible = [
+                    quest for quest in all_quests
+                    if levels.count_at_least(quest.get('min_aspect_level', 1)) >= quest.get('party_size', 1)
+                ]
+                # اختيار عشوائي موزون من المناسبة (spawn_weight، والوزن 0 لا يظهر أبداً)
+                selected_quest = db.quests.pick_weighted(eligible)
+
+                # 3. الإطلاق
+                if selected_quest:
+                    # ✅ وجدنا بوابة مناسبة -> نطلقها
+                    await self.launch_public_portal(selected_quest)
+                else:
+                    # ❌ لم نجد أي بوابة مناسبة لقوة اللاعبين الحاليين
+                    # الحل: نسجل "تخطي" في قاعدة البيانات لتحديث المؤقت ومنع التكرار الفوري
+                    # نستخدم أول كويست في القائمة فقط لملء خانة الـ Foreign Key (لن يتم عرضه)
+                    dummy_quest_id = all_quests[0]['id']
                     
-                    # 2. البحث عن بوابة مناسبة لقوة السيرفر الحالية
-                    for quest in all_quests:
-                        required_level = quest.get('min_aspect_level', 1)
-                        required_party = quest.get('party_size', 1)
-                        
-                        # نسأل قاعدة البيانات: هل يوجد عدد كافٍ من الأقوياء؟
-                        capable_count = await db.count_capable_players(required_level)
-                        
-                        if capable_count >= required_party:
-                            selected_quest = quest
-                            break # وجدنا بوابة مناسبة!
-                        else:
-                            # (اختياري) طباعة في اللوج للمراقبة
-                            # print(f"Skipped {quest['title']}: Need {required_party} players lvl {required_level}, found {capable_count}")
-                            pass
-
-                    # 3. الإطلاق
-                    if selected_quest:
-                        # ✅ وجدنا بوابة مناسبة -> نطلقها
-                        await self.launch_public_portal(selected_quest)
-                    else:
-                        # ❌ لم نجد أي بوابة مناسبة لقوة اللاعبين الحاليين
-                        # الحل: نسجل "تخطي" في قاعدة البيانات لتحديث المؤقت ومنع التكرار الفوري
-                        # نستخدم أول كويست في القائمة فقط لملء خانة الـ Foreign Key (لن يتم عرضه)
-                        dummy_quest_id = all_quests[0]['id']
-                        
-                        await db._execute_async(
-                            lambda: db.client.table('portal_history').insert({
-                                'quest_id': dummy_quest_id,
-                                'status': 'skipped', # حالة جديدة تعني "تم التخطي لعدم الجاهزية"
-                                'participants_data': {'reason': 'no_capable_players'}
-                            }).execute()
-                        )
-                        print(f"⚠️ Skipped spawning: No capable players found. Timer reset for {interval_hours} hours.")
+                    await db._execute_async(
+                        lambda: db.client.table('portal_history').insert({
+                            'quest_id': dummy_quest_id,
+                            'status': 'skipped', # حالة جديدة تعني "تم التخطي لعدم الجاهزية"
+                            'participants_data': {'reason': 'no_capable_players'}
+                        }).execute(),
+                        table='portal_history', op='insert'
+                    )
+                    print(f"⚠️ Skipped spawning: No capable players found. Timer reset for {interval_hours} hours.")
+            return now
 
-        except Exception as e:
-            print(f"Portal Loop Error: {e}")     
-            
-    def parse_supabase_date(self, date_str):
-        """دالة احترافية لمعالجة كافة أشكال تواريخ سوبابيس (3، 4، 6 أرقام للكسور)"""
-        import re
-        # تنظيف حرف Z
-        clean_str = date_str.replace('Z', '+00:00')
-        
-        # البحث عن أجزاء المايكروثانية باستخدام Regex وتوحيدها لـ 6 أرقام
-        match = re.search(r'\.(\d+)', clean_str)
-        if match:
-            fraction = match.group(1)
-            fixed_fraction = (fraction + "000000")[:6]
-            clean_str = clean_str.replace(f".{fraction}", f".{fixed_fraction}")
-            
-        db_time_aware = datetime.fromisoformat(clean_str)
-        return db_time_aware.astimezone().replace(tzinfo=None)
-        
-    @portal_checker.before_loop
-    async def before_portal_checker(self): await self.bot.wait_until_ready()
+        return last_time
 
     # --- دالة الإغلاق والعقوبات (مصححة) ---
     async def close_portal(self, portal_data, new_status, message):
+        self.portals.discard(portal_data['id'])
         # 1. تحديث حالة البوابة في السجلات
         await db._execute_async(
             lambda: db.client.table('portal_history')
             .update({'status': new_status, 'ended_at': datetime.now().isoformat()})
-            .eq('id', portal_data['id']).execute()
+            .eq('id', portal_data['id']).execute(),
+            table='portal_history', op='update'
         )
         
 # 2. تفصيل العقوبة الجماعية (إذا كانت broken وعامة)
@@ -274,8 +281,11 @@ class PortalSystem(commands.Cog):
         channel = self.bot.get_channel(int(channel_id)) if channel_id else None
         if not channel: return
 
-        history = await db._execute_async(lambda: db.client.table('portal_history').insert({'quest_id': quest['id'], 'status': 'recruiting', 'is_private': False}).execute())
-        h_id = history.data[0]['id']
+        history = await db._execute_async(lambda: db.client.table('portal_history').insert({'quest_id': quest['id'], 'status': 'recruiting', 'is_private': False}).execute(), table='portal_history', op='insert')
+        row = history.data[0]
+        h_id = row['id']
+        row['quest'] = quest
+        self.track_portal(row, 'recruiting', datetime.now() + RECRUIT_TIMEOUT)
 
         end_time = datetime.now() + timedelta(minutes=quest['duration_minutes'])
         timestamp = int(end_time.timestamp())
@@ -288,18 +298,18 @@ class PortalSystem(commands.Cog):
         embed.set_image(url="https://media1.tenor.com/m/jJfdc2lJcQAAAAAd/solo-leveling-dungeon.gif")
         
         mention = f"<@&{role_id}>" if role_id else "@here"
-        view = PortalJoinView(quest, h_id, is_private=False)
+        view = remember_portal_view(PortalJoinView(quest, h_id, is_private=False))
         msg = await channel.send(content=f"{mention} ⚔️ استعدوا!", embed=embed, view=view)
+        row['channel_message_id'] = str(msg.id)
         
-        await db._execute_async(lambda: db.client.table('portal_history').update({'channel_message_id': str(msg.id)}).eq('id', h_id).execute())
+        await db._execute_async(lambda: db.client.table('portal_history').update({'channel_message_id': str(msg.id)}).eq('id', h_id).execute(), table='portal_history', op='update')
 
     async def create_private_portal(self, interaction, level, tier="E"):
-        quests = await db._execute_async(lambda: db.client.table('system_portal_quests').select('*').eq('min_aspect_level', level).execute())
-        if not quests.data: 
+        quest = db.quests.pick(await db.quests.for_level(level))
+        if not quest: 
             await interaction.followup.send("❌ لا توجد مهام متاحة لهذا المستوى حالياً.", ephemeral=True)
             return
             
-        quest = random.choice(quests.data)
         u_id = str(interaction.user.id)
         
         # إنشاء السجل
@@ -311,14 +321,16 @@ class PortalSystem(commands.Cog):
                 'owner_id': u_id, 
                 'is_private': True, 
                 'participants_ids': [u_id]
-            }).execute()
+            }).execute(),
+            table='portal_history', op='insert'
         )
-        h_id = h_entry.data[0]['id']
+        row = h_entry.data[0]
+        h_id = row['id']
+        row['quest'] = quest
+        self.track_portal(row, 'recruiting', datetime.now() + RECRUIT_TIMEOUT)
         
-        # ✅ إصلاح العداد: زيادة عداد "البوابات الخاصة المفتوحة" لصاحب المفتاح
-        p_db = await db.get_player(u_id)
-        if p_db:
-            await db.update_player(u_id, {'private_portals_opened': p_db.get('private_portals_opened', 0) + 1})
+        # ✅ إصلاح العداد: زيادة عداد "البوابات الخاصة المفتوحة" لصاحب المفتاح (ذرياً بدون قراءة مسبقة)
+        await db.increment_player(u_id, {'private_portals_opened': 1})
         
         end_time = datetime.now() + timedelta(minutes=quest['duration_minutes'])
         timestamp = int(end_time.timestamp())
@@ -328,10 +340,11 @@ class PortalSystem(commands.Cog):
         embed.add_field(name="👥 الفريق", value=f"1/{quest['party_size']}", inline=True)
         
         # تمرير h_id لضمان استمرارية الأزرار
-        view = PrivatePortalView(quest, h_id, u_id)
+        view = remember_portal_view(PrivatePortalView(quest, h_id, u_id))
         msg = await interaction.channel.send(embed=embed, view=view)
+        row['channel_message_id'] = str(msg.id)
         
-        await db._execute_async(lambda: db.client.table('portal_history').update({'channel_message_id': str(msg.id)}).eq('id', h_id).execute())
+        await db._execute_async(lambda: db.client.table('portal_history').update({'channel_message_id': str(msg.id)}).eq('id', h_id).execute(), table='portal_history', op='update')
         await interaction.followup.send("✅ تم استخدام المفتاح وفتح البوابة بنجاح!", ephemeral=True)
         
 
@@ -342,17 +355,23 @@ class PortalSystem(commands.Cog):
     async def schedule_portal(self, interaction: discord.Interaction, hours: int, rank: str):
         if not interaction.user.guild_permissions.administrator: await interaction.response.send_message("⛔ آدمن فقط", ephemeral=True); return
         await interaction.response.defer(ephemeral=True)
-        quests = await db._execute_async(lambda: db.client.table('system_portal_quests').select('*').eq('difficulty_rank', rank).execute())
-        if not quests.data: await interaction.followup.send("❌ لا توجد مهام."); return
-        quest = random.choice(quests.data)
+        quest = db.quests.pick(await db.quests.for_rank(rank))
+        if not quest: await interaction.followup.send("❌ لا توجد مهام."); return
         await interaction.followup.send(f"✅ سأطلق بوابة {rank} بعد {hours} ساعات.")
         await asyncio.sleep(hours * 3600)
         await self.launch_public_portal(quest)
 
+    @app_commands.command(name="reload_portal_quests", description="[Admin] إعادة تحميل مهام البوابات بعد تعديلها في قاعدة البيانات")
+    async def reload_portal_quests(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator: await interaction.response.send_message("⛔ آدمن فقط", ephemeral=True); return
+        await interaction.response.defer(ephemeral=True)
+        count = await db.quests.refresh()
+        await interaction.followup.send(f"✅ تم تحميل {count} مهمة بوابة.")
+
     @app_commands.command(name="invite", description="دعوة لاعب لبوابتك")
     async def invite_command(self, interaction: discord.Interaction, player: discord.Member):
         u_id = str(interaction.user.id)
-        portal = await db._execute_async(lambda: db.client.table('portal_history').select('*').eq('owner_id', u_id).eq('status', 'recruiting').execute())
+        portal = await db._execute_async(lambda: db.client.table('portal_history').select('*').eq('owner_id', u_id).eq('status', 'recruiting').execute(), table='portal_history', op='select')
         if not portal.data: await interaction.response.send_message("❌ لا توجد بوابة نشطة.", ephemeral=True); return
         p_data = portal.data[0]
         current = p_data.get('participants_ids', [])
@@ -370,7 +389,8 @@ class PortalSystem(commands.Cog):
             .select('*, quest:system_portal_quests(*)') # ✅ إصلاح: جلب الاسم الصحيح
             .contains('participants_ids', [u_id])
             .in_('status', ['recruiting', 'active'])
-            .execute()
+            .execute(),
+            table='portal_history', op='select'
         )
         if not portals.data: await interaction.followup.send("📭 لا يوجد.", ephemeral=True); return
         
@@ -382,9 +402,10 @@ class PortalSystem(commands.Cog):
             view = View()
             if p['status'] == 'active':
                 complete_btn = Button(label="✅ إتمام المهمة", style=discord.ButtonStyle.success, custom_id=f"quick_comp_{p['id']}")
-                async def complete_cb(inter):
-                    view_mock = PortalActiveView(quest, p['id'], p['participants_ids'])
-                    await view_mock.process_completion(inter)
+                async def complete_cb(inter, h_id=p['id']):
+                    # نفس View رسالة البوابة (أو يُبنى من صفها) بدل نسخة مؤقتة تطرد الأصلية من الذاكرة
+                    active_view = await load_portal_view(PortalActiveView, h_id)
+                    if active_view: await active_view.process_completion(inter)
                 complete_btn.callback = complete_cb
                 view.add_item(complete_btn)
             else: view.add_item(Button(label="في الانتظار...", disabled=True))
@@ -393,12 +414,12 @@ class PortalSystem(commands.Cog):
     @app_commands.command(name="portal_history", description="سجل آخر 10 بوابات")
     async def portal_history(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        history = await db._execute_async(lambda: db.client.table('portal_history').select('*, quest:system_portal_quests(title, difficulty_rank)').order('created_at', desc=True).limit(10).execute())
+        history = await db._execute_async(lambda: db.client.table('portal_history').select('*, quest:system_portal_quests(title, difficulty_rank)').order('created_at', desc=True).limit(10).execute(), table='portal_history', op='select')
         if not history.data: await interaction.followup.send("📭 السجل فارغ."); return
         embed = discord.Embed(title="📜 سجل البوابات الأخير", color=discord.Color.gold())
         for h in history.data:
             status_icon = "✅" if h['status'] == 'cleared' else "💔" if h['status'] == 'broken' else "⏳"
-            date = h['created_at'][:10]
+            date = local_time(h['created_at']).strftime("%Y-%m-%d")
             embed.add_field(name=f"{status_icon} {h['quest']['title']} ({h['quest']['difficulty_rank']})", value=f"📅 {date} | {h['status']}", inline=False)
         await interaction.followup.send(embed=embed)
         
@@ -415,11 +436,7 @@ class PortalSystem(commands.Cog):
             return
 
         # تحديث القيمة في جدول الإعدادات
-        await db._execute_async(
-            lambda: db.client.table('system_config')
-            .upsert({'key': 'portal_interval_hours', 'value': hours})
-            .execute()
-        )
+        await db.set_system_config('portal_interval_hours', hours)
         
         await interaction.response.send_message(f"✅ **تم تحديث النظام:** ستظهر بوابة عشوائية جديدة كل **{hours}** ساعات (خارج أوقات النوم).", ephemeral=True)    
 
@@ -427,6 +444,26 @@ class PortalSystem(commands.Cog):
 # 🛡️ Views
 # ====================================================
 
+def _release_portal_view(h_id, view):
+    """إخراج View مطرود من مخزن discord.py مع إبقاء نمط PortalButton مسجلاً"""
+    for item in [c for c in view.children if isinstance(c, discord.ui.DynamicItem)]:
+        view.remove_item(item)
+    view.stop()
+
+
+# Views البوابات المستخدمة مؤخراً فقط، وأي بوابة أخرى تُبنى من صفها عند أول ضغطة
+recent_portal_views = LRUCache(maxsize=int(os.getenv("PORTAL_VIEW_CACHE_SIZE", "200")), on_evict=_release_portal_view)
+
+
+def remember_portal_view(view):
+    """
+    تسجيل View البوابة الموجود فعلاً على رسالتها (عند الإرسال أو التعديل أو إعادة البناء).
+    التسجيل يستبدل View نفس البوابة ويوقفه، فلا تُسجل أي نسخة مؤقتة لا تُرسل.
+    """
+    recent_portal_views.set(str(view.h_id), view)
+    return view
+
+
 class PortalJoinView(View):
     def __init__(self, quest, h_id, is_private=False, owner_id=None):
         super().__init__(timeout=None)
@@ -434,62 +471,54 @@ class PortalJoinView(View):
         self.h_id = h_id
         self.is_private = is_private
         self.owner_id = owner_id
-        # ✅ هذا السطر يربط الزر بآيدي البوابة الفريد
-        self.children[0].custom_id = f"join_portal_{h_id}"
+        # ✅ الزر يحمل آيدي البوابة الفريد
+        self.add_item(PortalButton("join_portal", h_id, "⚔️ انضمام (20 طاقة)", discord.ButtonStyle.success))
 
-    @discord.ui.button(label="⚔️ انضمام (20 طاقة)", style=discord.ButtonStyle.success, custom_id="join_btn_persistent")
-    async def join(self, interaction: discord.Interaction, button: discord.ui.Button):
+    async def join(self, interaction: discord.Interaction):
         uid = str(interaction.user.id)
         
         # 1. التحقق من البيانات
         pd = await db.get_portal(self.h_id)
         if not pd: return
         
-        # التحقق من الجدول الحقيقي للمشاركين
-        participant_check = await db._execute_async(
-            lambda: db.client.table('portal_participants')
-            .select('*').eq('portal_id', self.h_id).eq('player_id', db.get_player_uuid(uid)) # نحتاج دالة لجلب UUID
-            .execute()
-        )
-        
-        # (للتسهيل سنستخدم player_id المباشر إذا كان لديك، أو نجلب اللاعب أولاً)
         player = await db.get_player(uid)
         if not player:
             await interaction.response.send_message("❌ سجل أولاً!", ephemeral=True)
             return
 
-        # التحقق من التكرار
-        is_joined = await db._execute_async(
-            lambda: db.client.table('portal_participants')
-            .select('*').eq('portal_id', self.h_id).eq('player_id', player['id']).execute()
-        )
-        if is_joined.data:
+        # التحقق من التكرار في الجدول الحقيقي للمشاركين
+        if await db.get_participant(self.h_id, player['id']):
             await interaction.response.send_message("✅ أنت منضم بالفعل.", ephemeral=True)
             return
 
-        if player['current_energy'] < 20:
+        # 2. خصم الطاقة ذرياً قبل الانضمام: strict يرفض الخصم إذا كانت الطاقة الفعلية أقل من 20
+        # (لا نعتمد على قيمة الذاكرة المؤقتة، فضغطتان متزامنتان لا تخصمان من نفس الرصيد)
+        deltas = {'current_energy': -20}
+        if not self.is_private:
+            deltas['public_portals_joined'] = 1
+        if await db.increment_player(uid, deltas, floor=0, strict=True) is None:
             await interaction.response.send_message("🔋 طاقتك لا تكفي.", ephemeral=True)
             return
 
-        # 2. ✅ الإدراج الصحيح في جدول المشاركين (هذا هو الرابط المفقود)
-        await db._execute_async(
-            lambda: db.client.table('portal_participants').insert({
-                'portal_id': self.h_id,
-                'player_id': player['id'],
-                'status': 'joined'
-            }).execute()
-        )
+        # 3. ✅ الإدراج الصحيح في جدول المشاركين (هذا هو الرابط المفقود)
+        try:
+            await db._execute_async(
+                lambda: db.client.table('portal_participants').insert({
+                    'portal_id': self.h_id,
+                    'player_id': player['id'],
+                    'status': 'joined'
+                }).execute(),
+                table='portal_participants', op='insert'
+            )
+        except Exception:
+            # فشل الانضمام: إعادة ما خُصم
+            await db.increment_player(uid, {field: -delta for field, delta in deltas.items()})
+            raise
 
-        # 3. تحديث مصفوفة العرض (لأجل العداد في الرسالة) والخصم
+        # 4. تحديث مصفوفة العرض (لأجل العداد في الرسالة)
         current_participants = pd.get('participants_ids', []) or []
         current_participants.append(uid)
-        
-        update_data = {'current_energy': player['current_energy'] - 20}
-        if not self.is_private:
-            update_data['public_portals_joined'] = player.get('public_portals_joined', 0) + 1
-            
         await db.update_portal_participants(self.h_id, current_participants)
-        await db.update_player(uid, update_data)
         
         # تحديث الرسالة
         embed = interaction.message.embeds[0]
@@ -510,19 +539,19 @@ class PortalJoinView(View):
     async def start_portal(self, interaction, embed, participants):
         embed.title = "🟢 GATE ACTIVE"; embed.color = discord.Color.green()
         embed.description += "\n\n🚀 **انطلقوا! الوحوش بدأت بالظهور.**"
-        await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'active', 'started_at': 'now()'}).eq('id', self.h_id).execute())
-        await interaction.response.edit_message(embed=embed, view=PortalActiveView(self.quest, self.h_id, participants))
+        await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'active', 'started_at': 'now()'}).eq('id', self.h_id).execute(), table='portal_history', op='update')
+        note_portal_status(interaction.client, self.h_id, 'active', self.quest, self.is_private)
+        await interaction.response.edit_message(embed=embed, view=remember_portal_view(PortalActiveView(self.quest, self.h_id, participants)))
 
 class PrivatePortalView(View):
     def __init__(self, quest, h_id, owner_id):
         super().__init__(timeout=None)
         self.quest = quest; self.h_id = h_id; self.owner_id = owner_id
         # ✅ تخصيص المعرفات للأزرار
-        self.children[0].custom_id = f"priv_join_{h_id}"
-        self.children[1].custom_id = f"priv_start_{h_id}"
+        self.add_item(PortalButton("priv_join", h_id, "انضمام", discord.ButtonStyle.success))
+        self.add_item(PortalButton("priv_start", h_id, "🚀 بدء الغارة", discord.ButtonStyle.danger))
 
-    @discord.ui.button(label="انضمام", style=discord.ButtonStyle.success, custom_id="priv_join_btn")
-    async def join(self, interaction: discord.Interaction, button: discord.ui.Button):
+    async def join(self, interaction: discord.Interaction):
         pd = await db.get_portal(self.h_id)
         if not pd: return
         if str(interaction.user.id) in pd.get('participants_ids', []): 
@@ -530,8 +559,7 @@ class PrivatePortalView(View):
         else: 
             await interaction.response.send_message("⛔ لست مدعواً لهذه البوابة الخاصة.", ephemeral=True)
 
-    @discord.ui.button(label="🚀 بدء الغارة", style=discord.ButtonStyle.danger, custom_id="priv_start_btn")
-    async def start(self, interaction: discord.Interaction, button: discord.ui.Button):
+    async def start(self, interaction: discord.Interaction):
         if str(interaction.user.id) != self.owner_id: 
             await interaction.response.send_message("⛔ المالك فقط من يمكنه فتح الختم!", ephemeral=True)
             return
@@ -543,8 +571,9 @@ class PrivatePortalView(View):
         new_embed = discord.Embed(title="🟢 GATE ACTIVE", description=embed.description + "\n\n🔥 **بدأت المهمة!**", color=discord.Color.green())
         for f in embed.fields: new_embed.add_field(name=f.name, value=f.value, inline=f.inline)
         
-        await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'active', 'started_at': 'now()'}).eq('id', self.h_id).execute())
-        await interaction.response.edit_message(embed=new_embed, view=PortalActiveView(self.quest, self.h_id, participants))
+        await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'active', 'started_at': 'now()'}).eq('id', self.h_id).execute(), table='portal_history', op='update')
+        note_portal_status(interaction.client, self.h_id, 'active', self.quest, is_private=True)
+        await interaction.response.edit_message(embed=new_embed, view=remember_portal_view(PortalActiveView(self.quest, self.h_id, participants)))
 
 class PortalActiveView(View):
     def __init__(self, quest, h_id, participants):
@@ -552,7 +581,7 @@ class PortalActiveView(View):
         self.quest = quest; self.h_id = h_id; self.participants = participants
         self.completed = [] # سيتم تحديثها من الداتابيز عند الضغط
         # ✅ تخصيص معرف زر الإتمام
-        self.children[0].custom_id = f"complete_portal_{h_id}"
+        self.add_item(PortalButton("complete_portal", h_id, "✅ إتمام المهمة", discord.ButtonStyle.primary))
 
     async def process_completion(self, interaction: discord.Interaction):
         uid = str(interaction.user.id)
@@ -568,15 +597,9 @@ class PortalActiveView(View):
             return
         
         # 2. فحص حالة الإتمام من قاعدة البيانات
-        participant_check = await db._execute_async(
-            lambda: db.client.table('portal_participants')
-            .select('status')
-            .eq('portal_id', self.h_id)
-            .eq('player_id', player['id'])
-            .execute()
-        )
+        participant = await db.get_participant(self.h_id, player['id'])
         
-        if participant_check.data and participant_check.data[0]['status'] == 'completed':
+        if participant and participant['status'] == 'completed':
             await interaction.response.send_message("✅ لقد سجلت إتمامك بالفعل، انتظر بقية الفريق.", ephemeral=True)
             return
         
@@ -587,9 +610,7 @@ class PortalActiveView(View):
                 await interaction.response.send_message("❌ فشل في جلب بيانات توقيت البوابة.", ephemeral=True)
                 return
             
-            start_str = pd['started_at'].replace('Z', '').split('.')[0]
-            db_start = datetime.fromisoformat(start_str)
-            elapsed = (datetime.now() - db_start).total_seconds() / 60
+            elapsed = (datetime.now() - local_time(pd['started_at'])).total_seconds() / 60
             
             if elapsed < self.quest['min_duration']:
                 rem = int(self.quest['min_duration'] - elapsed)
@@ -604,7 +625,8 @@ class PortalActiveView(View):
             .update({'status': 'completed', 'completed_at': 'now()'})
             .eq('portal_id', self.h_id)
             .eq('player_id', player['id'])
-            .execute()
+            .execute(),
+            table='portal_participants', op='update'
         )
 
         # 5. توزيع الجوائز وتحديث العدادات
@@ -612,18 +634,15 @@ class PortalActiveView(View):
         coins_reward = random.randint(200, 500)
         
         is_private = pd.get('is_private', False)
-        update_fields = {
-            'total_xp': player['total_xp'] + xp_reward,
-            f"{self.quest['category']}_xp": player.get(f"{self.quest['category']}_xp", 0) + xp_reward,
-            'coins': player['coins'] + coins_reward,
+        reward_deltas = {
+            'total_xp': xp_reward,
+            f"{self.quest['category']}_xp": xp_reward,
+            'coins': coins_reward,
+            'private_portals_cleared' if is_private else 'public_portals_cleared': 1,
         }
         
-        if is_private:
-            update_fields['private_portals_cleared'] = player.get('private_portals_cleared', 0) + 1
-        else:
-            update_fields['public_portals_cleared'] = player.get('public_portals_cleared', 0) + 1
-        
-        await db.update_player(uid, update_fields)
+        # إضافة ذرية حتى لا تتعارض مع ساعة الحساب لو كانت تعمل في نفس اللحظة
+        await db.increment_player(uid, reward_deltas)
 
         # 6. إرسال تقرير مفصل في الخاص (DM)
         try:
@@ -638,18 +657,14 @@ class PortalActiveView(View):
             await interaction.response.send_message(f"✅ تم الإتمام! حصلت على {xp_reward} XP و {coins_reward} عملة.", ephemeral=True)
 
         # 7. الفحص النهائي لإغلاق البوابة وبناء قائمة الأبطال (تعديل جوهري ✅)
-        participants_data = await db._execute_async(
-            lambda: db.client.table('portal_participants')
-            .select('status, player_id, players(discord_id, username)')
-            .eq('portal_id', self.h_id)
-            .execute()
-        )
+        participants = await db.get_portal_participants(self.h_id)
         
-        completed_players = [p for p in participants_data.data if p['status'] == 'completed']
-        total_team_count = len(participants_data.data)
+        completed_players = [p for p in participants if p['status'] == 'completed']
+        total_team_count = len(participants)
 
         if len(completed_players) >= total_team_count:
-            await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'cleared', 'ended_at': 'now()'}).eq('id', self.h_id).execute())
+            await db._execute_async(lambda: db.client.table('portal_history').update({'status': 'cleared', 'ended_at': 'now()'}).eq('id', self.h_id).execute(), table='portal_history', op='update')
+            note_portal_status(interaction.client, self.h_id, 'cleared')
             
             # بناء قائمة الشرف بشكل احترافي
             hall_of_fame = ""
@@ -680,10 +695,62 @@ class PortalActiveView(View):
             except Exception as e:
                 print(f"Error updating message: {e}")
 
-    @discord.ui.button(label="✅ إتمام المهمة", style=discord.ButtonStyle.primary, custom_id="complete_portal_btn_persistent")
-    async def complete_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # استدعاء دالة المعالجة التي أصلحناها سابقاً
-        await self.process_completion(interaction)
+
+# كل زر بوابة: (View الذي يعالجه، دالة المعالجة)
+PORTAL_ACTIONS = {
+    "join_portal": (PortalJoinView, "join"),
+    "priv_join": (PrivatePortalView, "join"),
+    "priv_start": (PrivatePortalView, "start"),
+    "complete_portal": (PortalActiveView, "process_completion"),
+}
+
+
+async def load_portal_view(view_cls, h_id):
+    """View البوابة من الذاكرة، أو يُبنى من صف البوابة ومهمتها (بعد إعادة التشغيل أو الطرد)"""
+    view = recent_portal_views.get(str(h_id))
+    if isinstance(view, view_cls):
+        return view
+
+    p = await db.get_portal(h_id)
+    if not p:
+        return None
+    p['quest'] = await db.quests.get(p['quest_id'])
+    if not p['quest']:
+        return None
+    if view_cls is PortalJoinView:
+        view = PortalJoinView(p['quest'], p['id'], is_private=p.get('is_private', False), owner_id=p.get('owner_id'))
+    elif view_cls is PrivatePortalView:
+        view = PrivatePortalView(p['quest'], p['id'], p.get('owner_id'))
+    else:
+        view = PortalActiveView(p['quest'], p['id'], p.get('participants_ids') or [])
+    return remember_portal_view(view)
+
+
+class PortalButton(discord.ui.DynamicItem[Button], template=r"(?P<action>join_portal|priv_join|priv_start|complete_portal)_(?P<h_id>[0-9a-fA-F-]+)"):
+    """
+    أزرار البوابات بآيدي البوابة في custom_id: موجه واحد يُسجل عند التشغيل بدل View لكل بوابة نشطة،
+    والضغطة تصل للـ View المناسب من الذاكرة أو من قاعدة البيانات.
+    """
+
+    def __init__(self, action, h_id, label, style):
+        super().__init__(Button(label=label, style=style, custom_id=f"{action}_{h_id}"))
+        self.action = action
+        self.h_id = h_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(match['action'], match['h_id'], item.label, item.style)
+
+    async def callback(self, interaction: discord.Interaction):
+        view_cls, handler = PORTAL_ACTIONS[self.action]
+        view = await load_portal_view(view_cls, self.h_id)
+        if view is None:
+            await interaction.response.send_message("❌ هذه البوابة لم تعد موجودة.", ephemeral=True)
+            return
+        await getattr(view, handler)(interaction)
+
 
 async def setup(bot):
-    await bot.add_cog(PortalSystem(bot))
\ No newline at end of file
+    await bot.add_cog(PortalSystem(bot))
+    # موجه أزرار كل البوابات (بدل استعادة View لكل بوابة نشطة عند التشغيل)
+    bot.add_dynamic_items(PortalButton)
\ No newline at end of file
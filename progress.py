@@ -0,0 +1,120 @@
+# progress.py
+from tasks_library import ALL_TASKS
+
+
+def report_category(category: str) -> str:
+    """فئة المهمة في التقارير (العمل يُدمج مع المال)"""
+    return 'freedom' if category == 'work' else category
+
+
+class DailyProgress:
+    """
+    ملخص يوم لاعب واحد يتحدث مع كل تسجيل مهمة بدل إعادة قراءة سجلات اليوم:
+    tasks: {task_id: (xp, completed)} والمجاميع (عدد المنجز، الخبرة لكل فئة) تُعدل تزايدياً.
+    evaluate(plan) يعطي نتيجة اليوم مقابل خطة اللاعب بنفس قواعد ساعة الحساب.
+    """
+
+    def __init__(self, player_id: str, log_date: str, tasks: dict = None):
+        self.player_id = player_id
+        self.log_date = log_date
+        self.tasks = {}
+        self.completed_count = 0
+        self.xp_total = 0
+        self.category_xp = {}
+        for task_id, (xp, completed) in (tasks or {}).items():
+            self.apply(task_id, xp, completed)
+
+    def apply(self, task_id: str, xp, completed):
+        """تسجيل (أو تعديل) نتيجة مهمة واحدة"""
+        xp, completed = int(xp or 0), bool(completed)
+        cat = report_category(ALL_TASKS.get(task_id, {}).get('category', 'general'))
+        old = self.tasks.get(task_id)
+        if old:
+            self.xp_total -= old[0]
+            self.completed_count -= old[1]
+            self.category_xp[cat] -= old[0]
+        self.tasks[task_id] = (xp, completed)
+        self.xp_total += xp
+        self.completed_count += completed
+        self.category_xp[cat] = self.category_xp.get(cat, 0) + xp
+
+    def is_completed(self, task_id: str) -> bool:
+        return self.tasks.get(task_id, (0, False))[1]
+
+    def evaluate(self, plan) -> dict:
+        """{completed, total, progress_pct, category_xp, failed_categories} مقابل خطة اليوم"""
+        category_xp = {}
+        completed = 0
+        failed_categories = []
+        for tid, info in plan.items():
+            cat = report_category(info.get('category', 'general'))
+            xp, done = self.tasks.get(tid, (0, None))
+            category_xp[cat] = category_xp.get(cat, 0) + xp
+            if done:
+                completed += 1
+            else:
+                # مهمة غير مسجلة أو مسجلة بدون إنجاز
+                failed_categories.append(cat)
+
+        total = len(plan)
+        return {
+            "completed": completed, "total": total,
+            "progress_pct": (completed / total * 100) if total > 0 else 0,
+            "category_xp": category_xp, "failed_categories": failed_categories,
+        }
+
+    # --- التحويل من وإلى قاعدة البيانات ---
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """من صف player_daily_progress (tasks: {task_id: {"xp", "done"}})"""
+        tasks = {tid: (t.get('xp'), t.get('done')) for tid, t in (row.get('tasks') or {}).items()}
+        return cls(str(row['player_id']), str(row['log_date']), tasks)
+
+    @classmethod
+    def from_logs(cls, player_id: str, log_date: str, logs: list):
+        """من سجلات player_daily_quests (قبل إنشاء جدول الملخصات)"""
+        return cls(player_id, log_date, {log['task_id']: (log.get('xp_gained'), log.get('is_completed')) for log in logs})
+
+
+class ProgressTracker:
+    """
+    ملخصات الأيام في الذاكرة لآخر keep_days أيام فقط {log_date: {player_id: DailyProgress}}.
+    كل upsert_daily_quest يعدل ملخص اللاعب إن كان محملاً، وإلا يُحمل عند أول قراءة من الجدول
+    (الذي يحدثه trigger في قاعدة البيانات مع كل كتابة).
+    version() يتغير مع كل كتابة حتى لا يُخزن ملخص قُرئ قبلها.
+    """
+
+    def __init__(self, keep_days: int = 2):
+        self.keep_days = keep_days
+        self._days = {}
+        self._versions = {}
+
+    def get(self, player_id: str, log_date: str):
+        return self._days.get(log_date, {}).get(player_id)
+
+    def version(self, player_id: str, log_date: str) -> int:
+        return self._versions.get((player_id, log_date), 0)
+
+    def put(self, progress: DailyProgress):
+        day = self._days.get(progress.log_date)
+        if day is None:
+            day = self._days[progress.log_date] = {}
+            self._prune()
+        day[progress.player_id] = progress
+
+    def record(self, data: dict):
+        """تطبيق سجل مهمة بعد حفظه (نفس القاموس المرسل إلى upsert_daily_quest)"""
+        player_id, log_date = str(data['player_id']), str(data['log_date'])
+        key = (player_id, log_date)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        progress = self.get(player_id, log_date)
+        if progress is not None:
+            progress.apply(data['task_id'], data.get('xp_gained'), data.get('is_completed'))
+
+    def _prune(self):
+        for old in sorted(self._days)[:-self.keep_days]:
+            del self._days[old]
+        if self._days:
+            oldest = min(self._days)
+            self._versions = {k: v for k, v in self._versions.items() if k[1] >= oldest}
@@ -0,0 +1,100 @@
+# quest_catalog.py
+import asyncio
+import logging
+import random
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+
+class QuestCatalog:
+    """
+    نسخة مفهرسة في الذاكرة من جدول system_portal_quests (عشرات الصفوف تتغير نادراً):
+    - تُحمّل مرة واحدة عند أول استخدام، وإنشاء أي بوابة بعدها لا يقرأ الجدول
+    - فهارس حسب التاريخ الهجري الموسمي، وأقل مستوى، والرتبة، والفئة
+    - الظهور العشوائي للبوابات موزون بعمود spawn_weight (الافتراضي 1، و0 = لا تظهر عشوائياً)،
+      أما البوابات الخاصة والمجدولة فتختار بالتساوي كما كانت
+    - refresh() يعيد التحميل عند الطلب (أمر الإدارة reload_portal_quests)
+    المهام المعادة مشتركة وللقراءة فقط (MappingProxyType).
+    """
+
+    def __init__(self, database):
+        self.db = database
+        self._loaded = False
+        self._lock = None
+        self.by_id = {}
+        self.regular = []       # غير الموسمية (المولد العشوائي)
+        self.seasonal = {}      # seasonal_hijri_date -> [مهام]
+        self.by_level = {}      # min_aspect_level -> [مهام]
+        self.by_rank = {}       # difficulty_rank -> [مهام]
+        self.by_category = {}   # category -> [مهام]
+
+    async def ensure_loaded(self):
+        if not self._loaded:
+            await self.refresh()
+
+    async def refresh(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            rows = await self.db._fetch_portal_quests()
+            self._index([MappingProxyType(dict(row)) for row in rows])
+            self._loaded = True
+        logger.info(f"🌀 تم تحميل {len(self.by_id)} مهمة بوابة في الذاكرة")
+        return len(self.by_id)
+
+    def _index(self, quests):
+        by_id, regular, seasonal, by_level, by_rank, by_category = {}, [], {}, {}, {}, {}
+        for quest in quests:
+            by_id[str(quest['id'])] = quest
+            if quest.get('is_seasonal'):
+                seasonal.setdefault(quest.get('seasonal_hijri_date'), []).append(quest)
+            else:
+                regular.append(quest)
+            by_level.setdefault(quest.get('min_aspect_level'), []).append(quest)
+            by_rank.setdefault(quest.get('difficulty_rank'), []).append(quest)
+            by_category.setdefault(quest.get('category'), []).append(quest)
+        # استبدال الفهارس مرة واحدة حتى لا يرى أي قارئ فهرساً نصف مبني
+        (self.by_id, self.regular, self.seasonal,
+         self.by_level, self.by_rank, self.by_category) = by_id, regular, seasonal, by_level, by_rank, by_category
+
+    # --- الاستعلامات (كلها من الذاكرة) ---
+
+    async def get(self, quest_id):
+        await self.ensure_loaded()
+        return self.by_id.get(str(quest_id))
+
+    async def seasonal_for(self, hijri_key: str):
+        """البوابة الموسمية لهذا اليوم الهجري (مثل 10-1 للعيد) أو None"""
+        await self.ensure_loaded()
+        quests = self.seasonal.get(hijri_key)
+        return quests[0] if quests else None
+
+    async def regular_quests(self) -> list:
+        await self.ensure_loaded()
+        return self.regular
+
+    async def for_level(self, level: int) -> list:
+        await self.ensure_loaded()
+        return self.by_level.get(level, [])
+
+    async def for_rank(self, rank: str) -> list:
+        await self.ensure_loaded()
+        return self.by_rank.get(rank, [])
+
+    async def for_category(self, category: str) -> list:
+        await self.ensure_loaded()
+        return self.by_category.get(category, [])
+
+    @staticmethod
+    def pick(quests):
+        """اختيار عشوائي متساوٍ، أو None إذا كانت القائمة فارغة"""
+        return random.choice(quests) if quests else None
+
+    @staticmethod
+    def pick_weighted(quests):
+        """اختيار الظهور العشوائي موزوناً بـ spawn_weight، أو None إذا لم تبقَ مهمة بوزن أكبر من 0"""
+        weights = [max(float(1 if q.get('spawn_weight') is None else q['spawn_weight']), 0.0) for q in quests]
+        if not any(weights):
+            return None
+        return random.choices(quests, weights=weights)[0]
@@ -1,17 +1,23 @@
 import discord
 from discord import app_commands
-from discord.ext import tasks, commands
+from discord.ext import commands
 from discord.ui import View, Button, Modal, TextInput, Select
 from discord import ButtonStyle
 import os
 import random
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from hijri_converter import Gregorian
+from datetime import datetime, timedelta, time
 
 # ============ استيراد ملفات المشروع الداخلية ============
-from database import db
+from cache import LRUCache
+from database import db, BatchWriter
+from db_executor import background_lane
+from delivery import DeliveryPipeline
+from hijri_calendar import hijri_calendar
+from journal import CycleJournal
+from progress import DailyProgress
+from scheduler import Scheduler, next_daily_run
 import task_logic
 from task_logic import draw_progress_bar
 from tasks_library import ALL_TASKS
@@ -19,6 +25,20 @@ from tasks_library import ALL_TASKS
 # إعداد السجلات للمحرك
 logger = logging.getLogger(__name__)
 
+# أعمدة اللاعب اللازمة لإرسال لوحة اليوم (بدل select('*') على كل اللاعبين)
+LAUNCH_COLUMNS = ("discord_id", "username") + task_logic.PROFILE_COLUMNS
+
+# مواعيد الدورات اليومية
+LAUNCH_AT = time(5, 0)
+JUDGMENT_AT = time(23, 50)
+FASTING_REMINDER_AT = time(20, 0)
+# الدورة اليومية -> علامة آخر تشغيل في system_config (واسم سجلها هو نفس اسم الدورة)
+CYCLE_MARKERS = {
+    "launch": 'last_daily_quest_run',
+    "judgment": 'last_judgment_run',
+    "fasting": 'last_fasting_reminder_run',
+}
+
 # ============ 1. النوافذ المنبثقة (Modals) ============
 # ملاحظة: تم وضعها في البداية ليتمكن كلاس اللوحة من استدعائها
 
@@ -42,20 +62,15 @@ class CaffeineModal(Modal, title="☕ سجل استهلاك الكافيين"):
             
             xp_gained = int(self.task_info.get('xp_reward', 0) * score_pct)
             
-            await db.upsert_daily_quest({
-                "player_id": self.dashboard_view.player_id, "task_id": self.task_id,
-                "performed_data": {"coffee": c_val, "tea": t_val}, "xp_gained": xp_gained,
-                "is_completed": score_pct == 1.0, "log_date": datetime.now().date().isoformat()
-            })
-            
-            # ✅ تحديث المستوى فوراً
-            await db.recalculate_player_stats(self.dashboard_view.player_id)
+            await self.dashboard_view.record_task(
+                self.task_id, {"coffee": c_val, "tea": t_val}, xp_gained, score_pct == 1.0
+            )
 
             msg = f"✅ تم التسجيل. الخبرة: +{xp_gained}"
             if score_pct < 1.0: msg += "\n⚠️ تنبيه: تجاوزت الحد!"
             
             await interaction.followup.send(msg, ephemeral=True)
-            await self.dashboard_view.back_to_main(interaction)
+            self.dashboard_view.refresh_soon(interaction)
         except ValueError:
             await interaction.followup.send("❌ أدخل أرقاماً فقط.", ephemeral=True)
 
@@ -71,63 +86,166 @@ class NumericTaskModal(Modal):
         await interaction.response.defer(ephemeral=True)
         try:
             val = float(self.value_input.value)
-            p = await db.get_player(str(interaction.user.id))
+            p = await self.dashboard_view.profile()
             target = float(self.task_info.get('targets', {}).get(p.get('age_group', 'young'), 1.0))
             if target <= 0: target = 1.0
             
             progress = min(1.0, val / target)
             xp = int(self.task_info.get('xp_reward', 0) * progress)
 
-            await db.upsert_daily_quest({
-                "player_id": self.dashboard_view.player_id, "task_id": self.task_id,
-                "performed_data": {"value": val, "expected": target}, "xp_gained": xp,
-                "is_completed": progress >= 1.0, "log_date": datetime.now().date().isoformat()
-            })
-            
-            # ✅ تحديث المستوى فوراً
-            await db.recalculate_player_stats(self.dashboard_view.player_id)
+            await self.dashboard_view.record_task(
+                self.task_id, {"value": val, "expected": target}, xp, progress >= 1.0
+            )
 
             await interaction.followup.send(f"✅ تم التسجيل ({int(progress*100)}%)", ephemeral=True)
-            await self.dashboard_view.back_to_main(interaction)
+            self.dashboard_view.refresh_soon(interaction)
         except:
             await interaction.followup.send("❌ أدخل رقماً صحيحاً.", ephemeral=True)
             
+ASPECT_OPTIONS = [
+    ("القوة البدنية 💪", "strength", "💪"),
+    ("الذكاء والمعرفة 🧠", "intelligence", "🧠"),
+    ("الصحة والعافية ❤️", "vitality", "❤️"),
+    ("الجانب الاجتماعي 🤝", "agility", "🤝"),
+    ("الجانب الديني 🕌", "perception", "🕌"),
+    ("الحرية المالية والعمل 💸", "freedom", "💸"),
+]
+
+
+def _release_dashboard(key, view):
+    """
+    إخراج لوحة مطرودة من مخزن discord.py. عناصر DynamicItem تُزال أولاً لأن
+    remove_view يلغي تسجيل أنماطها، والموجه يجب أن يبقى مسجلاً لكل اللوحات.
+    """
+    for item in [c for c in view.children if isinstance(c, discord.ui.DynamicItem)]:
+        view.remove_item(item)
+    view.stop()
+
+
+# اللوحات المستخدمة مؤخراً فقط في الذاكرة، وأي لوحة أخرى تُبنى من جديد عند أول ضغطة
+recent_dashboards = LRUCache(maxsize=int(os.getenv("DASHBOARD_CACHE_SIZE", "500")), on_evict=_release_dashboard)
+
+
+class DashboardSelect(discord.ui.DynamicItem[Select], template=r"main_sel_(?P<player_id>[0-9a-fA-F-]+)"):
+    """
+    قائمة الأقسام في الشاشة الرئيسية للوحة، وهي الموجه الوحيد المسجل عند التشغيل لكل اللوحات:
+    معرف اللاعب في custom_id، فأول ضغطة بعد إعادة التشغيل تعيد بناء لوحته من قاعدة البيانات.
+    """
+
+    def __init__(self, player_id):
+        super().__init__(Select(
+            placeholder="اختر قسماً لعرض مهامه...",
+            options=[discord.SelectOption(label=label, value=value, emoji=emoji) for label, value, emoji in ASPECT_OPTIONS],
+            custom_id=f"main_sel_{player_id}"
+        ))
+        self.player_id = player_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Select, match):
+        return cls(match['player_id'])
+
+    async def callback(self, interaction: discord.Interaction):
+        view = await QuestDashboard.resume(self.player_id)
+        if view is None:
+            await interaction.response.send_message("⌛ انتهت صلاحية هذه اللوحة، انتظر لوحة الغد.", ephemeral=True)
+            return
+        if await view.interaction_check(interaction):
+            await view.aspect_callback(interaction)
+
+
 class QuestDashboard(View):
     """
     لوحة التحكم الشاملة (نظام الملاحة - Single Message Navigation)
+    اللوحة تحتفظ بملخص يومها وبيانات الصياد في الذاكرة: كل تسجيل مهمة كتابة واحدة تُطبق محلياً،
+    والتسجيلات المتتالية السريعة تُدمج في تعديل واحد للرسالة (REFRESH_DELAY).
     """
+    REFRESH_DELAY = 0.5  # ثانية
+
     def __init__(self, player_id, discord_snowflake_id, task_list):
         super().__init__(timeout=None)
         self.player_id = player_id
         self.discord_snowflake_id = int(discord_snowflake_id)
         self.task_list = task_list
+        self.progress = None        # DailyProgress ليوم اللوحة (يُحمل عند أول عرض)
+        self._refresh_interaction = None
+        self._refresh_task = None
         # نبدأ ببناء الواجهة الرئيسية فوراً
         self.build_main_ui()
 
+    @classmethod
+    async def resume(cls, player_id):
+        """اللوحة من الذاكرة إن استُخدمت مؤخراً اليوم، وإلا تُبنى من صف اللاعب وخطة اليوم"""
+        key = (player_id, datetime.now().date())
+        view = recent_dashboards.get(key)
+        if view is None:
+            player = await db.get_player_by_uuid(player_id)
+            tasks = task_logic.get_daily_tasks_for_player(player) if player else None
+            if not tasks:
+                return None
+            view = cls(player['id'], player['discord_id'], tasks)
+            recent_dashboards.set(key, view)
+        return view
+
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.discord_snowflake_id:
             await interaction.response.send_message("🛑 هذه اللوحة مخصصة لصياد آخر!", ephemeral=True)
             return False
+        # تحديث مؤجل من تسجيل سابق يُنفذ قبل التنقل حتى لا يكتب فوق الشاشة الجديدة
+        await self.flush_refresh()
         return True
 
+    # =================================================
+    # 0. حالة اللوحة في الذاكرة
+    # =================================================
+    async def profile(self) -> dict:
+        """صف الصياد (الاسم، الرتبة، الفئة العمرية) من ذاكرة اللاعبين المشتركة (TTL وتُحدث مع كل كتابة)"""
+        return await db.get_player(str(self.discord_snowflake_id))
+
+    async def day_progress(self, today: str):
+        if self.progress is None or self.progress.log_date != today:
+            self.progress = await db.get_daily_progress(str(self.player_id), today)
+        return self.progress
+
+    async def record_task(self, task_id, performed_data: dict, xp: int, completed: bool):
+        """حفظ نتيجة مهمة (الطلب الوحيد لكل تسجيل) وتطبيقها على ملخص اللوحة"""
+        today = datetime.now().date().isoformat()
+        progress = await self.day_progress(today)
+        await db.upsert_daily_quest({
+            "player_id": self.player_id, "task_id": task_id,
+            "performed_data": performed_data, "xp_gained": xp,
+            "is_completed": completed, "log_date": today
+        })
+        # db.progress يحدّث نفس الملخص عادة، وإن كانت اللوحة تحمل نسخة منفصلة نطبقه عليها هنا
+        if db.progress.get(str(self.player_id), today) is not progress:
+            progress.apply(task_id, xp, completed)
+
+    def refresh_soon(self, interaction: discord.Interaction):
+        """العودة للرئيسية بعد تسجيل: التحديثات خلال REFRESH_DELAY تُدمج في تعديل واحد (بآخر تفاعل)"""
+        self.build_main_ui()
+        self._refresh_interaction = interaction
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_later())
+
+    async def _refresh_later(self):
+        await asyncio.sleep(self.REFRESH_DELAY)
+        await self.flush_refresh()
+
+    async def flush_refresh(self):
+        interaction, self._refresh_interaction = self._refresh_interaction, None
+        if interaction is None:
+            return
+        try:
+            await self.update_dashboard_embed(interaction)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تحديث لوحة {self.player_id}: {e}")
+
     # =================================================
     # 1. الواجهة الرئيسية (Main Menu)
     # =================================================
     def build_main_ui(self):
         self.clear_items()
-        
-        aspect_options = [
-            discord.SelectOption(label="القوة البدنية 💪", value="strength", emoji="💪"),
-            discord.SelectOption(label="الذكاء والمعرفة 🧠", value="intelligence", emoji="🧠"),
-            discord.SelectOption(label="الصحة والعافية ❤️", value="vitality", emoji="❤️"),
-            discord.SelectOption(label="الجانب الاجتماعي 🤝", value="agility", emoji="🤝"),
-            discord.SelectOption(label="الجانب الديني 🕌", value="perception", emoji="🕌"),
-            discord.SelectOption(label="الحرية المالية والعمل 💸", value="freedom", emoji="💸"),
-        ]
-        
-        select = Select(placeholder="اختر قسماً لعرض مهامه...", options=aspect_options, custom_id=f"main_sel_{self.player_id}")
-        select.callback = self.aspect_callback
-        self.add_item(select)
+        # الشاشة الرئيسية بلا عناصر ثابتة، فلا يحتفظ discord.py بنسخة من اللوحة لكل رسالة
+        self.add_item(DashboardSelect(self.player_id))
 
     async def aspect_callback(self, interaction: discord.Interaction):
         # الانتقال لقائمة مهام القسم
@@ -222,15 +340,10 @@ class QuestDashboard(View):
 
     async def process_simple_confirm(self, interaction, task_id, task_info):
         await interaction.response.defer(ephemeral=True)
-        await db.upsert_daily_quest({
-            "player_id": self.player_id, "task_id": task_id,
-            "performed_data": {"status": "done"}, "xp_gained": task_info.get('xp_reward', 0),
-            "is_completed": True, "log_date": datetime.now().date().isoformat()
-        })
-        await db.recalculate_player_stats(self.player_id)
+        await self.record_task(task_id, {"status": "done"}, task_info.get('xp_reward', 0), True)
         await interaction.followup.send(f"✅ تم إنجاز: **{task_info['title']}**", ephemeral=True)
         # العودة للرئيسية وتحديثها
-        await self.back_to_main(interaction)
+        self.refresh_soon(interaction)
 
     async def show_options_ui(self, interaction, task_id, task_info):
         """عرض الخيارات (مثل الصلوات) في نفس الرسالة"""
@@ -243,15 +356,11 @@ class QuestDashboard(View):
             opt = next((o for o in task_info['options'] if o['value'] == select.values[0]), None)
             xp = int(task_info.get('xp_reward', 0) * opt['xp_pct'])
             
-            await db.upsert_daily_quest({
-                "player_id": self.player_id, "task_id": task_id,
-                "performed_data": {"selected": select.values[0], "label": opt['label']},
-                "xp_gained": xp, "is_completed": opt['xp_pct'] >= 0.8,
-                "log_date": datetime.now().date().isoformat()
-            })
-            await db.recalculate_player_stats(self.player_id)
+            await self.record_task(
+                task_id, {"selected": select.values[0], "label": opt['label']}, xp, opt['xp_pct'] >= 0.8
+            )
             await i.followup.send(f"✅ تم تسجيل: **{opt['label']}**", ephemeral=True)
-            await self.back_to_main(i)
+            self.refresh_soon(i)
 
         select.callback = cb
         self.add_item(select)
@@ -268,9 +377,8 @@ class QuestDashboard(View):
     # =================================================
     async def update_dashboard_embed(self, interaction: discord.Interaction):
         today = datetime.now().date().isoformat()
-        p_data = await db.get_player(str(self.discord_snowflake_id))
-        logs = await db.get_player_daily_logs(str(self.player_id), today)
-        log_dict = {log['task_id']: log for log in logs}
+        p_data = await self.profile()
+        progress = await self.day_progress(today)
 
         embed = discord.Embed(title="📊 ملخص إنجازات اليوم", color=discord.Color.blue())
         embed.set_author(name=f"الصياد: {p_data['username']}", icon_url=interaction.user.display_avatar.url)
@@ -291,7 +399,7 @@ class QuestDashboard(View):
             cat_tasks = [tid for tid in self.task_list.keys() if self.task_list[tid].get('category') in target_cats]
             if not cat_tasks: continue
             
-            done_in_cat = sum(1 for tid in cat_tasks if log_dict.get(tid, {}).get('is_completed'))
+            done_in_cat = sum(1 for tid in cat_tasks if progress.is_completed(tid))
             total_done += done_in_cat
             
             bar = draw_progress_bar(done_in_cat, len(cat_tasks), length=8)
@@ -324,250 +432,506 @@ class QuestDashboard(View):
 class QuestEngine(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.daily_cycle.start()
+        self.dashboard_pipeline = DeliveryPipeline(
+            "daily_dashboard",
+            concurrency=int(os.getenv("DM_CONCURRENCY", "8")),
+            max_per_second=float(os.getenv("DM_MAX_PER_SECOND", "25"))
+        )
+        self.report_pipeline = DeliveryPipeline(
+            "judgment_report",
+            concurrency=int(os.getenv("DM_CONCURRENCY", "8")),
+            max_per_second=float(os.getenv("DM_MAX_PER_SECOND", "25"))
+        )
+        self._journals = {}
+        self._judgment_lock = asyncio.Lock()  # الدورة المجدولة والاستكمال والأمر اليدوي لا تتداخل
+
+        # مواعيد الدورات اليومية تُحسب من آخر يوم نُفذت فيه كل دورة (في الذاكرة)،
+        # وتُستعاد عند التشغيل من علامات system_config حتى لا تعيد نوافذ الاستكمال دورة اكتملت،
+        # والعلامات والسجل تُفحص مرة أخرى عند حلول الموعد
+        self._done_on = {}
+        self.scheduler = Scheduler("quest_engine")
+        self.scheduler.add("daily_launch", lambda now: next_daily_run(now, LAUNCH_AT, self._done_on.get("launch")), self.run_launch_cycle)
+        self.scheduler.add("daily_judgment", lambda now: next_daily_run(now, JUDGMENT_AT, self._done_on.get("judgment")), self.run_judgment_cycle)
+        self.scheduler.add("judgment_resume", self._judgment_resume_due, self.resume_judgment_cycle)
+        self.scheduler.add("fasting_reminder", lambda now: next_daily_run(now, FASTING_REMINDER_AT, self._done_on.get("fasting"), until=time(21, 0)), self.run_fasting_cycle)
+        self.scheduler.start(wait_for=self._before_schedule)
 
     def cog_unload(self):
-        self.daily_cycle.cancel()
+        self.scheduler.stop()
 
-    @tasks.loop(minutes=1)
-    async def daily_cycle(self):
-        """المراقب الزمني للمهام اليومية"""
-        try:
-            now = datetime.now()
-            time_str = now.strftime("%H:%M")
-            today_str = now.date().isoformat()
-            
-            # طباعة للتأكد من التوقيت كل ساعة
-            if now.minute == 0:
-                logger.info(f"🕒 توقيت البوت: {time_str} - التاريخ: {today_str}")
-
-            # 1. دورة الفجر (توزيع المهام)
-            if now.hour >= 5:
-                last_run = await db.get_system_config('last_daily_quest_run')
-                if last_run != today_str:
-                    logger.info(f"⏰ بدء دورة توزيع المهام ليوم {today_str}...")
-                    await db.set_system_config('last_daily_quest_run', today_str)
-                    await self.launch_daily_quests()
-
-            # 2. دورة منتصف الليل (ساعة الحساب)
-            if now.hour == 23 and now.minute >= 50:
-                last_judge = await db.get_system_config('last_judgment_run')
-                if last_judge != today_str:
-                    logger.info(f"⚖️ بدء دورة الحساب ليوم {today_str}...")
-                    await db.set_system_config('last_judgment_run', today_str)
-                    await self.apply_daily_judgment()
-
-            # 3. تذكير الصيام (الساعة 8 مساءً)
-            if now.hour == 20 and now.minute == 0:
-                await self.send_fasting_reminders()
-        except Exception as e:
-            logger.error(f"❌ خطأ في الدورة الزمنية: {e}")
-
-    async def send_fasting_reminders(self):
-        """إرسال تذكير بالصيام قبل يوم"""
+    async def _before_schedule(self):
+        """قبل أول تخطيط: الدورات التي نُفذت اليوم واكتملت (قبل إعادة التشغيل) لا تُستحق مرة أخرى"""
+        await self.bot.wait_until_ready()
+        today = datetime.now().date()
+        for cycle, key in CYCLE_MARKERS.items():
+            try:
+                last_run = await db.get_system_config(key)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر قراءة {key}: {e}")
+                continue
+            if last_run == today.isoformat() and not self.get_journal(cycle, last_run).in_progress:
+                self._done_on[cycle] = today
+
+    async def run_launch_cycle(self):
+        """دورة الفجر (توزيع المهام)"""
+        today = datetime.now().date()
+        today_str = today.isoformat()
+        # العلامة في system_config تعني "بدأت الدورة" فقط، والسجل يحدد إن كانت اكتملت فعلاً
+        last_run = await db.get_system_config('last_daily_quest_run')
+        journal = self.get_journal('launch', today_str)
+        if last_run != today_str or journal.in_progress:
+            if journal.in_progress:
+                logger.info(f"♻️ استكمال دورة توزيع المهام المنقطعة ليوم {today_str}...")
+            else:
+                logger.info(f"⏰ بدء دورة توزيع المهام ليوم {today_str}...")
+            await db.set_system_config('last_daily_quest_run', today_str)
+            await self.launch_daily_quests(journal)
+        self._done_on["launch"] = today
+
+    async def run_judgment_cycle(self):
+        """دورة منتصف الليل (ساعة الحساب)"""
+        today = datetime.now().date()
+        today_str = today.isoformat()
+        last_judge = await db.get_system_config('last_judgment_run')
+        journal = self.get_journal('judgment', today_str)
+        if last_judge != today_str or journal.in_progress:
+            if journal.in_progress:
+                logger.info(f"♻️ استكمال دورة الحساب المنقطعة ليوم {today_str}...")
+            else:
+                logger.info(f"⚖️ بدء دورة الحساب ليوم {today_str}...")
+            await db.set_system_config('last_judgment_run', today_str)
+            async with self._judgment_lock:
+                await self.apply_daily_judgment(judgment_date=today, journal=journal)
+        self._done_on["judgment"] = today
+
+    def _open_judgment_day(self, now):
+        """
+        يوم حساب لم تُغلق دورته: اليوم (تقارير تجاوزت الموعد النهائي أو نتائج لم تُحفظ)،
+        أو الأمس إذا انقطع الحساب وأُعيد التشغيل بعد منتصف الليل وقبل حساب اليوم
+        """
+        today = now.date()
+        if self.get_journal('judgment', today.isoformat()).in_progress:
+            return today
+        yesterday = today - timedelta(days=1)
+        if now.time() < JUDGMENT_AT and self.get_journal('judgment', yesterday.isoformat()).in_progress:
+            return yesterday
+        return None
+
+    def _judgment_resume_due(self, now):
+        """دورة حساب مفتوحة: موعد الاستكمال هو الآن (والمجدول يعيد المحاولة كل دقيقة حتى تُغلق)"""
+        return now if self._open_judgment_day(now) else None
+
+    async def resume_judgment_cycle(self):
+        day = self._open_judgment_day(datetime.now())
+        if day is None:
+            return
+        logger.info(f"♻️ استكمال دورة الحساب المفتوحة ليوم {day.isoformat()}...")
+        async with self._judgment_lock:
+            await self.apply_daily_judgment(judgment_date=day, journal=self.get_journal('judgment', day.isoformat()))
+
+    async def run_fasting_cycle(self):
+        """تذكير الصيام (الساعة 8 مساءً)، مرة واحدة في اليوم حتى مع إعادة التشغيل داخل نافذته"""
+        today = datetime.now().date()
+        today_str = today.isoformat()
+        last_run = await db.get_system_config('last_fasting_reminder_run')
+        journal = self.get_journal('fasting', today_str)
+        if last_run != today_str or journal.in_progress:
+            if journal.in_progress:
+                logger.info(f"♻️ استكمال تذكير الصيام المنقطع ليوم {today_str}...")
+            await db.set_system_config('last_fasting_reminder_run', today_str)
+            await self.send_fasting_reminders(journal)
+        self._done_on["fasting"] = today
+
+    def get_journal(self, cycle, day):
+        """سجل الدورة ليوم معين (يُقرأ من القرص مرة واحدة ثم يبقى في الذاكرة)"""
+        key = (cycle, day)
+        if key not in self._journals:
+            # نحتفظ بآخر سجل سابق فقط لكل دورة (اليوم والأمس)
+            days = sorted(d for c, d in self._journals if c == cycle)
+            for old in days[:-1]:
+                del self._journals[(cycle, old)]
+            self._journals[key] = CycleJournal(cycle, day)
+        return self._journals[key]
+
+    async def resolve_user(self, discord_id, pipeline=None):
+        """
+        المستخدم من ذاكرة البوت إن وجد، وإلا طلب API واحد.
+        مع pipeline تُفتح قناة الخاص هنا أيضاً، ويُحجز مكان في معدل الإرسال لكل طلب فعلي
+        (جلب المستخدم وفتح الخاص)، فلا يُحسب على المعدل إلا طلب الإرسال وحده
+        """
+        user = self.bot.get_user(int(discord_id))
+        if user is None:
+            if pipeline: await pipeline.pace()
+            user = await self.bot.fetch_user(int(discord_id))
+        if pipeline and user.dm_channel is None:
+            await pipeline.pace()
+            await user.create_dm()
+        return user
+
+    async def send_fasting_reminders(self, journal=None):
+        """إرسال تذكير بالصيام قبل يوم (مع journal يُسجل كل لاعب بعد تذكيره فلا يُكرر له بعد الاستكمال)"""
         try:
-            from hijri_converter import Gregorian
-            tomorrow = datetime.now() + timedelta(days=1)
-            hijri_tom = Gregorian(tomorrow.year, tomorrow.month, tomorrow.day).to_hijri()
+            tomorrow = hijri_calendar.tomorrow()
             
             msg = ""
-            if hijri_tom.day in [13, 14, 15]: msg = "🌕 **تذكير:** غداً من الأيام البيض."
-            elif tomorrow.weekday() in [0, 3]: msg = "📅 **تذكير:** غداً يوم صيام (إثنين/خميس)."
-            elif hijri_tom.month == 1 and hijri_tom.day == 10: msg = "🕌 **تذكير هام:** غداً يوم عاشوراء."
+            if tomorrow.is_white_day: msg = "🌕 **تذكير:** غداً من الأيام البيض."
+            elif tomorrow.is_mon_thu: msg = "📅 **تذكير:** غداً يوم صيام (إثنين/خميس)."
+            elif tomorrow.is_ashura: msg = "🕌 **تذكير هام:** غداً يوم عاشوراء."
             
             if msg:
-                players = await db._execute_async(lambda: db.client.table('players').select('*').eq('faith_type', 'muslim').eq('status', 'active').execute())
-                for p in players.data:
-                    try:
-                        u = await self.bot.fetch_user(int(p['discord_id']))
-                        await u.send(f"🔔 {msg}")
-                    except: pass
+                sent = {}
+                if journal:
+                    sent = journal.done('sent')
+                    journal.start()
+
+                async def pending():
+                    async for p in db.iter_players(('discord_id',), where={'faith_type': 'muslim', 'status': 'active'}, exclude_status=None):
+                        if p['id'] not in sent:
+                            yield p
+
+                pipeline = DeliveryPipeline("fasting_reminder")
+
+                async def remind(p):
+                    u = await self.resolve_user(p['discord_id'], pipeline)
+                    await u.send(f"🔔 {msg}")
+                    if journal: journal.mark('sent', p['id'])
+
+                await pipeline.run(pending(), remind)
+                if journal: journal.complete()
         except Exception as e:
             logger.error(f"Fasting Reminder Error: {e}")
 
-    async def launch_daily_quests(self):
-        """توليد وإرسال لوحات المهام"""
-        players = await db._execute_async(lambda: db.client.table('players').select('*').neq('status', 'inactive').execute())
-        
-        logger.info(f"🚀 بدء توزيع المهام لـ {len(players.data)} صياد...")
-        
-        for i, p in enumerate(players.data):
+    async def launch_daily_quests(self, journal=None):
+        """
+        توليد وإرسال لوحات المهام.
+        مع journal يُسجل كل لاعب بعد إرسال لوحته، وعند الاستكمال بعد إعادة التشغيل
+        تُرسل اللوحات للاعبين غير المسجلين فقط (بدون تكرار رسائل من وصلته لوحته)
+        """
+        # معرفات رسائل اللوحات تُحفظ دفعة واحدة بعد انتهاء الإرسال
+        writer = BatchWriter(db)
+
+        sent = {}
+        if journal:
+            sent = journal.done('sent')
+            journal.start()
+            # لوحات أُرسلت قبل الانقطاع: معرفاتها ربما لم تُحفظ بعد، فنعيد حفظها (الكتابة متطابقة)
+            for pid, data in sent.items():
+                writer.update_player(pid, {'last_dashboard_msg_id': data['msg_id']})
+            if sent:
+                logger.info(f"📒 تخطي {len(sent)} صياد استلموا لوحاتهم قبل الانقطاع")
+
+        async def pending():
+            # اللاعبون يُقرأون صفحة صفحة بالأعمدة اللازمة فقط، والإرسال يبدأ من أول صفحة
+            async for p in db.iter_players(LAUNCH_COLUMNS):
+                if p['id'] not in sent:
+                    yield p
+
+        logger.info("🚀 بدء توزيع المهام...")
+
+        async def deliver(p):
             assigned_tasks = task_logic.get_daily_tasks_for_player(p)
-            if not assigned_tasks: continue
+            if not assigned_tasks: return False
 
-            try:
-                user = await self.bot.fetch_user(int(p['discord_id']))
-                view = QuestDashboard(p['id'], p['discord_id'], assigned_tasks)
-                
-                status_titles = {
-                    "active": "⚔️ نداء الواجب اليومي",
-                    "sick": "🩹 بروتوكول التعافي",
-                    "traveling": "✈️ مهام الرحالة",
-                    "excuse": "✨ استراحة المحارب"
-                }
-                title = status_titles.get(p['status'], "⚔️ المهام اليومية")
-
-                # حساب إحصائيات سريعة
-                total_xp = sum(t.get('xp_reward', 0) for t in assigned_tasks.values())
-                categories = set(t.get('category', 'عام') for t in assigned_tasks.values())
-                cat_emojis = {"vitality": "❤️", "work": "💼", "freedom": "💸", "intelligence": "🧠", "agility": "🤝", "perception": "🕌", "strength": "💪"}
-                cat_icons = " ".join([cat_emojis.get(c, "🔸") for c in categories])
-
-                embed = discord.Embed(
-                    title=title,
-                    description=f"أهلاً بك يا **{p['username']}**. يوم جديد، فرصة جديدة للارتقاء!",
-                    color=discord.Color.gold()
-                )
-                embed.add_field(name="🎯 عدد المهام", value=f"**{len(assigned_tasks)}** مهمة", inline=True)
-                embed.add_field(name="✨ مجموع الخبرة", value=f"**{total_xp}** XP", inline=True)
-                embed.add_field(name="🏷️ الجوانب", value=cat_icons, inline=False)
-                embed.set_footer(text="اضغط على القائمة أدناه لبدء التنفيذ 👇")
-
-                msg = await user.send(embed=embed, view=view)
+            user = await self.resolve_user(p['discord_id'], self.dashboard_pipeline)
+            view = QuestDashboard(p['id'], p['discord_id'], assigned_tasks)
                 
-                # ✅ حفظ آيدي الرسالة لتحديثها لاحقاً
-                await db.update_player(p['discord_id'], {'last_dashboard_msg_id': str(msg.id)})
-                
-                if (i + 1) % 5 == 0: await asyncio.sleep(2)
-                else: await asyncio.sleep(0.6)
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ تعذر الإرسال للصياد {p['username']}: {e}")
+            status_titles = {
+                "active": "⚔️ نداء الواجب اليومي",
+                "sick": "🩹 بروتوكول التعافي",
+                "traveling": "✈️ مهام الرحالة",
+                "excuse": "✨ استراحة المحارب"
+            }
+            title = status_titles.get(p['status'], "⚔️ المهام اليومية")
+
+            # حساب إحصائيات سريعة
+            total_xp = sum(t.get('xp_reward', 0) for t in assigned_tasks.values())
+            categories = set(t.get('category', 'عام') for t in assigned_tasks.values())
+            cat_emojis = {"vitality": "❤️", "work": "💼", "freedom": "💸", "intelligence": "🧠", "agility": "🤝", "perception": "🕌", "strength": "💪"}
+            cat_icons = " ".join([cat_emojis.get(c, "🔸") for c in categories])
+
+            embed = discord.Embed(
+                title=title,
+                description=f"أهلاً بك يا **{p['username']}**. يوم جديد، فرصة جديدة للارتقاء!",
+                color=discord.Color.gold()
+            )
+            embed.add_field(name="🎯 عدد المهام", value=f"**{len(assigned_tasks)}** مهمة", inline=True)
+            embed.add_field(name="✨ مجموع الخبرة", value=f"**{total_xp}** XP", inline=True)
+            embed.add_field(name="🏷️ الجوانب", value=cat_icons, inline=False)
+            embed.set_footer(text="اضغط على القائمة أدناه لبدء التنفيذ 👇")
+
+            msg = await user.send(embed=embed, view=view)
+            
+            # ✅ حفظ آيدي الرسالة لتحديثها لاحقاً
+            writer.update_player(p['id'], {'last_dashboard_msg_id': str(msg.id)})
+            if journal: journal.mark('sent', p['id'], msg_id=str(msg.id))
+
+        # الإرسال بالتوازي، وحدود ديسكورد تحدد السرعة بدل الانتظار الثابت بين كل لاعب
+        await self.dashboard_pipeline.run(pending(), deliver)
+        await writer.flush()
+        if journal: journal.complete()
 
         logger.info("✅ اكتمل توزيع المهام.")
 
-    async def apply_daily_judgment(self):
-        """تحليل النتائج وتطبيق العقوبات (النسخة الموحدة)"""
-        today = datetime.now().date().isoformat()
-        players = await db._execute_async(lambda: db.client.table('players').select('*').neq('status', 'inactive').execute())
-        
-        logger.info(f"⚖️ بدء ساعة الحساب لـ {len(players.data)} صياد...")
+    async def apply_daily_judgment(self, judgment_date=None, deadline=None, journal=None):
+        """
+        ساعة الحساب على ثلاث مراحل:
+        1. الحساب: في الذاكرة فقط فوق ملخصات اليوم والبفات المجلوبة مسبقاً (بدون أي طلب لكل لاعب)
+        2. الحفظ: النتائج على دفعات عبر BatchWriter
+        3. الإشعارات: تقارير متوازية عبر DeliveryPipeline وتتوقف عند الموعد النهائي
+        كل المراحل تعمل على تاريخ اليوم الذي بدأ فيه الحساب حتى لو تجاوز التنفيذ منتصف الليل.
+        مع journal يُسجل كل لاعب بعد حفظ صفوفه فعلاً وكل تقرير بعد إرساله، فالاستكمال بعد إعادة
+        التشغيل لا يعاقب أو يكافئ نفس اللاعب مرتين، ويرسل التقارير المتبقية فقط.
+        صفوف اللاعب التي فشل حفظها تُسجل كما هي (unsaved) وتُعاد كتابتها في الاستكمال بدون إعادة حسابها،
+        ولا يُرسل تقريره قبل حفظها. الدورة لا تُغلق إلا بعد حفظ كل النتائج ووصول كل التقارير.
+        """
+        started = datetime.now()
+        judgment_date = judgment_date or started.date()
+        today = judgment_date.isoformat()
+        if deadline is None:
+            # الموعد النهائي: بعد مدة الميزانية أو منتصف الليل، أيهما أقرب
+            # (استكمال يوم سابق يأخذ مدة الميزانية كاملة حتى لا تؤجل تقاريره فور بدئه)
+            budget_end = started + timedelta(minutes=float(os.getenv("JUDGMENT_BUDGET_MINUTES", "9")))
+            midnight = datetime.combine(judgment_date + timedelta(days=1), datetime.min.time())
+            deadline = budget_end if midnight <= started else min(budget_end, midnight)
+
+        logger.info(f"⚖️ بدء ساعة الحساب (تاريخ {today}، الموعد النهائي {deadline:%H:%M:%S})...")
+
+        persisted, unsaved, resumed, computed = {}, {}, 0, False
+        if journal:
+            persisted = journal.done('persisted')
+            unsaved = {pid: entry for pid, entry in journal.done('unsaved').items() if pid not in persisted}
+            resumed, computed = len(persisted), journal.reached('persisted')
+            journal.start()
+            if persisted:
+                logger.info(f"📒 تخطي حساب {len(persisted)} صياد حُفظت نتائجهم قبل الانقطاع")
+
+        # 1. الحساب (صفحة صفحة من اللاعبين، بكل الأعمدة لأن العقوبات تقرأ أعمدة اختيارية)
+        # يُتخطى بالكامل إذا اكتمل الحفظ قبل الانقطاع ولم يبقَ إلا التقارير
+        verdicts = []
+        total_players = 0
+        if not computed:
+            # جلب ملخصات اليوم (صف لكل لاعب) ودروع الحماية لكل اللاعبين دفعة واحدة بدلاً من استعلام لكل لاعب
+            progress_by_player = await db.get_daily_progress_for_date(today)
+            protection_by_player = await db.get_active_buffs_by_player('streak_protection')
+            async for page in db.iter_player_pages():
+                for p in page:
+                    if p['id'] in persisted or p['id'] in unsaved: continue
+                    try:
+                        buffs = protection_by_player.get(p['id'])
+                        verdict = self.judge_player(p, judgment_date, progress_by_player.get(p['id']), buffs[0] if buffs else None)
+                        if verdict is None: continue
+                        verdicts.append(verdict)
+                    except Exception as e:
+                        logger.error(f"❌ خطأ في حساب نتائج {p['username']}: {e}")
+                total_players += len(page)
+                logger.info(f"⚖️ تقدم الحساب: {total_players} صياد")
+
+        # 2. الحفظ (دفعات محدودة، وكل لاعب يُسجل بعد حفظ صفوفه حتى لا يتكرر تطبيقها بعد الانقطاع)
+        failed_writes = 0
+        if unsaved:
+            # صفوف فشل حفظها قبل الانقطاع: تُعاد كتابتها كما هي (الفروق لا تُحسب من جديد)
+            writer = BatchWriter(db)
+            for entry in unsaved.values():
+                writer.replay(entry["writes"])
+            await writer.flush()
+            still_failed = writer.failed_players()
+            failed_writes += len(still_failed)
+            journal.mark_many('persisted', {pid: entry["record"] for pid, entry in unsaved.items() if pid not in still_failed})
+            logger.info(f"📒 إعادة حفظ نتائج {len(unsaved)} صياد (فشل {len(still_failed)})")
+
+        group_size = int(os.getenv("JUDGMENT_PERSIST_GROUP", "200")) if journal else len(verdicts) or 1
+        for start in range(0, len(verdicts), group_size):
+            group = []
+            writer = BatchWriter(db)
+            for verdict in verdicts[start:start + group_size]:
+                try:
+                    self.stage_verdict(verdict, writer)
+                    group.append(verdict)
+                except Exception as e:
+                    logger.error(f"❌ خطأ في تجهيز نتائج {verdict['player']['username']}: {e}")
+            saved = await writer.flush()
+            failed_writes += saved["failed"]
+            failed = writer.failed_players()
+            for verdict in group:
+                verdict["saved"] = verdict["player"]["id"] not in failed
+            if journal:
+                journal.mark_many('persisted', {v["player"]["id"]: self._verdict_record(v) for v in group if v["saved"]})
+                if failed:
+                    journal.mark_many('unsaved', {
+                        v["player"]["id"]: {"writes": failed[v["player"]["id"]], "record": self._verdict_record(v)}
+                        for v in group if not v["saved"]
+                    })
+        if journal and not computed:
+            journal.checkpoint('persisted')
+
+        # 3. الإشعارات (فقط لمن حُفظت نتيجته، ومع السجل: كل من حُفظ ولم يصل تقريره بعد)
+        if journal:
+            notified = journal.done('notified')
+            reports = [
+                self._verdict_from_record(record, judgment_date)
+                for pid, record in journal.done('persisted').items() if pid not in notified
+            ]
+        else:
+            reports = [v for v in verdicts if v.get("saved")]
 
-        for i, p in enumerate(players.data):
+        async def notify(verdict):
             try:
-                assigned_tasks = task_logic.get_daily_tasks_for_player(p)
-                if not assigned_tasks: continue
-
-                logs = await db.get_player_daily_logs(p['id'], today)
-                log_dict = {log['task_id']: log for log in logs}
-
-                category_xp = {}
-                total_xp_gained = 0
-                completed_count = 0
-                failed_categories = []
-                
-                for tid, info in assigned_tasks.items():
-                    log = log_dict.get(tid)
-                    # دمج العمل مع المال في التقرير
-                    raw_cat = info.get('category', 'general')
-                    cat = 'freedom' if raw_cat == 'work' else raw_cat
-                    
-                    if log:
-                        xp = log.get('xp_gained', 0)
-                        total_xp_gained += xp
-                        category_xp[cat] = category_xp.get(cat, 0) + xp
-                        if log.get('is_completed'):
-                            completed_count += 1
-                        else:
-                            failed_categories.append(cat)
-                    else:
-                        failed_categories.append(cat)
-                        category_xp[cat] = category_xp.get(cat, 0) + 0
-
-                failed_categories = list(set(failed_categories))
-                total_assigned = len(assigned_tasks)
-                progress_pct = (completed_count / total_assigned * 100) if total_assigned > 0 else 0
-                
-                thresholds = {"E": 40, "D": 50, "C": 65, "B": 80, "A": 100, "S": 100}
-                required_pct = thresholds.get(p['rank'], 40)
-                
-                buffs = await db.get_active_buffs(p['id'])
-                protection_buff = next((b for b in buffs if b['buff_type'] == 'streak_protection'), None)
-
-                judgment_msg = ""
-                penalty_applied = False
-                
-                if progress_pct >= required_pct:
-                    judgment_msg = "✅ **تم اجتياز اختبار اليوم بنجاح!**"
-                    await self.reward_player(p, total_xp_gained)
-                elif protection_buff:
-                    judgment_msg = "❄️ **تم تفعيل درع الحماية!** (الستريك لم ينكسر)"
-                    await self.consume_protection(p, protection_buff['id'], total_xp_gained)
-                else:
-                    judgment_msg = "💀 **لقد فشلت في تحقيق الانضباط المطلوب!**"
-                    penalty_applied = True
-                    await self.penalize_player(p, progress_pct, failed_categories)
-
-                # ✅ تحديث المستوى بعد الحساب النهائي
-                await db.recalculate_player_stats(p['id'])
-
-                # إرسال التقرير (تحديث الرسالة القديمة)
-                await self.send_daily_report(p, judgment_msg, category_xp, completed_count, total_assigned, progress_pct, penalty_applied)
-
-                if (i + 1) % 5 == 0: await asyncio.sleep(2)
-                else: await asyncio.sleep(0.7)
+                await self.send_daily_report(verdict)
+            except (discord.Forbidden, discord.NotFound):
+                # الخاص مغلق أو الحساب محذوف: لا فائدة من إعادة المحاولة
+                if journal: journal.mark('notified', verdict["player"]["id"], closed=True)
+                raise
+            if journal: journal.mark('notified', verdict["player"]["id"])
+
+        delivered = await self.report_pipeline.run(reports, notify, deadline=deadline)
+        if journal:
+            notified = journal.done('notified')
+            pending = [pid for pid in journal.done('persisted') if pid not in notified]
+            still_unsaved = [pid for pid in journal.done('unsaved') if pid not in journal.done('persisted')]
+            if pending or still_unsaved:
+                # تبقى الدورة مفتوحة ليستكملها judgment_resume
+                logger.warning(f"📒 دورة الحساب لم تُغلق: {len(pending)} تقرير لم يصل و{len(still_unsaved)} نتيجة لم تُحفظ")
+            else:
+                journal.complete()
 
-            except Exception as e:
-                logger.error(f"❌ خطأ في حساب نتائج {p['username']}: {e}")
+        summary = {
+            "date": today, "players": total_players, "judged": len(verdicts),
+            "resumed": resumed, "failed_writes": failed_writes, "reports": delivered,
+            "seconds": round((datetime.now() - started).total_seconds(), 1)
+        }
+        if datetime.now() > deadline:
+            logger.warning(f"⏰ تجاوزت ساعة الحساب الموعد النهائي: {summary}")
+        else:
+            logger.info(f"✅ اكتملت ساعة الحساب: {summary}")
+        return summary
+
+    def judge_player(self, player, judgment_date, progress, protection_buff):
+        """
+        مرحلة الحساب للاعب واحد (بدون أي I/O) فوق ملخص يومه DailyProgress
+        (None إذا لم يسجل أي مهمة)، تعيد None إذا لم تكن له مهام في هذا اليوم
+        """
+        assigned_tasks = task_logic.get_daily_tasks_for_player(player, judgment_date)
+        if not assigned_tasks: return None
+
+        progress = progress or DailyProgress(player['id'], judgment_date.isoformat())
+        result = progress.evaluate(assigned_tasks)
+        category_xp, failed_categories = result["category_xp"], result["failed_categories"]
+        completed_count, total_assigned, progress_pct = result["completed"], result["total"], result["progress_pct"]
+        
+        thresholds = {"E": 40, "D": 50, "C": 65, "B": 80, "A": 100, "S": 100}
+        required_pct = thresholds.get(player['rank'], 40)
 
-    async def send_daily_report(self, player, judgment, cat_xp, done, total, pct, failed):
-        """توليد وإرسال التقرير المرئي (تحديث الرسالة القديمة)"""
-        try:
-            user = await self.bot.fetch_user(int(player['discord_id']))
-            color = discord.Color.red() if failed else discord.Color.green()
-            
-            embed = discord.Embed(title="📊 التقرير الختامي لليوم", description=judgment, color=color)
-            
-            cat_emojis = {"strength": "💪", "intelligence": "🧠", "vitality": "❤️", "agility": "🤝", "perception": "🕌", "freedom": "💸"}
-            cat_names = {"strength": "القوة", "intelligence": "الذكاء", "vitality": "الصحة", "agility": "الاجتماعي", "perception": "الديني", "freedom": "المالي"}
-            
-            xp_details = ""
-            for cat, xp in cat_xp.items():
-                xp_details += f"{cat_emojis.get(cat, '✨')} {cat_names.get(cat, cat)}: `+{xp} XP` \n"
-            
-            embed.add_field(name="📈 تحليل النمو", value=xp_details or "لا يوجد بيانات", inline=False)
-            
-            bar = draw_progress_bar(done, total, length=15)
-            embed.add_field(name="🎯 معدل الإنجاز", value=f"{bar} **{int(pct)}%**\n({done} من أصل {total} مهام)", inline=False)
+        if progress_pct >= required_pct:
+            outcome = "passed"
+        elif protection_buff:
+            outcome = "protected"
+        else:
+            outcome = "failed"
 
-            if failed:
-                embed.set_footer(text="⚠️ انكسر الستريك الخاص بك وتم تطبيق العقوبة.")
-            else:
-                embed.set_footer(text=f"🔥 الستريك الحالي: {player.get('streak_days', 0) + 1} أيام")
+        return {
+            "player": player, "date": judgment_date, "outcome": outcome,
+            "category_xp": category_xp, "failed_categories": list(set(failed_categories)),
+            "completed": completed_count, "total": total_assigned, "progress_pct": progress_pct,
+            "protection_buff_id": protection_buff['id'] if protection_buff else None,
+        }
 
-            # ✅ محاولة تحديث الرسالة القديمة
-            msg_id = player.get('last_dashboard_msg_id')
-            if msg_id:
-                try:
-                    msg = await user.fetch_message(int(msg_id))
-                    # إزالة الـ View (الأزرار) لأن اليوم انتهى
-                    await msg.edit(embed=embed, view=None)
-                    return
-                except: pass # الرسالة حذفت، نرسل جديدة
+    def stage_verdict(self, verdict, writer):
+        """تسجيل نتيجة اللاعب في دفعة الكتابة وتجهيز رسالة الحكم للتقرير"""
+        p = verdict["player"]
+        if verdict["outcome"] == "passed":
+            verdict["judgment"] = "✅ **تم اجتياز اختبار اليوم بنجاح!**"
+            verdict["notice"] = self.reward_player(p, verdict["category_xp"], writer, verdict["date"])
+        elif verdict["outcome"] == "protected":
+            verdict["judgment"] = "❄️ **تم تفعيل درع الحماية!** (الستريك لم ينكسر)"
+            verdict["notice"] = self.consume_protection(p, verdict["protection_buff_id"], verdict["category_xp"], writer, verdict["date"])
+        else:
+            verdict["judgment"] = "💀 **لقد فشلت في تحقيق الانضباط المطلوب!**"
+            verdict["notice"] = self.penalize_player(p, verdict["progress_pct"], verdict["failed_categories"], writer)
+
+        # ✅ تحديث المستوى بعد الحساب النهائي (يُنفذ بعد حفظ الدفعة)
+        writer.recalculate(p['id'])
+
+    @staticmethod
+    def _verdict_record(verdict):
+        """نسخة مختصرة من النتيجة تُحفظ في السجل لإرسال التقرير بعد الاستكمال"""
+        p = verdict["player"]
+        record = {k: verdict[k] for k in ("outcome", "category_xp", "completed", "total", "progress_pct", "judgment", "notice")}
+        record["player"] = {k: p.get(k) for k in ("id", "discord_id", "username", "streak_days", "last_dashboard_msg_id")}
+        return record
+
+    @staticmethod
+    def _verdict_from_record(record, judgment_date):
+        return {**record, "date": judgment_date}
+
+    @staticmethod
+    def _aspect_xp_deltas(category_xp):
+        """تحويل خبرة المهام المكتسبة لكل جانب إلى فروق على أعمدة {cat}_xp"""
+        aspects = ["strength", "intelligence", "vitality", "agility", "perception", "freedom"]
+        return {f"{cat}_xp": xp for cat, xp in category_xp.items() if cat in aspects and xp}
+
+    async def send_daily_report(self, verdict):
+        """توليد وإرسال التقرير المرئي (تحديث رسالة لوحة اليوم بدل رسالة جديدة)"""
+        player = verdict["player"]
+        failed = verdict["outcome"] == "failed"
+        done, total, pct = verdict["completed"], verdict["total"], verdict["progress_pct"]
+
+        user = await self.resolve_user(player['discord_id'], self.report_pipeline)
+        color = discord.Color.red() if failed else discord.Color.green()
+        
+        embed = discord.Embed(title="📊 التقرير الختامي لليوم", description=verdict["judgment"], color=color)
+        embed.add_field(name="⚖️ الحكم", value=verdict["notice"], inline=False)
+        
+        cat_emojis = {"strength": "💪", "intelligence": "🧠", "vitality": "❤️", "agility": "🤝", "perception": "🕌", "freedom": "💸"}
+        cat_names = {"strength": "القوة", "intelligence": "الذكاء", "vitality": "الصحة", "agility": "الاجتماعي", "perception": "الديني", "freedom": "المالي"}
+        
+        xp_details = ""
+        for cat, xp in verdict["category_xp"].items():
+            xp_details += f"{cat_emojis.get(cat, '✨')} {cat_names.get(cat, cat)}: `+{xp} XP` \n"
+        
+        embed.add_field(name="📈 تحليل النمو", value=xp_details or "لا يوجد بيانات", inline=False)
+        
+        bar = draw_progress_bar(done, total, length=15)
+        embed.add_field(name="🎯 معدل الإنجاز", value=f"{bar} **{int(pct)}%**\n({done} من أصل {total} مهام)", inline=False)
 
-            await user.send(embed=embed)
-        except: pass
+        if failed:
+            embed.set_footer(text="⚠️ انكسر الستريك الخاص بك وتم تطبيق العقوبة.")
+        else:
+            embed.set_footer(text=f"🔥 الستريك الحالي: {player.get('streak_days', 0) + 1} أيام")
 
-    async def penalize_player(self, player, progress_pct, failed_categories):
-        """تطبيق العقوبة النسبية والديناميكية"""
+        # ✅ محاولة تحديث الرسالة القديمة (رسالة جزئية: طلب تعديل واحد بدون جلب الرسالة أولاً)
+        msg_id = player.get('last_dashboard_msg_id')
+        if msg_id:
+            try:
+                channel = user.dm_channel
+                # إزالة الـ View (الأزرار) لأن اليوم انتهى
+                await channel.get_partial_message(int(msg_id)).edit(embed=embed, view=None)
+                return
+            except discord.NotFound:
+                # الرسالة حذفت، نرسل جديدة (طلب ثانٍ لهذا اللاعب)
+                await self.report_pipeline.pace()
+
+        await user.send(embed=embed)
+
+    def penalize_player(self, player, progress_pct, failed_categories, writer):
+        """تطبيق العقوبة النسبية والديناميكية، وتعيد نص الحكم"""
         penalty_type = random.choice(["xp_loss", "coins_loss", "real_money"])
         base_penalty = player.get('base_penalty', 100)
         severity_multiplier = (1 - (progress_pct / 100)) 
         
         update_data = {"streak_days": 0}
+        deltas = {}
         category_arabic = {"strength": "القوة", "intelligence": "الذكاء", "vitality": "الصحة", "agility": "الاجتماعي", "perception": "الديني", "freedom": "المالي"}
 
         msg_detail = ""
 
         if penalty_type == "xp_loss":
             loss = int(250 * severity_multiplier)
-            update_data["total_xp"] = max(0, player['total_xp'] - loss)
+            deltas["total_xp"] = -loss
             
             if failed_categories:
                 loss_per_cat = loss // len(failed_categories)
                 for cat in failed_categories:
-                    col = f"{cat}_xp"
-                    update_data[col] = max(0, player.get(col, 0) - loss_per_cat)
+                    deltas[f"{cat}_xp"] = -loss_per_cat
                 
                 cats_txt = ", ".join([category_arabic.get(c, c) for c in failed_categories])
                 msg_detail = f"تم خصم الـ XP من: ({cats_txt})."
@@ -578,7 +942,7 @@ class QuestEngine(commands.Cog):
             
         elif penalty_type == "coins_loss":
             loss = int(base_penalty * severity_multiplier)
-            update_data["coins"] = max(0, player['coins'] - loss)
+            deltas["coins"] = -loss
             msg = f"💸 **غرامة تقصير:** انكسر الستريك! وتم خصم {loss} عملة ذهبية."
             
         else: # real_money
@@ -586,41 +950,38 @@ class QuestEngine(commands.Cog):
             # ✅ استخدام العملة الديناميكية
             currency = player.get('currency', 'USD')
             
-            await db._execute_async(lambda: db.client.table('penalties').insert({
+            writer.add_penalty({
                 "player_id": player['id'], "penalty_type": "real_donation",
                 "amount": amount, "currency": currency, "status": "pending", 
                 "description": "عقوبة فشل المهام اليومية"
-            }).execute())
+            })
             msg = f"🚨 **عقوبة واقعية:** انكسر الستريك! ويجب عليك التبرع بـ {amount} {currency} لجهة خيرية."
 
-        await db.update_player(player['discord_id'], update_data)
-        try:
-            user = await self.bot.fetch_user(int(player['discord_id']))
-            await user.send(f"💀 **ساعة الحساب:**\n{msg}")
-        except: pass
+        writer.update_player(player['id'], update_data)
+        if deltas:
+            writer.increment_player(player['id'], deltas, floor=0)
+        return msg
 
-    async def reward_player(self, player, xp):
+    def reward_player(self, player, category_xp, writer, judgment_date):
+        xp = sum(category_xp.values())
         new_streak = player.get('streak_days', 0) + 1
-        await db.update_player(player['discord_id'], {
-            "total_xp": player['total_xp'] + xp,
-            "streak_days": new_streak,
-            "last_streak_date": datetime.now().date().isoformat()
+        # الخبرة تضاف لأعمدة الجوانب حتى لا تمحوها إعادة حساب المستوى (المجموع = مجموع الجوانب)
+        writer.increment_player(player['id'], {
+            **self._aspect_xp_deltas(category_xp),
+            "total_xp": xp,
+            "streak_days": 1
         })
-        try:
-            user = await self.bot.fetch_user(int(player['discord_id']))
-            await user.send(f"🔥 **إنجاز رائع!** تم الحفاظ على الستريك: **{new_streak} يوم**.\nحصلت على +{xp} XP.")
-        except: pass
-
-    async def consume_protection(self, player, buff_id, xp):
-        await db._execute_async(lambda: db.client.table('player_buffs').delete().eq('id', buff_id).execute())
-        await db.update_player(player['discord_id'], {
-            "total_xp": player['total_xp'] + xp,
-            "last_streak_date": datetime.now().date().isoformat()
+        writer.update_player(player['id'], {"last_streak_date": judgment_date.isoformat()})
+        return f"🔥 **إنجاز رائع!** تم الحفاظ على الستريك: **{new_streak} يوم**.\nحصلت على +{xp} XP."
+
+    def consume_protection(self, player, buff_id, category_xp, writer, judgment_date):
+        writer.delete_buff(buff_id, player['id'])
+        writer.increment_player(player['id'], {
+            **self._aspect_xp_deltas(category_xp),
+            "total_xp": sum(category_xp.values())
         })
-        try:
-            user = await self.bot.fetch_user(int(player['discord_id']))
-            await user.send(f"❄️ **تم تفعيل حماية الستريك!**\nلقد قصرت في مهامك اليوم، ولكن 'تذكرة تخطي يوم' أنقذت الستريك.")
-        except: pass
+        writer.update_player(player['id'], {"last_streak_date": judgment_date.isoformat()})
+        return "❄️ **تم تفعيل حماية الستريك!**\nلقد قصرت في مهامك اليوم، ولكن 'تذكرة تخطي يوم' أنقذت الستريك."
 
     # ============ أوامر التحكم اليدوي ============
     
@@ -631,7 +992,8 @@ class QuestEngine(commands.Cog):
             return
         await interaction.response.defer(ephemeral=True)
         await interaction.followup.send("🔄 جاري تشغيل محرك التوزيع اليدوي...")
-        await self.launch_daily_quests()
+        with background_lane():
+            await self.launch_daily_quests()
         await interaction.followup.send("✅ تم التوزيع.")
 
     @app_commands.command(name="force_judgment", description="[Admin] إجبار النظام على تنفيذ ساعة الحساب الآن")
@@ -640,9 +1002,23 @@ class QuestEngine(commands.Cog):
             await interaction.response.send_message("⛔ هذا الأمر للمطورين فقط.", ephemeral=True)
             return
         await interaction.response.defer(ephemeral=True)
+        # نفس سجل اليوم: التقارير المؤجلة تُستكمل تلقائياً ولا يُحاسب أحد مرتين
+        today = datetime.now().date()
+        journal = self.get_journal('judgment', today.isoformat())
+        if journal.completed:
+            await interaction.followup.send("✅ ساعة الحساب لهذا اليوم اكتملت بالفعل.")
+            return
         await interaction.followup.send("⚖️ جاري بدء ساعة الحساب يدوياً...")
-        await self.apply_daily_judgment()
-        await interaction.followup.send("✅ تم الحساب.")
+        await db.set_system_config('last_judgment_run', today.isoformat())
+        with background_lane():
+            async with self._judgment_lock:
+                summary = await self.apply_daily_judgment(judgment_date=today, journal=journal)
+        await interaction.followup.send(
+            f"✅ تم الحساب: {summary['judged']} صياد في {summary['seconds']} ث "
+            f"(تقارير مرسلة: {summary['reports']['sent']}، فشل الحفظ: {summary['failed_writes']})."
+        )
 
 async def setup(bot):
-    await bot.add_cog(QuestEngine(bot))
\ No newline at end of file
+    await bot.add_cog(QuestEngine(bot))
+    # موجه لوحات المهام (بدل تسجيل لوحة لكل لاعب عند التشغيل)
+    bot.add_dynamic_items(DashboardSelect)
\ No newline at end of file
@@ -0,0 +1,120 @@
+# scheduler.py
+import asyncio
+import logging
+from datetime import datetime, timedelta, time
+
+from db_executor import background_lane
+
+logger = logging.getLogger(__name__)
+
+
+def next_daily_run(now: datetime, at: time, done_on=None, until: time = None) -> datetime:
+    """
+    الموعد القادم لمهمة يومية عند الساعة at:
+    اليوم إن لم تُنفذ بعد (أو الآن إذا فات موعدها وما زالت نافذتها until مفتوحة)، وإلا غداً
+    """
+    today = now.date()
+    if done_on != today and (until is None or now.time() < until):
+        return max(now, datetime.combine(today, at))
+    return datetime.combine(today + timedelta(days=1), at)
+
+
+class Job:
+    def __init__(self, name, due, run):
+        self.name = name
+        self.due = due    # due(now) -> datetime أو None (لا يوجد موعد حالياً)، بدون أي استعلام
+        self.run = run    # كوروتين التنفيذ
+        self.retry_at = None
+
+
+class Scheduler:
+    """
+    منفذ مهام حسب المواعيد بدل الفحص كل دقيقة:
+    يحسب موعد كل مهمة من الحالة في الذاكرة وينام حتى أقربها، فالدقائق الخاملة لا تكلف أي استعلام.
+    wake() يوقظه لإعادة التخطيط فوراً (تغيير إعداد، بوابة جديدة...).
+    المهمة التي تفشل (أو يبقى موعدها مستحقاً بعد تنفيذها) تُعاد بعد retry_delay ثانية.
+    كل المهام تعمل على مسار الخلفية المحدود لقاعدة البيانات.
+    """
+
+    def __init__(self, name: str, max_sleep: float = 900.0, retry_delay: float = 60.0):
+        self.name = name
+        # حد أعلى للنوم حتى لا تنحرف المواعيد عن ساعة الحائط (تغيير التوقيت مثلاً)
+        self.max_sleep = max_sleep
+        self.retry_delay = retry_delay
+        self.jobs = {}
+        self._wake = None
+        self._task = None
+
+    def add(self, name: str, due, run):
+        self.jobs[name] = Job(name, due, run)
+        self.wake()
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self, wait_for=None):
+        self._task = asyncio.create_task(self._loop(wait_for))
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def _due(self, job, now):
+        if job.retry_at is not None:
+            if job.retry_at > now:
+                return job.retry_at
+            job.retry_at = None
+        return job.due(now)
+
+    def next_runs(self, now: datetime = None) -> dict:
+        """{اسم المهمة: موعدها القادم} للمراقبة"""
+        now = now or datetime.now()
+        return {name: self._due(job, now) for name, job in self.jobs.items()}
+
+    async def _loop(self, wait_for):
+        self._wake = asyncio.Event()
+        if wait_for:
+            await wait_for()
+
+        while True:
+            # أي wake() بعد هذه النقطة يوقظ النوم التالي فوراً
+            self._wake.clear()
+            now = datetime.now()
+            planned = [(self._due(job, now), job) for job in list(self.jobs.values())]
+            planned = [(when, job) for when, job in planned if when is not None]
+
+            ready = [(when, job) for when, job in planned if when <= now]
+            if ready:
+                for when, job in ready:
+                    await self._run(job, when)
+                continue
+
+            delay = self.max_sleep
+            if planned:
+                when, job = min(planned, key=lambda item: item[0])
+                delay = min(delay, max(0.0, (when - now).total_seconds()))
+                logger.debug(f"⏭️ [{self.name}] المهمة التالية {job.name} عند {when:%Y-%m-%d %H:%M:%S}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job, planned_at):
+        lag = (datetime.now() - planned_at).total_seconds()
+        logger.info(f"⏰ [{self.name}] تنفيذ {job.name} (تأخير {lag:.1f} ث)")
+        try:
+            with background_lane():
+                await job.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ [{self.name}] فشل تنفيذ {job.name}: {e}")
+            job.retry_at = datetime.now() + timedelta(seconds=self.retry_delay)
+            return
+
+        # حماية من التكرار المستمر: المهمة التي لم تحدّث حالتها تنتظر قبل المحاولة التالية
+        now = datetime.now()
+        when = job.due(now)
+        if when is not None and when <= now:
+            job.retry_at = now + timedelta(seconds=self.retry_delay)
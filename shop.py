@@ -26,15 +26,9 @@ class ShopView(View):
 
     async def load_items(self):
         """جلب العناصر من قاعدة البيانات"""
-        # 1. جلب كل العناصر المتاحة
-        query = db.client.table('system_shop_items').select('*').eq('is_available', True)
-            
-        # 2. تطبيق فلتر النوع
-        if self.current_filter != "all":
-            query = query.eq('type', self.current_filter)
-            
-        response = await db._execute_async(lambda: query.execute())
-        all_items = response.data
+        # 1. جلب العناصر المتاحة مع فلتر النوع (فتح المتجر من عدة لاعبين معاً يرسل طلباً واحداً)
+        item_type = self.current_filter if self.current_filter != "all" else None
+        all_items = await db.get_shop_items(item_type)
 
         # 3. فلترة المخزون يدوياً (لأن Supabase لا يدعم OR بسهولة في التصفية المباشرة مع NULL)
         # نقبل العنصر إذا كان مخزونه (None = لا نهائي) أو (أكبر من 0)
@@ -182,11 +176,13 @@ class ShopView(View):
                 return
 
             try:
-                # 2. خصم الرصيد
-                new_balance = user_balance - cost
-                update_field = {'coins': new_balance} if currency == 'coins' else {'gems': new_balance}
-                
-                await db.update_player(str(self.user_id), update_field)
+                # 2. خصم الرصيد ذرياً (يُرفض الخصم إذا كان الرصيد الفعلي في السيرفر أقل من السعر)
+                balance_field = 'coins' if currency == 'coins' else 'gems'
+                updated = await db.increment_player(str(self.user_id), {balance_field: -cost}, floor=0, strict=True)
+                if not updated:
+                    await interaction.followup.send(f"❌ ليس لديك رصيد كافٍ! تحتاج {cost} {currency}.", ephemeral=True)
+                    return
+                new_balance = updated[balance_field]
                 
                 # 3. إضافة للمخزن (نستخدم self.player_uuid مباشرة) ✅
                 inventory_item = {
@@ -196,7 +192,7 @@ class ShopView(View):
                     "is_equipped": False
                 }
                 
-                await db._execute_async(lambda: db.client.table('player_inventory').insert(inventory_item).execute())
+                await db._execute_async(lambda: db.client.table('player_inventory').insert(inventory_item).execute(), table='player_inventory', op='insert')
                 
                 # 4. تحديث المخزون (Stock)
                 if item['stock'] is not None:
@@ -204,7 +200,8 @@ class ShopView(View):
                     await db._execute_async(
                         lambda: db.client.table('system_shop_items')
                         .update({'stock': new_stock})
-                        .eq('id', item['id']).execute()
+                        .eq('id', item['id']).execute(),
+                        table='system_shop_items', op='update'
                     )
                 
                 # تحديث الرصيد المحلي في الكلاس
@@ -0,0 +1,29 @@
+-- تحديث عدة لاعبين في طلب واحد (يستخدمه BatchWriter في ساعة الحساب)
+-- المدخل: مصفوفة JSON، كل عنصر فيها {"id": "<uuid>", "<column>": <value>, ...}
+-- كل صف يحدّث أعمدته فقط، والقيم تُحوَّل لأنواع الأعمدة عبر jsonb_populate_record
+create or replace function bulk_update_players(updates jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    item jsonb;
+    assignments text;
+    affected integer := 0;
+begin
+    for item in select value from jsonb_array_elements(updates) loop
+        select string_agg(format('%I = r.%I', k.key, k.key), ', ')
+          into assignments
+          from jsonb_object_keys(item) as k(key)
+         where k.key <> 'id';
+
+        continue when assignments is null;
+
+        execute format(
+            'update players as p set %s from jsonb_populate_record(null::players, $1) as r where p.id = r.id',
+            assignments
+        ) using item;
+        affected := affected + 1;
+    end loop;
+    return affected;
+end;
+$$;
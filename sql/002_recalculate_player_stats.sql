@@ -0,0 +1,82 @@
+-- إعادة حساب المستوى الكلي والرتبة داخل السيرفر في جملة UPDATE ... RETURNING واحدة
+-- (بدلاً من جلب صف اللاعب ثم إرسال تحديث منفصل من البوت)
+
+-- 1. جدول عتبات المستويات: أقل XP يحقق كل مستوى حسب calculate_level_progressive في questions.py
+--    القيم محسوبة مسبقاً من نفس المعادلة: level = int(120 * (1 - exp(-xp / 100000)))
+create table if not exists level_thresholds (
+    level  integer primary key,
+    min_xp bigint  not null
+);
+
+insert into level_thresholds (level, min_xp) values
+    (1, 0), (2, 1681), (3, 2532), (4, 3391), (5, 4256), (6, 5130),
+    (7, 6011), (8, 6900), (9, 7797), (10, 8702), (11, 9615), (12, 10537),
+    (13, 11467), (14, 12406), (15, 13354), (16, 14311), (17, 15277), (18, 16252),
+    (19, 17238), (20, 18233), (21, 19238), (22, 20253), (23, 21279), (24, 22315),
+    (25, 23362), (26, 24420), (27, 25490), (28, 26571), (29, 27664), (30, 28769),
+    (31, 29886), (32, 31016), (33, 32159), (34, 33315), (35, 34485), (36, 35668),
+    (37, 36866), (38, 38078), (39, 39305), (40, 40547), (41, 41805), (42, 43079),
+    (43, 44369), (44, 45676), (45, 47001), (46, 48343), (47, 49704), (48, 51083),
+    (49, 52482), (50, 53900), (51, 55339), (52, 56799), (53, 58280), (54, 59784),
+    (55, 61311), (56, 62861), (57, 64436), (58, 66036), (59, 67662), (60, 69315),
+    (61, 70996), (62, 72705), (63, 74445), (64, 76215), (65, 78016), (66, 79851),
+    (67, 81720), (68, 83625), (69, 85567), (70, 87547), (71, 89568), (72, 91630),
+    (73, 93735), (74, 95886), (75, 98083), (76, 100331), (77, 102630), (78, 104983),
+    (79, 107392), (80, 109862), (81, 112394), (82, 114991), (83, 117658), (84, 120398),
+    (85, 123215), (86, 126114), (87, 129099), (88, 132176), (89, 135351), (90, 138630),
+    (91, 142020), (92, 145529), (93, 149166), (94, 152940), (95, 156862), (96, 160944),
+    (97, 165200), (98, 169645), (99, 174297), (100, 179176), (101, 184306), (102, 189712),
+    (103, 195428), (104, 201491), (105, 207945), (106, 214844), (107, 222255), (108, 230259),
+    (109, 238960), (110, 248491), (111, 259027), (112, 270806), (113, 284159), (114, 299574),
+    (115, 317806), (116, 340120), (117, 368888), (118, 409435), (119, 478750), (120, 3742995)
+on conflict (level) do update set min_xp = excluded.min_xp;
+
+-- 2. سلم الرتب (المكان الوحيد الذي تُحدد فيه الرتبة من المستوى)
+create or replace function player_rank_for_level(p_level integer)
+returns text
+language sql
+immutable
+as $$
+    select case
+        when p_level >= 100 then 'SS'
+        when p_level >= 80  then 'S'
+        when p_level >= 60  then 'A'
+        when p_level >= 40  then 'B'
+        when p_level >= 20  then 'C'
+        when p_level >= 10  then 'D'
+        else 'E'
+    end;
+$$;
+
+-- 3. النسخة المجمعة: مجموع خبرة الجوانب الستة ← المستوى من جدول العتبات ← الرتبة
+create or replace function recalculate_players_stats(p_player_ids uuid[])
+returns table (id uuid, total_level integer, total_xp bigint, rank text)
+language sql
+as $$
+    update players as p
+       set total_xp    = s.total_xp,
+           total_level = s.total_level,
+           rank        = player_rank_for_level(s.total_level)
+      from (
+            select x.id,
+                   x.total_xp,
+                   coalesce((select max(t.level) from level_thresholds t where t.min_xp <= x.total_xp), 1) as total_level
+              from (
+                    select pl.id,
+                           coalesce(pl.strength_xp, 0) + coalesce(pl.intelligence_xp, 0) + coalesce(pl.vitality_xp, 0)
+                         + coalesce(pl.agility_xp, 0) + coalesce(pl.perception_xp, 0) + coalesce(pl.freedom_xp, 0) as total_xp
+                      from players pl
+                     where pl.id = any(p_player_ids)
+                   ) x
+           ) s
+     where p.id = s.id
+ returning p.id, p.total_level::integer, p.total_xp::bigint, p.rank::text;
+$$;
+
+-- 4. نسخة اللاعب الواحد (تستدعى بعد كل تسجيل مهمة)
+create or replace function recalculate_player_stats(p_player_id uuid)
+returns table (id uuid, total_level integer, total_xp bigint, rank text)
+language sql
+as $$
+    select * from recalculate_players_stats(array[p_player_id]);
+$$;
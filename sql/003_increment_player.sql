@@ -0,0 +1,79 @@
+-- إضافة/خصم قيم على عدادات اللاعبين (عملات، جواهر، خبرة، عدادات البوابات...) ذرياً داخل السيرفر
+-- كل عمود يصبح: عمود + الفرق، بدون قراءة الصف في البوت أولاً (لا يضيع تحديث لو تزامنت عمليتان)
+-- المدخل: مصفوفة JSON، كل عنصر فيها:
+--   {"key": "<id أو discord_id>", "deltas": {"coins": -50, ...},
+--    "floor": {"coins": 0}, "cap": {"current_energy": 100}, "strict": false}
+--   floor: أقل قيمة مسموحة (تُقص القيمة عندها)، cap: أعلى قيمة مسموحة
+--   strict = true: بدل القص يُرفض تحديث الصف كاملاً إذا نزل أي عمود تحت floor (مثل الشراء بدون رصيد كافٍ)
+-- المخرج: صفوف اللاعبين بعد التحديث (الصفوف المرفوضة أو غير الموجودة لا تعود)
+create or replace function increment_players(p_rows jsonb, p_key text default 'id')
+returns setof players
+language plpgsql
+as $$
+declare
+    item       jsonb;
+    col        text;
+    expr       text;
+    set_parts  text[];
+    guards     text[];
+    is_strict  boolean;
+begin
+    if p_key not in ('id', 'discord_id') then
+        raise exception 'increment_players: unsupported key column %', p_key;
+    end if;
+
+    for item in select value from jsonb_array_elements(p_rows) loop
+        set_parts := '{}';
+        guards    := '{}';
+        is_strict := coalesce((item ->> 'strict')::boolean, false);
+
+        for col in select jsonb_object_keys(item -> 'deltas') loop
+            expr := format('coalesce(%I, 0) + ($1 -> ''deltas'' ->> %L)::numeric', col, col);
+
+            if coalesce(item -> 'cap' ? col, false) then
+                expr := format('least(%s, ($1 -> ''cap'' ->> %L)::numeric)', expr, col);
+            end if;
+
+            if coalesce(item -> 'floor' ? col, false) then
+                if is_strict then
+                    guards := guards || format('%s >= ($1 -> ''floor'' ->> %L)::numeric', expr, col);
+                else
+                    expr := format('greatest(%s, ($1 -> ''floor'' ->> %L)::numeric)', expr, col);
+                end if;
+            end if;
+
+            set_parts := set_parts || format('%I = %s', col, expr);
+        end loop;
+
+        continue when cardinality(set_parts) = 0;
+
+        return query execute format(
+            'update players set %s where %I = ($1 ->> ''key'')::%s%s returning *',
+            array_to_string(set_parts, ', '),
+            p_key,
+            case p_key when 'id' then 'uuid' else 'text' end,
+            case when cardinality(guards) > 0 then ' and ' || array_to_string(guards, ' and ') else '' end
+        ) using item;
+    end loop;
+end;
+$$;
+
+-- نسخة اللاعب الواحد بمعرف ديسكورد (تستخدمها أوامر البوت والمتجر والبوابات)
+create or replace function increment_player(
+    p_discord_id text,
+    p_deltas     jsonb,
+    p_floor      jsonb   default '{}',
+    p_cap        jsonb   default '{}',
+    p_strict     boolean default false
+)
+returns setof players
+language sql
+as $$
+    select * from increment_players(
+        jsonb_build_array(jsonb_build_object(
+            'key', p_discord_id, 'deltas', p_deltas,
+            'floor', p_floor, 'cap', p_cap, 'strict', p_strict
+        )),
+        'discord_id'
+    );
+$$;
@@ -0,0 +1,22 @@
+-- رقم إصدار لكل تعديل في system_config حتى يعرف البوت متى يعيد تحميل الإعدادات
+-- (محرك سوبابيس يفحص max(version) دورياً، ومحرك asyncpg يستقبل إشعار system_config_changed فوراً)
+alter table system_config add column if not exists version bigint not null default 0;
+
+create sequence if not exists system_config_version_seq;
+
+create or replace function bump_system_config_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.version := nextval('system_config_version_seq');
+    -- الإشعار يُرسل عند اكتمال المعاملة فقط، والمحتوى هو مفتاح الإعداد المعدل
+    perform pg_notify('system_config_changed', new.key);
+    return new;
+end;
+$$;
+
+drop trigger if exists system_config_version on system_config;
+create trigger system_config_version
+before insert or update on system_config
+for each row execute function bump_system_config_version();
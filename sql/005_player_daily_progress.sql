@@ -0,0 +1,53 @@
+-- ملخص يوم كل لاعب (صف واحد بدل كل سجلات المهام) يتحدث تلقائياً مع كل سجل في player_daily_quests
+-- tasks: {task_id: {"xp": .., "done": ..}} وتقرأه ساعة الحساب ولوحة المهام بدل سجلات اليوم كاملة
+create table if not exists player_daily_progress (
+    player_id uuid not null references players(id) on delete cascade,
+    log_date date not null,
+    tasks jsonb not null default '{}'::jsonb,
+    completed_count integer not null default 0,
+    xp_total numeric not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (player_id, log_date)
+);
+
+create index if not exists player_daily_progress_date_idx on player_daily_progress (log_date, player_id);
+
+create or replace function track_daily_progress()
+returns trigger
+language plpgsql
+as $$
+declare
+    done boolean := coalesce(new.is_completed, false);
+    xp numeric := coalesce(new.xp_gained, 0);
+begin
+    -- إعادة تسجيل نفس المهمة تستبدل قيمتها القديمة في المجاميع
+    insert into player_daily_progress as p (player_id, log_date, tasks, completed_count, xp_total)
+    values (new.player_id, new.log_date,
+            jsonb_build_object(new.task_id, jsonb_build_object('xp', xp, 'done', done)),
+            done::int, xp)
+    on conflict (player_id, log_date) do update set
+        tasks = p.tasks || excluded.tasks,
+        completed_count = p.completed_count
+            - coalesce((p.tasks -> new.task_id ->> 'done')::boolean::int, 0) + excluded.completed_count,
+        xp_total = p.xp_total
+            - coalesce((p.tasks -> new.task_id ->> 'xp')::numeric, 0) + excluded.xp_total,
+        updated_at = now();
+    return new;
+end;
+$$;
+
+drop trigger if exists track_daily_progress on player_daily_quests;
+create trigger track_daily_progress
+after insert or update on player_daily_quests
+for each row execute function track_daily_progress();
+
+-- ملخصات اليوم وأمس من السجلات الموجودة قبل إنشاء الـ trigger
+insert into player_daily_progress (player_id, log_date, tasks, completed_count, xp_total)
+select player_id, log_date,
+       jsonb_object_agg(task_id, jsonb_build_object('xp', coalesce(xp_gained, 0), 'done', coalesce(is_completed, false))),
+       count(*) filter (where is_completed),
+       coalesce(sum(xp_gained), 0)
+from player_daily_quests
+where log_date >= current_date - 1
+group by player_id, log_date
+on conflict (player_id, log_date) do nothing;
@@ -0,0 +1,13 @@
+-- مدرج مستويات اللاعبين النشطين (صف لكل مستوى كلي) في استعلام تجميعي واحد
+-- يستخدمه مولد البوابات بدل عدّ اللاعبين القادرين لكل مهمة على حدة
+create or replace function active_level_histogram()
+returns table (level integer, players bigint)
+language sql
+stable
+as $$
+    select total_level::integer, count(*)
+      from players
+     where status = 'active' and total_level is not null
+     group by total_level
+     order by total_level;
+$$;
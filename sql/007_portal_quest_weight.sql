@@ -0,0 +1,3 @@
+-- وزن ظهور كل مهمة بوابة في الاختيار العشوائي (1 = الافتراضي، 0 = لا تظهر عشوائياً، 2 = ضعف الفرصة)
+-- يُقرأ مع فهرس المهام في الذاكرة، وبعد تعديله نفذ أمر /reload_portal_quests
+alter table system_portal_quests add column if not exists spawn_weight real not null default 1;
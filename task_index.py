@@ -0,0 +1,145 @@
+# task_index.py
+from functools import lru_cache
+from types import MappingProxyType
+
+from tasks_library import ALL_TASKS
+
+# ترتيب الرتب للمقارنة (E هو الأضعف، SS هو الأقوى)
+RANKS_ORDER = ["E", "D", "C", "B", "A", "S", "SS"]
+FRIDAY = 4  # 0=الأثنين ... 4=الجمعة
+# عبادات خفيفة مسموحة حتى مع العذر الشرعي (جزء من معرف المهمة)
+EXCUSE_ALLOWED = ("adhkar", "istighfar", "charity", "bad_words")
+
+
+def _bits(mask):
+    """مواقع البتات المفعلة في القناع بالترتيب"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class TaskIndex:
+    """
+    فهرس مكتبة المهام يُبنى مرة واحدة عند الاستيراد.
+    كل شرط أهلية (الجنس، المجهود، الجدولة، الأيام، الهجري، الرتبة، أيام الإجازة) يصبح قناع بتات
+    (البت رقم i يمثل المهمة رقم i في المكتبة)، فخطة اللاعب تُحسب بعمليات AND قليلة
+    بدل المرور على كل مهمة. قواعد الرتبة معرفة في المكتبة نفسها:
+    - min_rank: أقل رتبة تظهر لها المهمة
+    - weekdays_by_rank: أيام المهمة لكل رتبة (الرتب غير المذكورة لا تظهر لها)
+    - ranks_by_gender: الرتب المسموحة لجنس معين
+    - targets_by_rank / target_default / senior_scaling: تدرج الهدف حسب الرتبة والعمر
+    """
+
+    def __init__(self, tasks: dict):
+        self.ids = list(tasks)
+        self.tasks = [MappingProxyType(tasks[tid]) for tid in self.ids]
+        self.all = (1 << len(self.ids)) - 1
+
+        self.no_gender = 0
+        self.by_gender = {}
+        self.work = 0            # تختفي في أيام الإجازة
+        self.off_day_only = 0    # تظهر في أيام الإجازة فقط
+        self.hard = 0            # مجهود متوسط أو عالٍ (تُحذف للمريض وصاحب العذر)
+        self.excuse_blocked = 0  # مهام دينية تُحذف مع العذر الشرعي
+        self.senior_friday = 0   # أسبوعية لكبار السن يوم الجمعة فقط
+        self.scaled = 0          # مهام يتغير هدفها حسب الرتبة أو العمر
+        self.dated = []          # (بت، معلومات) للمهام المقيدة بتاريخ ميلادي أو هجري
+        self.gender_rank_rules = []
+
+        min_rank_rules = []
+        weekday_rules = []
+        for i, (tid, info) in enumerate(tasks.items()):
+            bit = 1 << i
+            if "gender" in info:
+                self.by_gender[info["gender"]] = self.by_gender.get(info["gender"], 0) | bit
+            else:
+                self.no_gender |= bit
+            if info.get("is_work"): self.work |= bit
+            if info.get("is_off_day_only"): self.off_day_only |= bit
+            if info.get("exertion") in ("medium", "high"): self.hard |= bit
+            if info.get("is_religious") and not any(x in tid for x in EXCUSE_ALLOWED): self.excuse_blocked |= bit
+            if info.get("frequency_senior") == "weekly" and info.get("schedule_senior") == "friday":
+                self.senior_friday |= bit
+            if "targets_by_rank" in info or "expect_senior" in info: self.scaled |= bit
+            if any(k in info for k in ("schedule", "hijri_month", "hijri_day", "hijri_days", "exclude_months", "weekdays")):
+                self.dated.append((bit, info))
+            if "min_rank" in info: min_rank_rules.append((bit, RANKS_ORDER.index(info["min_rank"])))
+            if "weekdays_by_rank" in info: weekday_rules.append((bit, info["weekdays_by_rank"]))
+            if "ranks_by_gender" in info: self.gender_rank_rules.append((bit, info["ranks_by_gender"]))
+
+        # أقنعة الرتبة لكل (رتبة، يوم في الأسبوع)، والرتبة غير المعروفة لا تظهر لها مهام الرتب
+        rank_locked = sum(bit for bit, _ in min_rank_rules) | sum(bit for bit, _ in weekday_rules)
+        self.unknown_rank = self.all & ~rank_locked
+        self.rank_masks = {}
+        for idx, rank in enumerate(RANKS_ORDER):
+            for weekday in range(7):
+                blocked = sum(bit for bit, req in min_rank_rules if idx < req)
+                blocked |= sum(bit for bit, days in weekday_rules if weekday not in days.get(rank, ()))
+                self.rank_masks[(rank, weekday)] = self.all & ~blocked
+
+        self._variants = {}
+
+    @lru_cache(maxsize=8)
+    def date_mask(self, day_context: tuple) -> int:
+        """المهام المتاحة في يوم معين حسب الجدولة الميلادية والهجرية"""
+        today_num, day_of_month, hijri_day, hijri_month = day_context
+        blocked = 0
+        for bit, info in self.dated:
+            schedule = info.get("schedule")
+            if ((schedule == "friday" and today_num != FRIDAY)
+                    or (schedule == "first_of_month" and day_of_month != 1)
+                    or ("hijri_month" in info and info["hijri_month"] != hijri_month)
+                    or ("hijri_day" in info and info["hijri_day"] != hijri_day)
+                    or ("hijri_days" in info and hijri_day not in info["hijri_days"])
+                    or ("exclude_months" in info and hijri_month in info["exclude_months"])
+                    or ("weekdays" in info and today_num not in info["weekdays"])):
+                blocked |= bit
+        return self.all & ~blocked
+
+    def select(self, day_context, gender, age, rank, status, off_days) -> int:
+        """قناع مهام اللاعب في اليوم"""
+        today_num = day_context[0]
+        mask = self.date_mask(day_context) & self.rank_masks.get((rank, today_num), self.unknown_rank)
+        mask &= self.no_gender | self.by_gender.get(gender, 0)
+        for bit, allowed in self.gender_rank_rules:
+            if gender in allowed and rank not in allowed[gender]:
+                mask &= ~bit
+
+        # مهام العمل تختفي في الإجازة، والمهام الاجتماعية تظهر فيها فقط
+        mask &= ~(self.work if today_num in off_days else self.off_day_only)
+        if age == "senior" and today_num != FRIDAY:
+            mask &= ~self.senior_friday
+        if status == "sick":
+            mask &= ~self.hard
+        elif status == "excuse":
+            mask &= ~(self.hard | self.excuse_blocked)
+        return mask
+
+    def plan(self, day_context, gender, age, rank, status, off_days) -> MappingProxyType:
+        """خطة اليوم {task_id: معلومات المهمة} للقراءة فقط بنفس ترتيب المكتبة"""
+        mask = self.select(day_context, gender, age, rank, status, off_days)
+        plan = {}
+        for i in _bits(mask):
+            plan[self.ids[i]] = self.variant(i, rank, age) if self.scaled >> i & 1 else self.tasks[i]
+        return MappingProxyType(plan)
+
+    def variant(self, i: int, rank: str, age: str) -> MappingProxyType:
+        """نسخة المهمة بعد تطبيق تدرج الهدف (مشتركة بين كل اللاعبين بنفس الرتبة والعمر)"""
+        key = (i, rank, age)
+        if key not in self._variants:
+            info = dict(self.tasks[i])
+            # تعديل التوقع لكبار السن (مثلاً غسيل الأسنان مرة واحدة)
+            if age == "senior" and "expect_senior" in info:
+                info["target_label"] = info["expect_senior"]
+            if "targets_by_rank" in info:
+                target = info["targets_by_rank"].get(rank, info.get("target_default"))
+                scaling = info.get("senior_scaling")
+                if age == "senior" and scaling:
+                    target = max(scaling["min"], target // scaling["divisor"])
+                info["targets"] = {"young": target, "senior": target}
+            self._variants[key] = MappingProxyType(info)
+        return self._variants[key]
+
+
+TASK_INDEX = TaskIndex(ALL_TASKS)
@@ -145,6 +145,11 @@ STRENGTH_TASKS = {
         "exertion": "high",
         "gender": "male",
         "min_rank": "C", # تظهر من رتبة C فما فوق
+        # أيام التدريب حسب الرتبة: العليا كل الأيام عدا الجمعة، و B/C السبت والإثنين والأربعاء
+        "weekdays_by_rank": {
+            "SS": [0, 1, 2, 3, 5, 6], "S": [0, 1, 2, 3, 5, 6], "A": [0, 1, 2, 3, 5, 6],
+            "B": [5, 0, 2], "C": [5, 0, 2]
+        },
         "xp_reward": 150
     },
     "str_home_workout": {
@@ -154,6 +159,7 @@ STRENGTH_TASKS = {
         "category": "strength",
         "exertion": "medium",
         # تظهر للنساء دائماً، وللرجال في الرتب الضعيفة E و D
+        "ranks_by_gender": {"male": ["E", "D"]},
         "xp_reward": 80
     },
     "str_walking": {
@@ -178,6 +184,8 @@ INTELLIGENCE_TASKS = {
         "targets_by_rank": {
             "E": 15, "D": 20, "C": 30, "B": 45, "A": 60, "S": 90, "SS": 120
         },
+        "target_default": 15,
+        "senior_scaling": {"divisor": 2, "min": 10}, # تخفيف لكبار السن (النصف وبحد أدنى 10 دقائق)
         "xp_reward": 80
     },
     "int_anki_summary": {
@@ -418,6 +426,7 @@ PERCEPTION_TASKS = {
         "category": "perception",
         "is_religious": True, # تخطي في العذر (أو يمكن إبقاؤه للقراءة من الهاتف)
         "targets_by_rank": {"E": 2, "D": 4, "C": 10, "B": 20, "A": 30, "S": 60},
+        "target_default": 2,
         "xp_reward": 90
     },
     "rel_istighfar": {